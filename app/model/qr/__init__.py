@@ -3,12 +3,15 @@ QR Code Detection Module
 """
 from .qr_processor import QRProcessor
 from .qr_detection_service import QRDetectionService, QRDetectionResult, ROIRegion
+from .qr_engine import QREngine, ROIStats
 
 __all__ = [
     'QRProcessor',
     'QRDetectionService',
     'QRDetectionResult',
-    'ROIRegion'
+    'ROIRegion',
+    'QREngine',
+    'ROIStats'
 ]
 
 
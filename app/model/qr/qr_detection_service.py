@@ -4,16 +4,24 @@ Hỗ trợ nhiều vùng ROI và nhiều lần xử lý
 """
 import cv2
 import numpy as np
-from typing import List, Optional, Dict, Any, Tuple
-from dataclasses import dataclass
+from typing import List, Optional, Dict, Any, Sequence, Tuple
+from dataclasses import dataclass, replace
 import logging
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from .qr_processor import QRProcessor
+from .qr_engine import QREngine, ROIStats, DEFAULT_DETECTORS
 
 logger = logging.getLogger(__name__)
 
+# Số bộ (list ROI, kích thước ảnh) giữ tọa độ ROI đã tính sẵn
+ROI_GEOMETRY_CACHE_SIZE = 8
+
 
 @dataclass
 class ROIRegion:
@@ -77,6 +85,8 @@ class QRDetectionService:
     - Detect QR codes trong nhiều ROI regions
     - Hỗ trợ nhiều lần xử lý với preprocessing khác nhau
     - Validation và visualization
+    Detection không ghi vào state của service (ROI truyền vào detect_qr_in_rois, roi_regions
+    chỉ được thay cả list) nên có thể gọi đồng thời từ nhiều thread
     """
     
     def __init__(self, config: Dict[str, Any]):
@@ -92,6 +102,20 @@ class QRDetectionService:
         # Detection settings
         detection_config = config.get('detection', {})
         self.max_attempts = detection_config.get('max_attempts', 3)
+        # Detector dùng lại theo thread (classic / aruco), các ROI decode song song trên pool
+        self.engine = QREngine(detection_config.get('detectors', DEFAULT_DETECTORS))
+        self.workers = max(1, int(detection_config.get('workers', min(4, os.cpu_count() or 1))))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Chạy song song các preprocessing method của một ROI (tối đa parallel_attempts_window method
+        # cùng lúc), kết quả vẫn là method ưu tiên cao nhất decode được
+        self.parallel_attempts = bool(detection_config.get('parallel_attempts', False))
+        self.parallel_attempts_window = max(1, int(detection_config.get('parallel_attempts_window', 2)))
+        self._attempt_executor: Optional[ThreadPoolExecutor] = None
+        # (width, height, nội dung các ROI) -> [(tên ROI, x, y, w, h)]
+        self._geometry_cache: Dict[Tuple[Any, ...], List[Tuple[str, int, int, int, int]]] = {}
+        # Thống kê theo tên ROI (lock dùng chung với cache tọa độ ROI)
+        self._roi_stats: Dict[str, ROIStats] = {}
+        self._lock = threading.Lock()
         
         # Validation settings
         validation_config = config.get('validation', {})
@@ -124,7 +148,8 @@ class QRDetectionService:
         if self.save_debug_images:
             os.makedirs(self.debug_image_path, exist_ok=True)
         
-        logger.info(f"QRDetectionService initialized: {len(self.roi_regions)} ROI regions, max_attempts={self.max_attempts}")
+        logger.info(f"QRDetectionService initialized: {len(self.roi_regions)} ROI regions, max_attempts={self.max_attempts}, "
+                    f"detectors={list(self.engine.detectors)}, workers={self.workers}")
     
     def _load_roi_regions(self) -> List[ROIRegion]:
         """Load ROI regions từ config"""
@@ -148,10 +173,23 @@ class QRDetectionService:
     
     def detect_qr_codes(self, image: np.ndarray) -> List[QRDetectionResult]:
         """
-        Detect QR codes trong image
+        Detect QR codes trong image (ROI regions từ config)
+        
+        Args:
+            image: Input image (BGR)
+        
+        Returns:
+            List of QRDetectionResult
+        """
+        return self.detect_qr_in_rois(image, self.roi_regions)
+    
+    def detect_qr_in_rois(self, image: np.ndarray, rois: Sequence[ROIRegion]) -> List[QRDetectionResult]:
+        """
+        Detect QR codes trong các ROI cho trước (không đọc / ghi roi_regions của service)
         
         Args:
             image: Input image (BGR)
+            rois: ROI regions (ví dụ ROI của recipe đã dịch theo template match)
         
         Returns:
             List of QRDetectionResult
@@ -159,89 +197,184 @@ class QRDetectionService:
         if not self.enabled:
             return []
         
-        results = []
         image_height, image_width = image.shape[:2]
+        # ROI view (không copy): preprocessing không ghi vào ảnh nguồn
+        patches = [
+            (roi_name, image[roi_y:roi_y+roi_h, roi_x:roi_x+roi_w])
+            for roi_name, roi_x, roi_y, roi_w, roi_h in self._resolve_rois(rois, image_width, image_height)
+        ]
+        return self._detect_batch(patches)
+    
+    def detect_qr_in_patches(self, patches: List[Tuple[str, np.ndarray]]) -> List[QRDetectionResult]:
+        """
+        Detect QR codes trong các patch đã cắt sẵn (ví dụ ROI của recipe đã warp thẳng theo
+        tư thế panel); không dùng roi_regions của service
+        
+        Args:
+            patches: [(roi_name, patch image)]
+        
+        Returns:
+            List of QRDetectionResult (bbox / polygon theo tọa độ patch)
+        """
+        if not self.enabled:
+            return []
+        return self._detect_batch([(name, patch) for name, patch in patches
+                                   if patch is not None and patch.size > 0])
+    
+    def _resolve_rois(self, rois: Sequence[ROIRegion], image_width: int,
+                      image_height: int) -> List[Tuple[str, int, int, int, int]]:
+        """
+        Tọa độ tuyệt đối (tên, x, y, w, h) của các ROI enabled
+        Khóa cache theo nội dung ROI + kích thước ảnh: list ROI tạo mới mỗi frame (recipe) vẫn
+        dùng lại được, ROI sửa tại chỗ không trả về tọa độ cũ
+        """
+        key = (image_width, image_height,
+               tuple((roi_region.name, roi_region.enabled, roi_region.x, roi_region.y,
+                      roi_region.width, roi_region.height, roi_region.use_percentage)
+                     for roi_region in rois))
+        with self._lock:
+            cached = self._geometry_cache.get(key)
+            if cached is not None:
+                return cached
+            resolved = [(roi_region.name,) + roi_region.get_absolute_coords(image_width, image_height)
+                        for roi_region in rois if roi_region.enabled]
+            if len(self._geometry_cache) >= ROI_GEOMETRY_CACHE_SIZE:
+                self._geometry_cache.pop(next(iter(self._geometry_cache)))
+            self._geometry_cache[key] = resolved
+            return resolved
+    
+    def _detect_batch(self, patches: List[Tuple[str, np.ndarray]]) -> List[QRDetectionResult]:
+        """Decode các ROI (song song trên pool nếu nhiều ROI), kết quả theo thứ tự ROI"""
+        if len(patches) > 1 and self.workers > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr")
+            outcomes = list(self._executor.map(lambda item: self._detect_in_roi(item[1], item[0]), patches))
+        else:
+            outcomes = [self._detect_in_roi(patch, name) for name, patch in patches]
+        return [result for result in outcomes if result is not None]
+    
+    def _detect_in_roi(self, roi_image: np.ndarray, roi_name: str) -> Optional[QRDetectionResult]:
+        """Thử lần lượt các preprocessing method trên ROI, trả về QR hợp lệ đầu tiên"""
+        start = time.perf_counter()
+        result = self._decode_roi(roi_image, roi_name)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            stats = self._roi_stats.get(roi_name)
+            if stats is None:
+                stats = self._roi_stats[roi_name] = ROIStats()
+            stats.record(elapsed_ms, result is not None)
+        return result
+    
+    def _decode_roi(self, roi_image: np.ndarray, roi_name: str) -> Optional[QRDetectionResult]:
+        attempts = range(min(self.max_attempts, self.processor.get_preprocessing_count()))
+        # Stage tiền xử lý đã tính của ROI này (dùng chung giữa các method, vd. ảnh gray)
+        cache: Dict[Any, np.ndarray] = {}
+        
+        if self.parallel_attempts and len(attempts) > 1:
+            result = self._decode_roi_parallel(roi_image, roi_name, attempts, cache)
+        else:
+            # Try detection with multiple preprocessing methods
+            result = None
+            for attempt in attempts:
+                result = self._decode_attempt(roi_image, roi_name, attempt, cache)
+                if result is not None:
+                    break
+        
+        # Log if no QR found in this ROI
+        if result is None and self.log_failures:
+            logger.warning(f"No QR code found in {roi_name} after {self.max_attempts} attempts")
+        return result
+    
+    def _decode_roi_parallel(self, roi_image: np.ndarray, roi_name: str, attempts: range,
+                             cache: Dict[Any, np.ndarray]) -> Optional[QRDetectionResult]:
+        """
+        Chạy trước các method tiếp theo trong khi chờ method ưu tiên hơn
+        - Kết quả xét theo thứ tự ưu tiên (như chạy tuần tự), không theo method xong trước
+        - Mỗi ROI chỉ có tối đa parallel_attempts_window method đang chạy / chờ trên pool,
+          method chưa chạy bị hủy khi đã có kết quả
+        """
+        if self._attempt_executor is None:
+            # Pool riêng: ROI đang decode trên pool ROI không chờ chính pool đó
+            self._attempt_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr-attempt")
+        pending = deque(attempts)
+        in_flight: deque = deque()
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < self.parallel_attempts_window:
+                    in_flight.append(self._attempt_executor.submit(
+                        self._decode_attempt, roi_image, roi_name, pending.popleft(), cache
+                    ))
+                result = in_flight.popleft().result()
+                if result is not None:
+                    return result
+            return None
+        finally:
+            for future in in_flight:
+                future.cancel()
+    
+    def _decode_attempt(self, roi_image: np.ndarray, roi_name: str, attempt: int,
+                        cache: Dict[Any, np.ndarray]) -> Optional[QRDetectionResult]:
+        """Một preprocessing method + decode, trả về QR hợp lệ đầu tiên"""
+        # Preprocess image
+        processed_image = self.processor.preprocess_image(roi_image, attempt, cache)
+        preprocessing_method = self.processor.get_preprocessing_name(attempt)
+        
+        # Detect QR codes (detector của thread hiện tại)
+        decoded_info, points = self.engine.decode(processed_image)
         
-        # Process each ROI region
-        for roi_region in self.roi_regions:
-            if not roi_region.enabled:
+        for i, data in enumerate(decoded_info):
+            if not data:  # Skip empty data
                 continue
             
-            # Get ROI coordinates
-            roi_x, roi_y, roi_w, roi_h = roi_region.get_absolute_coords(image_width, image_height)
+            # Validate
+            if not self._validate_qr_data(data):
+                if self.log_failures:
+                    logger.warning(f"QR validation failed in {roi_name}: {data}")
+                continue
             
-            # Extract ROI
-            roi_image = image[roi_y:roi_y+roi_h, roi_x:roi_x+roi_w].copy()
+            # Extract bounding box and polygon from points
+            if points is not None and len(points) > i:
+                point_set = points[i]
+                if point_set is not None and len(point_set) > 0:
+                    # Convert points to bbox
+                    xs = [p[0] for p in point_set]
+                    ys = [p[1] for p in point_set]
+                    bbox = (int(min(xs)), int(min(ys)), 
+                            int(max(xs) - min(xs)), int(max(ys) - min(ys)))
+                    
+                    # Polygon is the points themselves
+                    polygon = [(int(p[0]), int(p[1])) for p in point_set]
+                else:
+                    bbox = (0, 0, 0, 0)
+                    polygon = []
+            else:
+                bbox = (0, 0, 0, 0)
+                polygon = []
             
-            # Try detection with multiple preprocessing methods
-            for attempt in range(min(self.max_attempts, self.processor.get_preprocessing_count())):
-                # Preprocess image
-                processed_image = self.processor.preprocess_image(roi_image, attempt)
-                preprocessing_method = self.processor.get_preprocessing_name(attempt)
-                
-                # Detect QR codes using OpenCV
-                qr_detector = cv2.QRCodeDetector()
-                retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(processed_image)
-                
-                if retval and decoded_info:
-                    for i, data in enumerate(decoded_info):
-                        if not data:  # Skip empty data
-                            continue
-                        
-                        # Validate
-                        if not self._validate_qr_data(data):
-                            if self.log_failures:
-                                logger.warning(f"QR validation failed in {roi_region.name}: {data}")
-                            continue
-                        
-                        # Extract bounding box and polygon from points
-                        if points is not None and len(points) > i:
-                            point_set = points[i]
-                            if point_set is not None and len(point_set) > 0:
-                                # Convert points to bbox
-                                xs = [p[0] for p in point_set]
-                                ys = [p[1] for p in point_set]
-                                bbox = (int(min(xs)), int(min(ys)), 
-                                        int(max(xs) - min(xs)), int(max(ys) - min(ys)))
-                                
-                                # Polygon is the points themselves
-                                polygon = [(int(p[0]), int(p[1])) for p in point_set]
-                            else:
-                                bbox = (0, 0, 0, 0)
-                                polygon = []
-                        else:
-                            bbox = (0, 0, 0, 0)
-                            polygon = []
-                        
-                        # Create result
-                        result = QRDetectionResult(
-                            success=True,
-                            data=data,
-                            roi_name=roi_region.name,
-                            attempt=attempt,
-                            preprocessing_method=preprocessing_method,
-                            bbox=bbox,
-                            polygon=polygon,
-                            confidence=1.0  # OpenCV doesn't provide confidence
-                        )
-                        
-                        results.append(result)
-                        
-                        if self.log_results:
-                            logger.info(f"QR detected in {roi_region.name} (attempt {attempt}, method: {preprocessing_method}): {data}")
-                        
-                        # Found QR in this ROI, break attempt loop
-                        break
-                
-                # If found QR, break attempt loop
-                if results and results[-1].roi_name == roi_region.name:
-                    break
+            if self.log_results:
+                logger.info(f"QR detected in {roi_name} (attempt {attempt}, method: {preprocessing_method}): {data}")
             
-            # Log if no QR found in this ROI
-            if self.log_failures and (not results or results[-1].roi_name != roi_region.name):
-                logger.warning(f"No QR code found in {roi_region.name} after {self.max_attempts} attempts")
-        
-        return results
+            # Found QR in this ROI
+            return QRDetectionResult(
+                success=True,
+                data=data,
+                roi_name=roi_name,
+                attempt=attempt,
+                preprocessing_method=preprocessing_method,
+                bbox=bbox,
+                polygon=polygon,
+                confidence=1.0  # OpenCV doesn't provide confidence
+            )
+        return None
+    
+    def get_roi_stats(self) -> Dict[str, ROIStats]:
+        """Thống kê decode theo ROI (số lần, tỉ lệ thành công, thời gian trung bình / gần nhất)"""
+        with self._lock:
+            return {name: replace(stats) for name, stats in self._roi_stats.items()}
+    
+    def reset_roi_stats(self):
+        with self._lock:
+            self._roi_stats = {}
     
     def _validate_qr_data(self, data: str) -> bool:
         """Validate QR data"""
@@ -268,23 +401,27 @@ class QRDetectionService:
         
         return True
     
-    def draw_results(self, image: np.ndarray, results: List[QRDetectionResult]) -> np.ndarray:
+    def draw_results(self, image: np.ndarray, results: List[QRDetectionResult],
+                     rois: Optional[Sequence[ROIRegion]] = None) -> np.ndarray:
         """
         Draw detection results on image
         
         Args:
             image: Input image (BGR)
             results: Detection results
+            rois: ROI regions đã dùng để detect (None = roi_regions của service)
         
         Returns:
             Image with drawings
         """
         output = image.copy()
         image_height, image_width = output.shape[:2]
+        if rois is None:
+            rois = self.roi_regions
         
         # Draw ROI regions
         if self.draw_roi:
-            for roi_region in self.roi_regions:
+            for roi_region in rois:
                 if not roi_region.enabled:
                     continue
                 
@@ -300,7 +437,7 @@ class QRDetectionService:
         if self.draw_qr:
             for result in results:
                 # Find ROI region
-                roi_region = next((r for r in self.roi_regions if r.name == result.roi_name), None)
+                roi_region = next((r for r in rois if r.name == result.roi_name), None)
                 if roi_region is None:
                     continue
                 
@@ -355,13 +492,13 @@ class QRDetectionService:
     def update_roi_region(self, roi_name: str, x: int, y: int, width: int, height: int, 
                          use_percentage: bool = False):
         """Update ROI region coordinates"""
-        for roi_region in self.roi_regions:
+        for index, roi_region in enumerate(self.roi_regions):
             if roi_region.name == roi_name:
-                roi_region.x = x
-                roi_region.y = y
-                roi_region.width = width
-                roi_region.height = height
-                roi_region.use_percentage = use_percentage
+                # Thay cả list (copy-on-write): thread đang detect vẫn thấy ROI cũ nguyên vẹn
+                regions = list(self.roi_regions)
+                regions[index] = replace(roi_region, x=x, y=y, width=width, height=height,
+                                         use_percentage=use_percentage)
+                self.roi_regions = regions
                 logger.info(f"ROI region updated: {roi_name}")
                 return True
         
@@ -370,9 +507,11 @@ class QRDetectionService:
     
     def enable_roi_region(self, roi_name: str, enabled: bool = True):
         """Enable/disable ROI region"""
-        for roi_region in self.roi_regions:
+        for index, roi_region in enumerate(self.roi_regions):
             if roi_region.name == roi_name:
-                roi_region.enabled = enabled
+                regions = list(self.roi_regions)
+                regions[index] = replace(roi_region, enabled=enabled)
+                self.roi_regions = regions
                 logger.info(f"ROI region {roi_name}: {'enabled' if enabled else 'disabled'}")
                 return True
         
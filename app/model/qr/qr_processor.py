@@ -4,21 +4,40 @@ Hỗ trợ nhiều phương pháp tiền xử lý ảnh để cải thiện dete
 """
 import cv2
 import numpy as np
-from typing import Optional, Dict, Any
+from typing import Any, Dict, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Mỗi method được compile một lần thành chuỗi stage (tên, tham số...); các method dùng chung
+# tiền tố chỉ tính stage đó một lần cho mỗi ROI khi dùng chung cache. Stage giữ đúng xử lý của
+# từng method: ảnh màu được equalize (kênh Y) / sharpen / denoise trên ảnh màu như trước,
+# chỉ adaptive threshold chuyển gray
+Stage = Tuple[Any, ...]
+StageKey = Tuple[Stage, ...]
+
+
 class QRProcessor:
     """
     QR Processor - Xử lý tiền xử lý ảnh cho QR detection
     Hỗ trợ nhiều phương pháp preprocessing
+    - Config / kernel được đọc và compile một lần khi khởi tạo
+    - preprocess_image(..., cache) dùng lại stage đã tính của cùng ROI (memoization theo tiền tố)
     """
     
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.preprocessing_methods = self._load_preprocessing_methods()
+        
+        # Sharpening kernel
+        self._sharpen_kernel = np.array([
+            [-1, -1, -1],
+            [-1,  9, -1],
+            [-1, -1, -1]
+        ], dtype=np.float32)
+        
+        self._compiled: List[Optional[StageKey]] = [self._compile(method) for method in self.preprocessing_methods]
         logger.info(f"QRProcessor initialized with {len(self.preprocessing_methods)} preprocessing methods")
     
     def _load_preprocessing_methods(self):
@@ -35,111 +54,92 @@ class QRProcessor:
         
         return methods
     
-    def preprocess_image(self, image: np.ndarray, method_index: int = 0) -> np.ndarray:
+    def _compile(self, method: Dict[str, Any]) -> Optional[StageKey]:
+        """Method (config) -> chuỗi stage, None nếu method không hỗ trợ"""
+        method_name = method['name']
+        config = method['config']
+        
+        if method_name == 'none':
+            return ()
+        
+        if method_name == 'adaptive_threshold':
+            block_size = int(config.get('block_size', 11))
+            # Ensure block_size is odd
+            if block_size % 2 == 0:
+                block_size += 1
+            return (('gray',), ('adaptive', block_size, config.get('c', 2)))
+        
+        if method_name == 'histogram_equalization':
+            return (('equalize',),)
+        
+        if method_name == 'sharpen':
+            return (('sharpen',),)
+        
+        if method_name == 'denoise':
+            return (('denoise', float(config.get('h', 10))),)
+        
+        logger.warning(f"Unknown preprocessing method: {method_name}")
+        return None
+    
+    def preprocess_image(self, image: np.ndarray, method_index: int = 0,
+                         cache: Optional[Dict[StageKey, np.ndarray]] = None) -> np.ndarray:
         """
         Tiền xử lý ảnh theo method được chỉ định
         
         Args:
             image: Input image (BGR or Grayscale)
             method_index: Index của preprocessing method (0-based)
+            cache: Stage đã tính của cùng image (dict rỗng cho mỗi ROI, dùng chung giữa các method)
         
         Returns:
             Processed image
         """
-        if method_index >= len(self.preprocessing_methods):
+        if method_index >= len(self._compiled):
             logger.warning(f"Method index {method_index} out of range, using original image")
             return image
         
-        method = self.preprocessing_methods[method_index]
-        method_name = method['name']
-        method_config = method['config']
+        stages = self._compiled[method_index]
+        if not stages:
+            return image
         
         try:
-            if method_name == 'none':
-                return image
-            
-            elif method_name == 'adaptive_threshold':
-                return self._adaptive_threshold(image, method_config)
-            
-            elif method_name == 'histogram_equalization':
-                return self._histogram_equalization(image)
-            
-            elif method_name == 'sharpen':
-                return self._sharpen(image, method_config)
-            
-            elif method_name == 'denoise':
-                return self._denoise(image, method_config)
-            
-            else:
-                logger.warning(f"Unknown preprocessing method: {method_name}")
-                return image
+            result = image
+            for i, stage in enumerate(stages):
+                key = stages[:i + 1]
+                cached = cache.get(key) if cache is not None else None
+                if cached is None:
+                    cached = self._run_stage(stage, result)
+                    if cache is not None:
+                        cache[key] = cached
+                result = cached
+            return result
                 
         except Exception as e:
-            logger.error(f"Error in preprocessing method '{method_name}': {e}")
+            logger.error(f"Error in preprocessing method '{self.get_preprocessing_name(method_index)}': {e}")
             return image
     
-    def _adaptive_threshold(self, image: np.ndarray, config: Dict) -> np.ndarray:
-        """Adaptive thresholding"""
-        # Convert to grayscale if needed
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = image.copy()
-        
-        block_size = config.get('block_size', 11)
-        c = config.get('c', 2)
-        
-        # Ensure block_size is odd
-        if block_size % 2 == 0:
-            block_size += 1
-        
-        result = cv2.adaptiveThreshold(
-            gray,
-            255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY,
-            block_size,
-            c
-        )
-        
-        return result
-    
-    def _histogram_equalization(self, image: np.ndarray) -> np.ndarray:
-        """Histogram equalization"""
-        if len(image.shape) == 3:
-            # Convert to YUV, equalize Y channel, convert back
-            yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
-            yuv[:, :, 0] = cv2.equalizeHist(yuv[:, :, 0])
-            result = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
-        else:
-            result = cv2.equalizeHist(image)
-        
-        return result
-    
-    def _sharpen(self, image: np.ndarray, config: Dict) -> np.ndarray:
-        """Sharpen image"""
-        kernel_size = config.get('kernel_size', 3)
-        
-        # Sharpening kernel
-        kernel = np.array([
-            [-1, -1, -1],
-            [-1,  9, -1],
-            [-1, -1, -1]
-        ], dtype=np.float32)
-        
-        result = cv2.filter2D(image, -1, kernel)
-        return result
-    
-    def _denoise(self, image: np.ndarray, config: Dict) -> np.ndarray:
-        """Denoise image"""
-        h = config.get('h', 10)
-        
-        if len(image.shape) == 3:
-            result = cv2.fastNlMeansDenoisingColored(image, None, h, h, 7, 21)
-        else:
-            result = cv2.fastNlMeansDenoising(image, None, h, 7, 21)
-        
-        return result
+    def _run_stage(self, stage: Stage, src: np.ndarray) -> np.ndarray:
+        kind = stage[0]
+        if kind == 'gray':
+            return cv2.cvtColor(src, cv2.COLOR_BGR2GRAY) if src.ndim == 3 else src
+        if kind == 'adaptive':
+            return cv2.adaptiveThreshold(src, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                         stage[1], stage[2])
+        if kind == 'equalize':
+            if src.ndim == 3:
+                # Equalize kênh Y (YUV), giữ màu
+                yuv = cv2.cvtColor(src, cv2.COLOR_BGR2YUV)
+                yuv[:, :, 0] = cv2.equalizeHist(yuv[:, :, 0])
+                return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+            return cv2.equalizeHist(src)
+        if kind == 'sharpen':
+            return cv2.filter2D(src, -1, self._sharpen_kernel)
+        if kind == 'denoise':
+            h = stage[1]
+            if src.ndim == 3:
+                return cv2.fastNlMeansDenoisingColored(src, None, h, h, 7, 21)
+            return cv2.fastNlMeansDenoising(src, None, h, 7, 21)
+        raise ValueError(f"Unknown preprocessing stage: {kind}")
     
     def get_preprocessing_count(self) -> int:
         """Lấy số lượng preprocessing methods"""
@@ -150,9 +150,3 @@ class QRProcessor:
         if 0 <= index < len(self.preprocessing_methods):
             return self.preprocessing_methods[index]['name']
         return "unknown"
-
-
-
-
-
-
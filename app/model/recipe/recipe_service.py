@@ -4,15 +4,65 @@ Lưu trữ template image, template region, và QR ROI regions
 """
 import cv2
 import numpy as np
+import copy
+import glob
 import json
 import os
+from collections import OrderedDict
 from typing import Optional, List, Dict, Any, Tuple
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
 import logging
 
+from ..template.template_matching_service import PreparedTemplate
+from ..template.pose_estimation import PanelPose
+
 logger = logging.getLogger(__name__)
 
+# Số recipe giữ trong bộ nhớ (chuyển qua lại giữa các sản phẩm trên cùng line)
+RECIPE_CACHE_SIZE = 8
+
+
+# Sidecar template ROI: tên cố định, geometry của template region lưu kèm trong file (.npz)
+TEMPLATE_SIDECAR_SUFFIX = "_template"
+
+
+def _sidecar_path(image_path: str, suffix: str = "", ext: str = ".npy") -> str:
+    """File .npy (không nén, mmap được) đi kèm ảnh master"""
+    return f"{os.path.splitext(image_path)[0]}{suffix}{ext}"
+
+
+def _legacy_template_sidecars(image_path: str) -> List[str]:
+    """Sidecar template cũ có geometry trong tên file (_template_x_y_w_h.npy)"""
+    return glob.glob(glob.escape(os.path.splitext(image_path)[0]) + f"{TEMPLATE_SIDECAR_SUFFIX}_*.npy")
+
+
+def _sidecar_valid(sidecar_path: str, image_path: str) -> bool:
+    """Sidecar tồn tại và không cũ hơn ảnh PNG"""
+    try:
+        return os.path.getmtime(sidecar_path) >= os.path.getmtime(image_path)
+    except OSError:
+        return False
+
+
+def _save_sidecar(sidecar_path: str, array: np.ndarray, geometry: Optional[Tuple[int, ...]] = None):
+    """
+    Ghi sidecar qua file tạm (reader không bao giờ thấy file ghi dở)
+    geometry != None: ghi .npz gồm 'roi' + 'geometry' (kiểm tra lại khi load)
+    """
+    temp_path = f"{sidecar_path}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            if geometry is None:
+                np.save(f, np.ascontiguousarray(array))
+            else:
+                np.savez(f, roi=np.ascontiguousarray(array), geometry=np.asarray(geometry, dtype=np.int64))
+        os.replace(temp_path, sidecar_path)
+    except OSError as e:
+        logger.warning(f"Failed to write image cache {sidecar_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
 
 @dataclass
 class TemplateRegion:
@@ -54,20 +104,45 @@ class QRROIRegion:
         abs_y = template_y + self.relative_y
         return abs_x, abs_y, self.width, self.height
     
+    def get_pose_coords(self, template_x: int, template_y: int, pose: PanelPose) -> Tuple[int, int, int, int]:
+        """
+        Tọa độ trên frame theo tư thế panel (dx, dy, angle, scale từ các fiducial)
+        Args:
+            template_x, template_y: Vị trí template region trên ảnh master
+            pose: Tư thế panel (master -> frame)
+        Returns:
+            (x, y, w, h) hình chữ nhật bao ROI sau biến đổi
+        """
+        return pose.map_rect(template_x + self.relative_x, template_y + self.relative_y,
+                             self.width, self.height)
+    
+    def extract_patch(self, image: np.ndarray, template_x: int, template_y: int,
+                      pose: PanelPose) -> Optional[np.ndarray]:
+        """
+        Cắt ROI từ frame thành patch thẳng trục (warp riêng vùng ROI theo tư thế panel)
+        Args:
+            image: Frame
+            template_x, template_y: Vị trí template region trên ảnh master
+            pose: Tư thế panel (master -> frame)
+        Returns:
+            Patch width x height (view nếu panel không xoay), None nếu ROI ngoài frame
+        """
+        return pose.extract_rect(image, template_x + self.relative_x, template_y + self.relative_y,
+                                 self.width, self.height)
+    
     def transform_coords(self, dx: int, dy: int, angle: float = 0.0) -> Tuple[int, int, int, int]:
         """
-        Transform ROI coordinates theo offset và góc xoay
+        Transform ROI coordinates theo offset và góc xoay (quanh gốc template, tọa độ tương đối)
         Args:
             dx, dy: Độ lệch vị trí (pixel)
             angle: Góc xoay (độ)
         Returns:
-            (x, y, w, h) đã transform
+            (x, y, w, h) đã transform - hình chữ nhật bao ROI sau khi xoay
         """
-        # TODO: Implement rotation transform nếu cần
-        # Hiện tại chỉ áp dụng translation
-        new_x = self.relative_x + dx
-        new_y = self.relative_y + dy
-        return new_x, new_y, self.width, self.height
+        if angle == 0.0:
+            return self.relative_x + dx, self.relative_y + dy, self.width, self.height
+        pose = PanelPose(center_x=0.0, center_y=0.0, dx=dx, dy=dy, angle=angle)
+        return pose.map_rect(self.relative_x, self.relative_y, self.width, self.height)
 
 
 @dataclass
@@ -85,7 +160,7 @@ class Recipe:
     Recipe - Bản mẫu cho một loại panel
     Chứa:
     - Template image (ảnh master)
-    - Template region (vùng định vị)
+    - Template region (vùng định vị) + các fiducial phụ (ước lượng góc / scale)
     - QR ROI regions (các vùng QR, tọa độ tương đối)
     - Tolerance (ngưỡng sai lệch)
     """
@@ -96,28 +171,90 @@ class Recipe:
     template_region: TemplateRegion
     qr_roi_regions: List[QRROIRegion]
     tolerance: Tolerance
+    # Fiducial phụ (tọa độ trên ảnh master), cùng template_region cho tư thế đầy đủ
+    fiducial_regions: List[TemplateRegion] = field(default_factory=list)
     
     # Runtime data (không lưu vào file)
     _template_image: Optional[np.ndarray] = None
     _template_roi: Optional[np.ndarray] = None
+    _prepared_template: Optional[PreparedTemplate] = None
+    _prepared_fiducials: Optional[List[Tuple[PreparedTemplate, int, int]]] = None
+    
+    def _template_sidecar_path(self) -> str:
+        return _sidecar_path(self.template_image_path, TEMPLATE_SIDECAR_SUFFIX, ".npz")
+    
+    def _template_geometry(self) -> Tuple[int, int, int, int]:
+        region = self.template_region
+        return region.x, region.y, region.width, region.height
+    
+    def _load_template_sidecar(self, sidecar_path: str) -> Optional[np.ndarray]:
+        """Template ROI từ sidecar nếu sidecar mới hơn ảnh master và cùng geometry template region"""
+        if not _sidecar_valid(sidecar_path, self.template_image_path):
+            return None
+        try:
+            with np.load(sidecar_path) as data:
+                if tuple(int(v) for v in data['geometry']) != self._template_geometry():
+                    return None
+                return data['roi']
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring invalid template cache {sidecar_path}: {e}")
+            return None
+    
+    def copy(self) -> 'Recipe':
+        """
+        Bản sao độc lập phần cấu hình (region, ROI, tolerance) - sửa bản sao không ảnh hưởng
+        recipe trong cache; ảnh master, template ROI (chỉ đọc) và template đã chuẩn bị dùng chung
+        """
+        clone = copy.copy(self)
+        for name in ('template_region', 'qr_roi_regions', 'tolerance', 'fiducial_regions'):
+            setattr(clone, name, copy.deepcopy(getattr(self, name)))
+        if self._prepared_fiducials is not None:
+            clone._prepared_fiducials = list(self._prepared_fiducials)
+        return clone
     
     def load_template_image(self) -> bool:
-        """Load template image từ file"""
+        """
+        Load template image từ file
+        - Ảnh master: memory-map sidecar .npy (decode PNG một lần, tạo sidecar nếu chưa có / cũ)
+          -> mảng chỉ đọc, chỉ các trang được dùng mới được đọc từ đĩa
+        - Template ROI: đọc ngay vào bộ nhớ (dùng cho mọi frame)
+        """
         try:
             if not os.path.exists(self.template_image_path):
                 logger.error(f"Template image not found: {self.template_image_path}")
                 return False
             
-            self._template_image = cv2.imread(self.template_image_path)
+            master_sidecar = _sidecar_path(self.template_image_path)
+            template_sidecar = self._template_sidecar_path()
+            if _sidecar_valid(master_sidecar, self.template_image_path):
+                self._template_image = np.load(master_sidecar, mmap_mode='r')
+            else:
+                self._template_image = cv2.imread(self.template_image_path)
+                if self._template_image is not None:
+                    _save_sidecar(master_sidecar, self._template_image)
             if self._template_image is None:
                 logger.error(f"Failed to load template image: {self.template_image_path}")
                 return False
             
             # Extract template ROI
-            self._template_roi = self.template_region.get_roi(self._template_image)
+            self._template_roi = self._load_template_sidecar(template_sidecar)
+            if self._template_roi is None:
+                self._template_roi = self.template_region.get_roi(self._template_image)
+                if self._template_roi is not None:
+                    _save_sidecar(template_sidecar, self._template_roi, self._template_geometry())
+                    # Sidecar cũ (geometry trong tên file) không còn được dùng
+                    for legacy_path in _legacy_template_sidecars(self.template_image_path):
+                        try:
+                            os.remove(legacy_path)
+                        except OSError as e:
+                            logger.warning(f"Failed to remove old template cache {legacy_path}: {e}")
+            self._prepared_template = None
+            self._prepared_fiducials = None
             if self._template_roi is None:
                 logger.error("Failed to extract template ROI")
                 return False
+            # Dùng chung giữa các bản sao của recipe (cache): chỉ đọc
+            self._template_roi.setflags(write=False)
             
             logger.info(f"Template image loaded: {self.template_image_path}")
             return True
@@ -126,6 +263,14 @@ class Recipe:
             logger.error(f"Error loading template image: {e}")
             return False
     
+    def release_template_image(self):
+        """
+        Bỏ tham chiếu ảnh master (memory-map sidecar .npy); template ROI / template đã chuẩn bị
+        vẫn giữ trong bộ nhớ, get_template_image load lại khi cần
+        File chỉ được unmap khi mọi bản sao của recipe đều đã release (hoặc bị bỏ)
+        """
+        self._template_image = None
+    
     def get_template_image(self) -> Optional[np.ndarray]:
         """Get template image (load nếu chưa load)"""
         if self._template_image is None:
@@ -138,6 +283,33 @@ class Recipe:
             self.load_template_image()
         return self._template_roi
     
+    def get_prepared_template(self) -> Optional[PreparedTemplate]:
+        """Template ROI đã chuẩn bị cho template matching (gray, pyramid, bank xoay) - tạo một lần"""
+        if self._prepared_template is None:
+            template_roi = self.get_template_roi()
+            if template_roi is None:
+                return None
+            self._prepared_template = PreparedTemplate(template_roi)
+        return self._prepared_template
+    
+    def get_fiducials(self) -> List[Tuple[PreparedTemplate, int, int]]:
+        """
+        Các fiducial cho TemplateMatchingService.match_fiducials: template region trước, sau đó
+        các fiducial phụ (bỏ qua fiducial nằm ngoài ảnh master)
+        """
+        primary = self.get_prepared_template()
+        if primary is None:
+            return []
+        if self._prepared_fiducials is None:
+            self._prepared_fiducials = []
+            for region in self.fiducial_regions:
+                roi = region.get_roi(self.get_template_image())
+                if roi is None:
+                    logger.warning(f"Fiducial '{region.name}' is outside the master image, ignored")
+                    continue
+                self._prepared_fiducials.append((PreparedTemplate(roi), region.x, region.y))
+        return [(primary, self.template_region.x, self.template_region.y)] + self._prepared_fiducials
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary (để lưu JSON)"""
         return {
@@ -147,7 +319,8 @@ class Recipe:
             'template_image_path': self.template_image_path,
             'template_region': asdict(self.template_region),
             'qr_roi_regions': [asdict(roi) for roi in self.qr_roi_regions],
-            'tolerance': asdict(self.tolerance)
+            'tolerance': asdict(self.tolerance),
+            'fiducial_regions': [asdict(region) for region in self.fiducial_regions]
         }
     
     @staticmethod
@@ -156,6 +329,7 @@ class Recipe:
         template_region = TemplateRegion(**data['template_region'])
         qr_roi_regions = [QRROIRegion(**roi) for roi in data['qr_roi_regions']]
         tolerance = Tolerance(**data.get('tolerance', {}))
+        fiducial_regions = [TemplateRegion(**region) for region in data.get('fiducial_regions', [])]
         
         return Recipe(
             name=data['name'],
@@ -164,7 +338,8 @@ class Recipe:
             template_image_path=data['template_image_path'],
             template_region=template_region,
             qr_roi_regions=qr_roi_regions,
-            tolerance=tolerance
+            tolerance=tolerance,
+            fiducial_regions=fiducial_regions
         )
 
 
@@ -188,6 +363,10 @@ class RecipeService:
         # Current active recipe
         self.current_recipe: Optional[Recipe] = None
         
+        # LRU cache: đường dẫn config -> (mtime config, mtime ảnh master, Recipe)
+        # load_recipe trả về bản sao (Recipe.copy), Recipe trong cache không bị caller sửa
+        self._cache: "OrderedDict[str, Tuple[float, float, Recipe]]" = OrderedDict()
+        
         logger.info(f"RecipeService initialized: {self.recipe_dir}")
     
     def create_recipe(
@@ -197,7 +376,8 @@ class RecipeService:
         master_image: np.ndarray,
         template_region: TemplateRegion,
         qr_roi_regions: List[QRROIRegion],
-        tolerance: Optional[Tolerance] = None
+        tolerance: Optional[Tolerance] = None,
+        fiducial_regions: Optional[List[TemplateRegion]] = None
     ) -> Optional[Recipe]:
         """
         Tạo recipe mới từ ảnh master
@@ -209,6 +389,7 @@ class RecipeService:
             template_region: Vùng định vị
             qr_roi_regions: Các vùng QR
             tolerance: Ngưỡng sai lệch (None = dùng default)
+            fiducial_regions: Fiducial phụ để ước lượng góc / scale (None = chỉ template region)
         
         Returns:
             Recipe object hoặc None nếu lỗi
@@ -241,7 +422,8 @@ class RecipeService:
                 template_image_path=image_path,
                 template_region=template_region,
                 qr_roi_regions=qr_roi_regions,
-                tolerance=tolerance or Tolerance()
+                tolerance=tolerance or Tolerance(),
+                fiducial_regions=list(fiducial_regions or [])
             )
             
             # Load template image
@@ -261,16 +443,52 @@ class RecipeService:
             logger.error(f"Error creating recipe: {e}", exc_info=True)
             return None
     
+    def _config_path(self, recipe_name: str) -> str:
+        safe_name = recipe_name.replace(" ", "_").replace("/", "_")
+        return os.path.join(self.config_dir, f"{safe_name}.json")
+    
+    def _cache_get(self, config_path: str) -> Optional[Recipe]:
+        """Recipe trong cache nếu config JSON và ảnh master chưa đổi trên đĩa"""
+        entry = self._cache.get(config_path)
+        if entry is None:
+            return None
+        config_mtime, image_mtime, recipe = entry
+        try:
+            unchanged = (os.path.getmtime(config_path) == config_mtime and
+                         os.path.getmtime(recipe.template_image_path) == image_mtime)
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            del self._cache[config_path]
+            return None
+        self._cache.move_to_end(config_path)
+        return recipe
+    
+    def _cache_put(self, config_path: str, recipe: Recipe):
+        try:
+            entry = (os.path.getmtime(config_path), os.path.getmtime(recipe.template_image_path), recipe)
+        except OSError:
+            return
+        self._cache[config_path] = entry
+        self._cache.move_to_end(config_path)
+        while len(self._cache) > RECIPE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
+    def clear_cache(self):
+        """Bỏ các recipe đã cache (file recipe bị sửa ngoài ứng dụng trong cùng giây)"""
+        self._cache.clear()
+    
     def save_recipe(self, recipe: Recipe) -> bool:
         """Lưu recipe vào file JSON"""
         try:
-            safe_name = recipe.name.replace(" ", "_").replace("/", "_")
-            config_filename = f"{safe_name}.json"
-            config_path = os.path.join(self.config_dir, config_filename)
+            config_path = self._config_path(recipe.name)
             
             with open(config_path, 'w', encoding='utf-8') as f:
                 json.dump(recipe.to_dict(), f, indent=2, ensure_ascii=False)
             
+            # Recipe vừa lưu là bản mới nhất (cache giữ bản sao, caller tiếp tục sửa recipe của mình)
+            self._cache_put(config_path, recipe.copy())
+            
             logger.info(f"Recipe saved: {config_path}")
             return True
             
@@ -279,16 +497,28 @@ class RecipeService:
             return False
     
     def load_recipe(self, recipe_name: str) -> Optional[Recipe]:
-        """Load recipe từ file"""
+        """
+        Load recipe từ file
+        Recipe đã load được giữ trong LRU cache (tối đa RECIPE_CACHE_SIZE), dùng lại khi file
+        config và ảnh master chưa đổi (mtime); mỗi lần load trả về bản sao riêng (Recipe.copy),
+        chỉ dữ liệu ảnh chỉ đọc và template đã chuẩn bị được dùng chung
+        """
         try:
-            safe_name = recipe_name.replace(" ", "_").replace("/", "_")
-            config_filename = f"{safe_name}.json"
-            config_path = os.path.join(self.config_dir, config_filename)
+            config_path = self._config_path(recipe_name)
             
             if not os.path.exists(config_path):
                 logger.error(f"Recipe config not found: {config_path}")
+                self._cache.pop(config_path, None)
                 return None
             
+            cached = self._cache_get(config_path)
+            if cached is not None:
+                # Bản do save_recipe đưa vào cache chưa chuẩn bị template: chuẩn bị trên bản
+                # trong cache (một lần) để các bản sao dùng chung
+                cached.get_fiducials()
+                logger.info(f"Recipe loaded from cache: {recipe_name}")
+                return cached.copy()
+            
             with open(config_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
@@ -299,8 +529,11 @@ class RecipeService:
                 logger.error("Failed to load template image")
                 return None
             
+            # Chuẩn bị template / fiducial một lần trên bản trong cache, các bản sao dùng chung
+            recipe.get_fiducials()
+            self._cache_put(config_path, recipe)
             logger.info(f"Recipe loaded: {recipe_name}")
-            return recipe
+            return recipe.copy()
             
         except Exception as e:
             logger.error(f"Error loading recipe: {e}", exc_info=True)
@@ -325,22 +558,41 @@ class RecipeService:
             return []
     
     def delete_recipe(self, recipe_name: str) -> bool:
-        """Xóa recipe"""
+        """
+        Xóa recipe (config, ảnh master và sidecar)
+        Ảnh master được memory-map (Windows không xóa được file đang map): recipe trong cache và
+        current_recipe được release và bỏ; bản sao khác từ load_recipe mà caller còn giữ phải được
+        bỏ (hoặc release_template_image) trước khi gọi hàm này
+        """
         try:
-            # Load recipe để lấy image path
-            recipe = self.load_recipe(recipe_name)
-            if recipe is None:
+            # Đọc config để lấy image path (không load ảnh: không tạo thêm mmap)
+            config_path = self._config_path(recipe_name)
+            if not os.path.exists(config_path):
                 logger.warning(f"Recipe not found: {recipe_name}")
+                self._cache.pop(config_path, None)
                 return False
+            with open(config_path, 'r', encoding='utf-8') as f:
+                recipe = Recipe.from_dict(json.load(f))
+            
+            # Bỏ mmap trước khi xóa file
+            entry = self._cache.pop(config_path, None)
+            if entry is not None:
+                entry[2].release_template_image()
+            current = self.current_recipe
+            if current is not None and current.template_image_path == recipe.template_image_path:
+                current.release_template_image()
+                self.current_recipe = None
+                logger.info(f"Current recipe cleared: {recipe_name}")
             
-            # Delete image file
-            if os.path.exists(recipe.template_image_path):
-                os.remove(recipe.template_image_path)
-                logger.info(f"Deleted image: {recipe.template_image_path}")
+            # Delete image file (+ sidecar .npy)
+            sidecars = ([_sidecar_path(recipe.template_image_path), recipe._template_sidecar_path()]
+                        + _legacy_template_sidecars(recipe.template_image_path))
+            for path in [recipe.template_image_path] + sidecars:
+                if os.path.exists(path):
+                    os.remove(path)
+                    logger.info(f"Deleted image: {path}")
             
             # Delete config file
-            safe_name = recipe_name.replace(" ", "_").replace("/", "_")
-            config_path = os.path.join(self.config_dir, f"{safe_name}.json")
             if os.path.exists(config_path):
                 os.remove(config_path)
                 logger.info(f"Deleted config: {config_path}")
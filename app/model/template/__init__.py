@@ -1,6 +1,7 @@
 """Template Matching Module"""
-from .template_matching_service import TemplateMatchingService, MatchResult
-
-__all__ = ['TemplateMatchingService', 'MatchResult']
-
+from .template_matching_service import TemplateMatchingService, MatchResult, PreparedTemplate
+from .fiducial_tracker import FiducialTracker
+from .pose_estimation import PanelPose, estimate_pose
 
+__all__ = ['TemplateMatchingService', 'MatchResult', 'PreparedTemplate', 'FiducialTracker',
+           'PanelPose', 'estimate_pose']
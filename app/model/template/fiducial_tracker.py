@@ -0,0 +1,123 @@
+"""
+Fiducial Tracker - Theo dõi vị trí template (fiducial) giữa các frame (streaming)
+Dự đoán vị trí frame sau bằng mô hình vận tốc, so khớp một patch nhỏ của template trong
+cửa sổ hẹp quanh vị trí dự đoán; cửa sổ chỉ được nới rộng sau khi miss
+"""
+import logging
+import math
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Lề tối thiểu (px) của cửa sổ tracking quanh vị trí dự đoán
+TRACK_MIN_MARGIN = 4
+# Lề tối đa: lớn hơn thì tìm toàn cửa sổ chuẩn (search_margin) sẽ rẻ ngang
+TRACK_MAX_MARGIN = 32
+# Hệ số cập nhật vận tốc theo sai số dự đoán (alpha-beta, vị trí lấy theo đo đạc)
+TRACK_VELOCITY_GAIN = 0.3
+# Miss liên tiếp quá số này: bỏ track, quay về tìm quanh vị trí chuẩn
+TRACK_MAX_MISSES = 3
+# Patch giữa template dùng để tracking (cạnh tối đa, px) - correlation nhỏ, dưới 1 ms
+TRACK_PATCH_SIDE = 96
+# Điểm tracking thấp hơn trung bình gần đây quá mức này: coi là miss (panel đổi / xoay thêm)
+TRACK_SCORE_DROP = 0.1
+
+
+@dataclass
+class FiducialTrack:
+    """Trạng thái tracking của template"""
+    # PreparedTemplate đang được track (đổi recipe -> track mới)
+    source: Any
+    # Vị trí top-left template (sub-pixel) và góc ở frame gần nhất
+    x: float
+    y: float
+    angle: float = 0.0
+    # Vận tốc (px / frame)
+    vx: float = 0.0
+    vy: float = 0.0
+    # Lề cửa sổ tìm kiếm cho frame tiếp theo
+    margin: int = TRACK_MIN_MARGIN
+    misses: int = 0
+    hits: int = 0
+    # Điểm tracking trung bình (EMA, 0 = chưa có)
+    patch_score: float = 0.0
+    # Patch tracking đã cắt sẵn theo góc (khóa = index góc trong bank, -1 = không xoay)
+    patch: Optional[np.ndarray] = None
+    patch_offset: Tuple[int, int] = (0, 0)
+    patch_key: Optional[int] = None
+
+
+class FiducialTracker:
+    """
+    Tracker cho template matching ở streaming mode
+    - predict(): vị trí dự đoán cho frame tiếp theo (vị trí + vận tốc)
+    - update(): ghi nhận vị trí đo được, cập nhật vận tốc và lề cửa sổ theo sai số dự đoán
+    - miss(): nhân đôi lề cửa sổ, bỏ track sau TRACK_MAX_MISSES lần liên tiếp
+    """
+
+    def __init__(self):
+        self.track: Optional[FiducialTrack] = None
+
+    def reset(self):
+        """Quên vị trí (đổi recipe / dừng stream)"""
+        self.track = None
+
+    def predict(self) -> Optional[Tuple[float, float]]:
+        """Vị trí top-left dự đoán cho frame tiếp theo (None = chưa track)"""
+        if self.track is None:
+            return None
+        return self.track.x + self.track.vx, self.track.y + self.track.vy
+
+    def update(self, source: Any, x: float, y: float, angle: float, tracked_score: float = 0.0):
+        """
+        Ghi nhận vị trí template đo được ở frame hiện tại
+
+        Args:
+            source: PreparedTemplate đã match
+            x, y: Vị trí top-left (sub-pixel)
+            angle: Góc (độ)
+            tracked_score: Điểm của patch tracking (0 = vị trí từ tìm kiếm đầy đủ)
+        """
+        track = self.track
+        if track is None or track.source is not source:
+            self.track = FiducialTrack(source=source, x=x, y=y, angle=angle, hits=1)
+            return
+
+        predicted_x, predicted_y = track.x + track.vx, track.y + track.vy
+        error_x, error_y = x - predicted_x, y - predicted_y
+        track.vx += TRACK_VELOCITY_GAIN * error_x
+        track.vy += TRACK_VELOCITY_GAIN * error_y
+        track.x, track.y = x, y
+        if angle != track.angle:
+            track.patch_key = None
+        track.angle = angle
+        track.misses = 0
+        track.hits += 1
+        if tracked_score <= 0:
+            # Tìm lại bằng tìm kiếm đầy đủ: điểm patch cũ không còn làm mốc
+            track.patch_score = 0.0
+        elif track.patch_score <= 0:
+            track.patch_score = tracked_score
+        else:
+            track.patch_score = 0.7 * track.patch_score + 0.3 * tracked_score
+
+        # Lề thích nghi: đủ chứa sai số dự đoán + vận tốc hiện tại
+        error = math.hypot(error_x, error_y)
+        speed = math.hypot(track.vx, track.vy)
+        track.margin = int(min(TRACK_MAX_MARGIN, max(TRACK_MIN_MARGIN, math.ceil(2.0 * error + speed))))
+
+    def miss(self):
+        """Không tìm thấy template ở frame hiện tại: nới rộng cửa sổ, bỏ track nếu miss liên tiếp"""
+        track = self.track
+        if track is None:
+            return
+        track.misses += 1
+        track.patch_score = 0.0
+        if track.misses > TRACK_MAX_MISSES:
+            logger.debug("Fiducial tracking lost")
+            self.track = None
+            return
+        track.margin = min(TRACK_MAX_MARGIN, track.margin * 2)
@@ -0,0 +1,168 @@
+"""
+Pose Estimation - Tư thế panel (similarity: dx, dy, angle, scale) từ vị trí các fiducial
+Tâm fiducial trên ảnh master -> tâm tìm được trên frame, bình phương tối thiểu
+(>= 2 fiducial); một fiducial: tịnh tiến + góc ước lượng từ bank template xoay
+Cắt ROI theo tư thế: warp riêng từng ROI thành patch thẳng trục (không xoay cả frame)
+"""
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Góc (độ) / sai lệch scale (px trên cạnh ROI) nhỏ hơn mức này: cắt ROI trực tiếp, không warp
+ROI_WARP_MIN_ANGLE = 0.05
+ROI_WARP_MIN_SCALE_PX = 0.5
+
+
+@dataclass
+class PanelPose:
+    """
+    Biến đổi similarity từ tọa độ ảnh master sang tọa độ frame
+    frame = scale * R(angle) * (master - center) + center + (dx, dy)
+    angle cùng quy ước với cv2.getRotationMatrix2D (dương = ngược chiều kim đồng hồ)
+    """
+    # Tâm xoay trên ảnh master (tâm fiducial chính)
+    center_x: float
+    center_y: float
+    # Độ dịch của tâm xoay (px)
+    dx: float = 0.0
+    dy: float = 0.0
+    angle: float = 0.0
+    scale: float = 1.0
+    # Số fiducial dùng để ước lượng và sai số RMS (px) của các tâm sau biến đổi
+    fiducials: int = 0
+    residual: float = 0.0
+    # Ma trận 2x3 master -> frame (tính từ các tham số trên)
+    matrix: np.ndarray = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.matrix is None:
+            matrix = rotation_matrix(self.center_x, self.center_y, self.angle, self.scale)
+            matrix[0, 2] += self.dx
+            matrix[1, 2] += self.dy
+            self.matrix = matrix
+
+    def map_point(self, x: float, y: float) -> Tuple[float, float]:
+        """Điểm trên ảnh master -> điểm trên frame"""
+        m = self.matrix
+        return (float(m[0, 0] * x + m[0, 1] * y + m[0, 2]),
+                float(m[1, 0] * x + m[1, 1] * y + m[1, 2]))
+
+    def map_corners(self, x: float, y: float, width: float, height: float) -> List[Tuple[float, float]]:
+        """4 góc hình chữ nhật trên ảnh master -> frame (thứ tự vòng: trên trái, trên phải, dưới phải, dưới trái)"""
+        return [self.map_point(cx, cy) for cx, cy in
+                ((x, y), (x + width, y), (x + width, y + height), (x, y + height))]
+
+    def map_rect(self, x: float, y: float, width: float, height: float) -> Tuple[int, int, int, int]:
+        """
+        Hình chữ nhật trên ảnh master -> hình chữ nhật bao (thẳng trục) trên frame
+
+        Returns:
+            (x, y, w, h) chứa trọn vùng sau khi xoay
+        """
+        corners = self.map_corners(x, y, width, height)
+        xs = [c[0] for c in corners]
+        ys = [c[1] for c in corners]
+        x1, y1 = int(math.floor(min(xs))), int(math.floor(min(ys)))
+        x2, y2 = int(math.ceil(max(xs))), int(math.ceil(max(ys)))
+        return x1, y1, x2 - x1, y2 - y1
+
+    def extract_rect(self, image: np.ndarray, x: int, y: int, width: int,
+                     height: int) -> Optional[np.ndarray]:
+        """
+        Cắt hình chữ nhật (tọa độ ảnh master) từ frame thành patch thẳng trục kích thước width x height
+        - Chỉ warpAffine cửa sổ nguồn bao quanh ROI trên frame (không xoay cả frame)
+        - Panel gần như không xoay / scale: trả về view cắt trực tiếp (không copy, không nội suy)
+
+        Args:
+            image: Frame (mono hoặc BGR)
+            x, y, width, height: ROI trên ảnh master
+
+        Returns:
+            Patch (height x width), None nếu ROI nằm ngoài frame
+        """
+        if width <= 0 or height <= 0:
+            return None
+        img_h, img_w = image.shape[:2]
+        origin_x, origin_y = self.map_point(x, y)
+
+        if (abs(self.angle) < ROI_WARP_MIN_ANGLE and
+                abs(self.scale - 1.0) * max(width, height) < ROI_WARP_MIN_SCALE_PX):
+            left, top = int(round(origin_x)), int(round(origin_y))
+            if 0 <= left and 0 <= top and left + width <= img_w and top + height <= img_h:
+                return image[top:top + height, left:left + width]
+
+        # Cửa sổ nguồn: hình bao ROI sau biến đổi + 1 px cho nội suy
+        box_x, box_y, box_w, box_h = self.map_rect(x, y, width, height)
+        x1, y1 = max(0, box_x - 1), max(0, box_y - 1)
+        x2, y2 = min(img_w, box_x + box_w + 1), min(img_h, box_y + box_h + 1)
+        if x2 <= x1 or y2 <= y1:
+            return None
+
+        # Patch (u, v) -> cửa sổ nguồn: A * (u, v) + pose(x, y) - gốc cửa sổ
+        matrix = self.matrix.copy()
+        matrix[0, 2] = origin_x - x1
+        matrix[1, 2] = origin_y - y1
+        return cv2.warpAffine(image[y1:y2, x1:x2], matrix, (width, height),
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_REPLICATE)
+
+
+def rotation_matrix(center_x: float, center_y: float, angle: float, scale: float) -> np.ndarray:
+    """Như cv2.getRotationMatrix2D nhưng float64 và không cần gọi OpenCV"""
+    theta = math.radians(angle)
+    alpha, beta = scale * math.cos(theta), scale * math.sin(theta)
+    return np.array([
+        [alpha, beta, (1.0 - alpha) * center_x - beta * center_y],
+        [-beta, alpha, beta * center_x + (1.0 - alpha) * center_y],
+    ], dtype=np.float64)
+
+
+def estimate_pose(master_points: Sequence[Tuple[float, float]],
+                  frame_points: Sequence[Tuple[float, float]],
+                  angles: Sequence[float] = ()) -> Optional[PanelPose]:
+    """
+    Ước lượng tư thế panel từ các cặp tâm fiducial
+
+    Args:
+        master_points: Tâm fiducial trên ảnh master (điểm đầu = fiducial chính, làm tâm xoay)
+        frame_points: Tâm tương ứng tìm được trên frame
+        angles: Góc ước lượng của từng fiducial (chỉ dùng khi có một fiducial)
+
+    Returns:
+        PanelPose, None nếu không có điểm nào
+    """
+    count = min(len(master_points), len(frame_points))
+    if count == 0:
+        return None
+    master = np.asarray(master_points[:count], dtype=np.float64)
+    frame = np.asarray(frame_points[:count], dtype=np.float64)
+    center_x, center_y = float(master[0, 0]), float(master[0, 1])
+
+    if count == 1:
+        angle = float(angles[0]) if angles else 0.0
+        return PanelPose(center_x=center_x, center_y=center_y,
+                         dx=float(frame[0, 0]) - center_x, dy=float(frame[0, 1]) - center_y,
+                         angle=angle, fiducials=1)
+
+    # Similarity bình phương tối thiểu dạng số phức: q = a * p + t, a = scale * e^(-i*angle)
+    # (trục y hướng xuống nên góc ngược chiều kim đồng hồ là arg âm)
+    p = master[:, 0] + 1j * master[:, 1]
+    q = frame[:, 0] + 1j * frame[:, 1]
+    p_mean, q_mean = p.mean(), q.mean()
+    spread = float(np.sum(np.abs(p - p_mean) ** 2))
+    if spread < 1e-6:
+        # Các fiducial trùng tâm: chỉ tịnh tiến
+        a = 1.0 + 0j
+    else:
+        a = np.sum((q - q_mean) * np.conj(p - p_mean)) / spread
+    t = q_mean - a * p_mean
+
+    residual = float(np.sqrt(np.mean(np.abs(a * p + t - q) ** 2)))
+    moved = a * p[0] + t
+    return PanelPose(center_x=center_x, center_y=center_y,
+                     dx=float(moved.real) - center_x, dy=float(moved.imag) - center_y,
+                     angle=-math.degrees(float(np.angle(a))), scale=float(abs(a)),
+                     fiducials=count, residual=residual)
@@ -3,13 +3,53 @@ Template Matching Service - So khớp vị trí panel với template
 Sử dụng OpenCV Template Matching
 """
 import cv2
+import math
+import os
 import numpy as np
-from typing import Optional, Tuple
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from dataclasses import dataclass, replace
 import logging
 
+from .fiducial_tracker import FiducialTracker, TRACK_PATCH_SIDE, TRACK_SCORE_DROP
+from .pose_estimation import PanelPose, estimate_pose
+
 logger = logging.getLogger(__name__)
 
+# Pyramid search: template được thu nhỏ 2^n lần sao cho cạnh ngắn còn >= giá trị này (px)
+PYRAMID_MIN_COARSE_SIDE = 24
+# Số tầng thu nhỏ tối đa (factor tối đa 2^n)
+PYRAMID_MAX_LEVELS = 3
+# Số ứng viên ở tầng thô được tinh chỉnh ở độ phân giải gốc
+PYRAMID_TOP_K = 3
+# Chỉ tinh chỉnh ứng viên có điểm tầng thô không kém ứng viên tốt nhất quá giá trị này
+PYRAMID_CANDIDATE_DELTA = 0.15
+# Lề thêm (px, độ phân giải gốc) quanh mỗi ứng viên khi tinh chỉnh
+PYRAMID_REFINE_MARGIN = 4
+
+# Ước lượng góc: mặc định tìm trong ±ANGLE_DEFAULT_RANGE độ, bước ANGLE_DEFAULT_STEP độ
+ANGLE_DEFAULT_RANGE = 5.0
+ANGLE_DEFAULT_STEP = 0.5
+# Quét thô mỗi ANGLE_COARSE_STRIDE bước (ảnh thu nhỏ), sau đó leo đồi từng bước quanh góc tốt nhất
+ANGLE_COARSE_STRIDE = 4
+# Lề (px) quanh vị trí tìm được ở góc 0 khi thử các góc khác
+ANGLE_SEARCH_MARGIN = 3
+# Số template đã chuẩn bị được giữ trong cache khi caller truyền ndarray (mỗi recipe một template)
+PREPARED_CACHE_SIZE = 8
+# Số thread tối đa khi match nhiều fiducial song song (matchTemplate nhả GIL)
+FIDUCIAL_MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def pyramid_factor(template_shape: Tuple[int, ...]) -> int:
+    """Hệ số thu nhỏ lớn nhất (2^n) mà template vẫn đủ chi tiết"""
+    factor = 1
+    min_side = min(template_shape[:2])
+    for _ in range(PYRAMID_MAX_LEVELS):
+        if min_side // (factor * 2) < PYRAMID_MIN_COARSE_SIDE:
+            break
+        factor *= 2
+    return factor
+
 
 @dataclass
 class MatchResult:
@@ -21,15 +61,109 @@ class MatchResult:
     # Độ lệch so với vị trí chuẩn
     dx: int = 0
     dy: int = 0
-    # Góc xoay (chưa implement)
+    # Góc xoay (độ, dương = ngược chiều kim đồng hồ như cv2.getRotationMatrix2D)
     angle: float = 0.0
     # Điểm số matching (0-1)
     score: float = 0.0
+    # Vị trí sub-pixel (top-left, nội suy parabol quanh đỉnh correlation)
+    sub_x: float = 0.0
+    sub_y: float = 0.0
     # Thông tin debug
     method: str = ""
     message: str = ""
 
 
+class RotatedTemplateBank:
+    """
+    Template gray đã xoay sẵn theo các góc -angle_range..+angle_range (bước angle_step)
+    - Tạo một lần cho mỗi recipe (lưu trong PreparedTemplate của recipe)
+    - Mỗi template xoay được cắt về cùng vùng giữa (crop) nằm trọn trong template ở mọi góc,
+      nên không có pixel nền do xoay; vị trí crop đổi ngược về top-left template qua crop_offset
+    """
+    
+    def __init__(self, template_gray: np.ndarray, angle_range: float, angle_step: float):
+        self.angle_range = float(angle_range)
+        self.angle_step = float(angle_step)
+        tpl_h, tpl_w = template_gray.shape[:2]
+        self.template_size = (tpl_w, tpl_h)
+        
+        # Vùng giữa lớn nhất (cùng tỉ lệ) nằm trong template xoay ở góc lớn nhất
+        theta = math.radians(self.angle_range)
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+        shrink = min(tpl_w / (tpl_w * cos_t + tpl_h * sin_t), tpl_h / (tpl_w * sin_t + tpl_h * cos_t))
+        crop_w = max(8, int(tpl_w * shrink) - 2)
+        crop_h = max(8, int(tpl_h * shrink) - 2)
+        # Cùng tính chẵn lẻ với template để crop nằm chính giữa (tâm xoay)
+        crop_w -= (tpl_w - crop_w) % 2
+        crop_h -= (tpl_h - crop_h) % 2
+        self.crop_size = (crop_w, crop_h)
+        crop_x, crop_y = (tpl_w - crop_w) // 2, (tpl_h - crop_h) // 2
+        self.crop_offset = (crop_x, crop_y)
+        
+        steps = int(round(self.angle_range / self.angle_step)) if self.angle_step > 0 else 0
+        self.angles = tuple(k * self.angle_step for k in range(-steps, steps + 1))
+        self.zero_index = steps
+        
+        center = ((tpl_w - 1) / 2.0, (tpl_h - 1) / 2.0)
+        self.templates = []
+        for angle in self.angles:
+            matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+            rotated = cv2.warpAffine(template_gray, matrix, (tpl_w, tpl_h),
+                                     flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            self.templates.append(np.ascontiguousarray(rotated[crop_y:crop_y + crop_h, crop_x:crop_x + crop_w]))
+        
+        # Bản thu nhỏ cho quét góc thô
+        self.coarse_factor = 1
+        while (self.coarse_factor < 4 and
+               min(crop_w, crop_h) // (self.coarse_factor * 2) >= PYRAMID_MIN_COARSE_SIDE):
+            self.coarse_factor *= 2
+        self.coarse_templates = self.templates
+        if self.coarse_factor > 1:
+            coarse_size = (crop_w // self.coarse_factor, crop_h // self.coarse_factor)
+            self.coarse_templates = [cv2.resize(t, coarse_size, interpolation=cv2.INTER_AREA)
+                                     for t in self.templates]
+        
+        logger.info(f"Rotated template bank built: {len(self.angles)} angles "
+                    f"(±{self.angle_range}° step {self.angle_step}°), crop {crop_w}x{crop_h}")
+    
+    def matches(self, angle_range: float, angle_step: float) -> bool:
+        return self.angle_range == angle_range and self.angle_step == angle_step
+
+
+class PreparedTemplate:
+    """
+    Template đã chuẩn bị một lần cho mỗi recipe, dùng lại cho mọi frame
+    - Gray liên tục trong bộ nhớ, tầng pyramid thu nhỏ
+    - Bank template xoay (tạo khi service cần ước lượng góc lần đầu)
+    Mỗi lần match chỉ còn phép correlation trên cửa sổ tìm kiếm
+    """
+    
+    def __init__(self, template: np.ndarray):
+        # Giữ tham chiếu template gốc (khóa cache, tránh trùng id sau khi bị giải phóng)
+        self.source = template
+        gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY) if template.ndim == 3 else template
+        self.gray = np.ascontiguousarray(gray)
+        self.height, self.width = self.gray.shape[:2]
+        
+        # Template phẳng (||T - mean|| ~ 0) không định vị được; chuẩn hóa của TM_CCOEFF_NORMED
+        # do matchTemplate tự tính (tổng tích phân), không cần giữ mean / norm ở đây
+        std = float(cv2.meanStdDev(self.gray)[1][0][0])
+        if std * math.sqrt(self.gray.size) < 1.0:
+            logger.warning(f"Template {self.width}x{self.height} has no texture (std={std:.2f}), "
+                           f"matching will be unreliable")
+        
+        # Tầng pyramid thô (factor = 1: template quá nhỏ để thu nhỏ)
+        self.pyramid_factor = pyramid_factor(self.gray.shape)
+        self.coarse_gray = None
+        if self.pyramid_factor > 1:
+            self.coarse_gray = cv2.resize(
+                self.gray, (self.width // self.pyramid_factor, self.height // self.pyramid_factor),
+                interpolation=cv2.INTER_AREA
+            )
+        
+        self.bank: Optional[RotatedTemplateBank] = None
+
+
 class TemplateMatchingService:
     """
     Template Matching Service
@@ -38,32 +172,330 @@ class TemplateMatchingService:
     - Kiểm tra tolerance
     """
     
-    def __init__(self):
+    def __init__(self, use_pyramid: bool = True, angle_range: float = ANGLE_DEFAULT_RANGE,
+                 angle_step: float = ANGLE_DEFAULT_STEP):
         # Template matching methods
         # TM_CCOEFF_NORMED: Correlation coefficient (normalized)
         # TM_CCORR_NORMED: Cross correlation (normalized)
         # TM_SQDIFF_NORMED: Squared difference (normalized, inverted)
         self.method = cv2.TM_CCOEFF_NORMED
+        # Coarse-to-fine: tìm ứng viên trên ảnh thu nhỏ, tinh chỉnh top-k ở độ phân giải gốc
+        self.use_pyramid = use_pyramid
+        # Ước lượng góc bằng bank template xoay sẵn (angle_range <= 0 = chỉ tìm tịnh tiến)
+        self.angle_range = angle_range
+        self.angle_step = angle_step
+        # Template đã chuẩn bị cho caller truyền ndarray (recipe nên giữ PreparedTemplate riêng)
+        self._prepared: Dict[int, PreparedTemplate] = {}
+        # Thread pool cho match_fiducials (tạo khi recipe có nhiều fiducial)
+        self._executor: Optional[ThreadPoolExecutor] = None
         logger.info("TemplateMatchingService initialized")
     
+    def prepare_template(self, template: Union[np.ndarray, PreparedTemplate]) -> PreparedTemplate:
+        """
+        PreparedTemplate của template (tạo lần đầu, sau đó lấy từ cache)
+        
+        Args:
+            template: Template ROI (giữ nguyên object giữa các frame) hoặc PreparedTemplate
+        """
+        if isinstance(template, PreparedTemplate):
+            return template
+        prepared = self._prepared.get(id(template))
+        if prepared is not None and prepared.source is template:
+            return prepared
+        prepared = PreparedTemplate(template)
+        if len(self._prepared) >= PREPARED_CACHE_SIZE:
+            self._prepared.pop(next(iter(self._prepared)))
+        self._prepared[id(template)] = prepared
+        return prepared
+    
+    def get_rotated_bank(self, prepared: PreparedTemplate) -> RotatedTemplateBank:
+        """Bank template xoay của template (tạo lần đầu, lưu trong PreparedTemplate)"""
+        if prepared.bank is None or not prepared.bank.matches(self.angle_range, self.angle_step):
+            prepared.bank = RotatedTemplateBank(prepared.gray, self.angle_range, self.angle_step)
+        return prepared.bank
+    
+    def clear_cache(self):
+        """Bỏ các template đã chuẩn bị (recipe đổi / template được dạy lại)"""
+        self._prepared = {}
+    
+    def _score_map(self, search: np.ndarray, template: np.ndarray) -> np.ndarray:
+        """matchTemplate, quy về 'càng lớn càng khớp' cho mọi method"""
+        result = cv2.matchTemplate(search, template, self.method)
+        if self.method in [cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED]:
+            result = 1.0 - result
+        return result
+    
+    @staticmethod
+    def _subpixel_peak(result: np.ndarray, loc: Tuple[int, int]) -> Tuple[float, float]:
+        """Nội suy parabol 1-D theo từng trục quanh đỉnh (x, y) của score map"""
+        px, py = loc
+        offsets = []
+        for axis, pos, size in ((1, px, result.shape[1]), (0, py, result.shape[0])):
+            if pos <= 0 or pos >= size - 1:
+                offsets.append(0.0)
+                continue
+            if axis == 1:
+                left, center, right = result[py, px - 1], result[py, px], result[py, px + 1]
+            else:
+                left, center, right = result[py - 1, px], result[py, px], result[py + 1, px]
+            denom = float(left - 2.0 * center + right)
+            offsets.append(0.0 if denom >= 0 else max(-0.5, min(0.5, 0.5 * float(left - right) / denom)))
+        return px + offsets[0], py + offsets[1]
+    
+    @staticmethod
+    def _top_peaks(result: np.ndarray, k: int, radius_x: int, radius_y: int):
+        """k đỉnh lớn nhất của score map, mỗi đỉnh che vùng (2*radius+1) xung quanh (NMS)"""
+        work = result.copy()
+        peaks = []
+        for _ in range(k):
+            _, max_val, _, max_loc = cv2.minMaxLoc(work)
+            if max_val < -1.0:
+                # Toàn bộ score map đã bị che
+                break
+            peaks.append((max_loc, max_val))
+            x, y = max_loc
+            work[max(0, y - radius_y):y + radius_y + 1, max(0, x - radius_x):x + radius_x + 1] = -2.0
+        return peaks
+    
+    def _match_exhaustive(self, search: np.ndarray, template: np.ndarray) -> Tuple[float, float, float]:
+        """Tìm toàn bộ search ở độ phân giải gốc -> (sub_x, sub_y, score)"""
+        result = self._score_map(search, template)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        sub_x, sub_y = self._subpixel_peak(result, max_loc)
+        return sub_x, sub_y, float(max_val)
+    
+    def _match_pyramid(self, search: np.ndarray, prepared: PreparedTemplate) -> Tuple[float, float, float]:
+        """
+        Coarse-to-fine: matchTemplate trên search/template thu nhỏ pyramid_factor lần, sau đó
+        matchTemplate ở độ phân giải gốc chỉ trong cửa sổ nhỏ quanh PYRAMID_TOP_K ứng viên
+        """
+        factor = prepared.pyramid_factor
+        template, coarse_tpl = prepared.gray, prepared.coarse_gray
+        search_h, search_w = search.shape[:2]
+        tpl_h, tpl_w = template.shape[:2]
+        coarse_search = cv2.resize(search, (max(1, search_w // factor), max(1, search_h // factor)),
+                                   interpolation=cv2.INTER_AREA)
+        if coarse_search.shape[0] < coarse_tpl.shape[0] or coarse_search.shape[1] < coarse_tpl.shape[1]:
+            return self._match_exhaustive(search, template)
+        coarse = self._score_map(coarse_search, coarse_tpl)
+        
+        peaks = self._top_peaks(coarse, PYRAMID_TOP_K,
+                                max(1, coarse_tpl.shape[1] // 2), max(1, coarse_tpl.shape[0] // 2))
+        
+        best = (0.0, 0.0, -1.0)
+        margin = factor + PYRAMID_REFINE_MARGIN
+        for (cx, cy), coarse_score in peaks:
+            if coarse_score < peaks[0][1] - PYRAMID_CANDIDATE_DELTA:
+                break
+            # Cửa sổ tinh chỉnh: vị trí ứng viên ở độ phân giải gốc ± margin
+            x1 = max(0, cx * factor - margin)
+            y1 = max(0, cy * factor - margin)
+            x2 = min(search_w, cx * factor + tpl_w + margin)
+            y2 = min(search_h, cy * factor + tpl_h + margin)
+            if x2 - x1 < tpl_w or y2 - y1 < tpl_h:
+                continue
+            refined = self._score_map(search[y1:y2, x1:x2], template)
+            _, max_val, _, max_loc = cv2.minMaxLoc(refined)
+            if max_val > best[2]:
+                sub_x, sub_y = self._subpixel_peak(refined, max_loc)
+                best = (x1 + sub_x, y1 + sub_y, float(max_val))
+        return best
+    
+    def _match_rotated(self, search: np.ndarray, bank: RotatedTemplateBank, sub_x: float, sub_y: float,
+                       score: float) -> Tuple[float, float, float, float]:
+        """
+        Ước lượng góc quanh vị trí tìm được ở góc 0 (top-left template trong search)
+        - Early exit: góc 0 tốt hơn ±1 bước -> panel không xoay (3 lần matchTemplate)
+        - Quét thô mỗi ANGLE_COARSE_STRIDE góc trên ảnh thu nhỏ, rồi leo đồi từng bước ở độ phân
+          giải gốc (dừng khi điểm giảm), cuối cùng nội suy parabol theo góc
+        Số lần matchTemplate bị chặn trên, mỗi lần chỉ trên cửa sổ nhỏ quanh vị trí
+        
+        Returns:
+            (sub_x, sub_y, angle, score) - vị trí top-left template (sub-pixel)
+        """
+        last = len(bank.angles) - 1
+        if last < 2:
+            return sub_x, sub_y, 0.0, score
+        
+        search_h, search_w = search.shape[:2]
+        crop_w, crop_h = bank.crop_size
+        # Cửa sổ quanh vị trí crop ở góc 0
+        x1 = max(0, int(sub_x) + bank.crop_offset[0] - ANGLE_SEARCH_MARGIN)
+        y1 = max(0, int(sub_y) + bank.crop_offset[1] - ANGLE_SEARCH_MARGIN)
+        x2 = min(search_w, x1 + crop_w + 2 * ANGLE_SEARCH_MARGIN + 1)
+        y2 = min(search_h, y1 + crop_h + 2 * ANGLE_SEARCH_MARGIN + 1)
+        if x2 - x1 < crop_w or y2 - y1 < crop_h:
+            return sub_x, sub_y, 0.0, score
+        window = search[y1:y2, x1:x2]
+        
+        evaluated: Dict[int, Tuple[float, float, float]] = {}
+        
+        def evaluate(index: int) -> float:
+            if index not in evaluated:
+                result = self._score_map(window, bank.templates[index])
+                _, max_val, _, max_loc = cv2.minMaxLoc(result)
+                px, py = self._subpixel_peak(result, max_loc)
+                evaluated[index] = (x1 + px, y1 + py, float(max_val))
+            return evaluated[index][2]
+        
+        zero = bank.zero_index
+        best = max((zero - 1, zero, zero + 1), key=evaluate)
+        if best != zero:
+            # Quét thô trên cửa sổ thu nhỏ (template xoay thu nhỏ có sẵn trong bank)
+            factor = bank.coarse_factor
+            coarse_window = window
+            if factor > 1:
+                coarse_window = cv2.resize(window, (window.shape[1] // factor, window.shape[0] // factor),
+                                           interpolation=cv2.INTER_AREA)
+            reach = zero // ANGLE_COARSE_STRIDE
+            coarse = sorted({zero + k * ANGLE_COARSE_STRIDE for k in range(-reach, reach + 1)} | {0, last})
+            coarse_scores = {}
+            for index in coarse:
+                result = self._score_map(coarse_window, bank.coarse_templates[index])
+                coarse_scores[index] = cv2.minMaxLoc(result)[1]
+            best = max(coarse_scores, key=coarse_scores.get)
+            
+            # Leo đồi từng bước ở độ phân giải gốc (early exit khi điểm giảm)
+            for direction in (-1, 1):
+                index = best + direction
+                while 0 <= index <= last and abs(index - best) <= ANGLE_COARSE_STRIDE:
+                    if evaluate(index) <= evaluate(best):
+                        break
+                    best = index
+                    index += direction
+        
+        # Nội suy parabol theo góc
+        angle = bank.angles[best]
+        if 0 < best < last:
+            left, center, right = evaluate(best - 1), evaluate(best), evaluate(best + 1)
+            denom = left - 2.0 * center + right
+            if denom < 0:
+                angle += bank.angle_step * max(-0.5, min(0.5, 0.5 * (left - right) / denom))
+        
+        crop_x, crop_y, best_score = evaluated[best]
+        logger.debug(f"Angle search: {len(evaluated)} rotations evaluated, angle={angle:+.2f}°, score={best_score:.3f}")
+        if best_score < score:
+            return sub_x, sub_y, 0.0, score
+        return crop_x - bank.crop_offset[0], crop_y - bank.crop_offset[1], angle, best_score
+    
+    def _locate(self, search: np.ndarray, prepared: PreparedTemplate,
+                min_score: float) -> Tuple[float, float, float, float, str]:
+        """
+        Tìm template trong search: tịnh tiến (pyramid nếu template đủ lớn) rồi ước lượng góc
+        
+        Returns:
+            (sub_x, sub_y, angle, score, method_name)
+        """
+        bank = self.get_rotated_bank(prepared) if self.angle_range > 0 else None
+        factor = prepared.pyramid_factor if self.use_pyramid else 1
+        template_gray = prepared.gray
+        
+        if factor > 1:
+            sub_x, sub_y, score = self._match_pyramid(search, prepared)
+            method_name = f"TM_CCOEFF_NORMED pyramid x{factor}"
+        else:
+            sub_x, sub_y, score = self._match_exhaustive(search, template_gray)
+            method_name = "TM_CCOEFF_NORMED"
+        angle = 0.0
+        if bank is not None:
+            sub_x, sub_y, angle, score = self._match_rotated(search, bank, sub_x, sub_y, score)
+        
+        if factor > 1 and score < min_score:
+            # Ứng viên tầng thô có thể bỏ sót chi tiết nhỏ: kiểm tra lại bằng tìm kiếm đầy đủ
+            logger.debug(f"Pyramid match score {score:.3f} below threshold, exhaustive fallback")
+            sub_x, sub_y, score = self._match_exhaustive(search, template_gray)
+            method_name = "TM_CCOEFF_NORMED"
+            angle = 0.0
+            if bank is not None:
+                sub_x, sub_y, angle, score = self._match_rotated(search, bank, sub_x, sub_y, score)
+        
+        return sub_x, sub_y, angle, score, method_name
+    
+    def _tracking_patch(self, prepared: PreparedTemplate, tracker: FiducialTracker):
+        """Patch giữa template (theo góc đang track) và offset của patch so với top-left template"""
+        track = tracker.track
+        if self.angle_range > 0:
+            bank = self.get_rotated_bank(prepared)
+            key = int(np.argmin([abs(a - track.angle) for a in bank.angles]))
+            source, (base_x, base_y) = bank.templates[key], bank.crop_offset
+        else:
+            key = -1
+            source, (base_x, base_y) = prepared.gray, (0, 0)
+        if track.patch is None or track.patch_key != key:
+            src_h, src_w = source.shape[:2]
+            patch_w, patch_h = min(src_w, TRACK_PATCH_SIDE), min(src_h, TRACK_PATCH_SIDE)
+            patch_x, patch_y = (src_w - patch_w) // 2, (src_h - patch_h) // 2
+            track.patch = np.ascontiguousarray(source[patch_y:patch_y + patch_h, patch_x:patch_x + patch_w])
+            track.patch_offset = (base_x + patch_x, base_y + patch_y)
+            track.patch_key = key
+        return track.patch, track.patch_offset
+    
+    def _match_tracked(self, image: np.ndarray, prepared: PreparedTemplate, tracker: FiducialTracker,
+                       min_score: float) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Tìm template trong cửa sổ nhỏ quanh vị trí dự đoán của tracker (một lần matchTemplate
+        với patch giữa template, góc giữ theo frame trước)
+        
+        Returns:
+            (sub_x, sub_y, angle, score) tọa độ tuyệt đối, None nếu miss (caller tìm kiếm đầy đủ)
+        """
+        track = tracker.track
+        if track is None:
+            return None
+        if track.source is not prepared:
+            tracker.reset()
+            return None
+        
+        predicted_x, predicted_y = tracker.predict()
+        patch, (offset_x, offset_y) = self._tracking_patch(prepared, tracker)
+        patch_h, patch_w = patch.shape[:2]
+        margin = track.margin
+        img_h, img_w = image.shape[:2]
+        x1 = max(0, int(math.floor(predicted_x)) + offset_x - margin)
+        y1 = max(0, int(math.floor(predicted_y)) + offset_y - margin)
+        x2 = min(img_w, x1 + patch_w + 2 * margin + 1)
+        y2 = min(img_h, y1 + patch_h + 2 * margin + 1)
+        if x2 - x1 < patch_w + 2 or y2 - y1 < patch_h + 2:
+            return None
+        
+        window = image[y1:y2, x1:x2]
+        if window.ndim == 3:
+            window = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+        result = self._score_map(window, patch)
+        _, score, _, max_loc = cv2.minMaxLoc(result)
+        threshold = min_score
+        if track.patch_score > 0:
+            threshold = max(threshold, track.patch_score - TRACK_SCORE_DROP)
+        if score < threshold:
+            return None
+        # Đỉnh nằm sát biên cửa sổ: vị trí thật có thể ở ngoài cửa sổ
+        if not (0 < max_loc[0] < result.shape[1] - 1 and 0 < max_loc[1] < result.shape[0] - 1):
+            return None
+        sub_x, sub_y = self._subpixel_peak(result, max_loc)
+        return x1 + sub_x - offset_x, y1 + sub_y - offset_y, track.angle, float(score)
+    
     def match_template(
         self,
         image: np.ndarray,
-        template: np.ndarray,
+        template: Union[np.ndarray, PreparedTemplate],
         template_x: int,
         template_y: int,
         search_margin: int = 50,
-        min_score: float = 0.7
+        min_score: float = 0.7,
+        tracker: Optional[FiducialTracker] = None
     ) -> MatchResult:
         """
         So khớp template trên image
         
         Args:
             image: Ảnh đầu vào (panel mới)
-            template: Template ROI (từ recipe)
+            template: Template ROI (từ recipe) hoặc PreparedTemplate của recipe (không chuẩn bị lại)
             template_x, template_y: Vị trí chuẩn của template trên ảnh master
             search_margin: Vùng tìm kiếm xung quanh vị trí chuẩn (pixel)
             min_score: Điểm số tối thiểu để chấp nhận
+            tracker: FiducialTracker của stream (None = tìm quanh vị trí chuẩn mỗi frame);
+                     có vị trí frame trước thì chỉ tìm trong cửa sổ nhỏ quanh vị trí dự đoán,
+                     miss mới tìm lại toàn cửa sổ search_margin
         
         Returns:
             MatchResult
@@ -75,9 +507,12 @@ class TemplateMatchingService:
                     message="Invalid input image or template"
                 )
             
+            # Template gray / pyramid / bank: chuẩn bị một lần cho mỗi recipe
+            prepared = self.prepare_template(template)
+            
             # Validate dimensions
             img_h, img_w = image.shape[:2]
-            tpl_h, tpl_w = template.shape[:2]
+            tpl_h, tpl_w = prepared.height, prepared.width
             
             if tpl_h > img_h or tpl_w > img_w:
                 return MatchResult(
@@ -85,16 +520,28 @@ class TemplateMatchingService:
                     message=f"Template ({tpl_w}x{tpl_h}) larger than image ({img_w}x{img_h})"
                 )
             
-            # Convert to grayscale if needed
-            if len(image.shape) == 3:
-                image_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                image_gray = image.copy()
-            
-            if len(template.shape) == 3:
-                template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-            else:
-                template_gray = template.copy()
+            # Tracking: cửa sổ nhỏ quanh vị trí dự đoán từ frame trước
+            if tracker is not None:
+                tracked = self._match_tracked(image, prepared, tracker, min_score)
+                if tracked is not None:
+                    sub_x, sub_y, angle, patch_score = tracked
+                    tracker.update(prepared, sub_x, sub_y, angle, patch_score)
+                    match_x = int(round(sub_x))
+                    match_y = int(round(sub_y))
+                    logger.debug(f"Template tracked: pos=({match_x}, {match_y}), score={patch_score:.3f}")
+                    return MatchResult(
+                        success=True,
+                        x=match_x,
+                        y=match_y,
+                        dx=match_x - template_x,
+                        dy=match_y - template_y,
+                        angle=angle,
+                        score=patch_score,
+                        sub_x=sub_x,
+                        sub_y=sub_y,
+                        method="TM_CCOEFF_NORMED tracked",
+                        message="Match successful"
+                    )
             
             # Define search region (ROI around expected position)
             # Search region should be large enough to contain the template + margin
@@ -103,35 +550,25 @@ class TemplateMatchingService:
             search_x2 = min(img_w, template_x + tpl_w + search_margin)
             search_y2 = min(img_h, template_y + tpl_h + search_margin)
             
-            # Ensure valid search region
-            if search_x2 <= search_x1 or search_y2 <= search_y1:
+            # Ensure valid search region (đủ chứa template)
+            if search_x2 - search_x1 < tpl_w or search_y2 - search_y1 < tpl_h:
                 # Search region invalid, search entire image
                 logger.warning("Search region invalid, searching entire image")
-                search_roi = image_gray
-                search_x1 = 0
-                search_y1 = 0
-            else:
-                # Extract search ROI
-                search_roi = image_gray[search_y1:search_y2, search_x1:search_x2]
+                search_x1, search_y1, search_x2, search_y2 = 0, 0, img_w, img_h
             
-            # Perform template matching
-            result = cv2.matchTemplate(search_roi, template_gray, self.method)
+            # Chỉ chuyển gray trong cửa sổ tìm kiếm (ảnh mono: view, không copy)
+            search_roi = image[search_y1:search_y2, search_x1:search_x2]
+            if search_roi.ndim == 3:
+                search_roi = cv2.cvtColor(search_roi, cv2.COLOR_BGR2GRAY)
             
-            # Find best match
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-            
-            # For TM_CCOEFF_NORMED and TM_CCORR_NORMED, higher is better
-            # For TM_SQDIFF_NORMED, lower is better
-            if self.method in [cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED]:
-                match_score = 1.0 - min_val
-                match_loc = min_loc
-            else:
-                match_score = max_val
-                match_loc = max_loc
+            # Perform template matching (pyramid nếu template đủ lớn, góc từ bank template xoay)
+            sub_x, sub_y, angle, match_score, method_name = self._locate(search_roi, prepared, min_score)
             
             # Convert to absolute coordinates
-            match_x = search_x1 + match_loc[0]
-            match_y = search_y1 + match_loc[1]
+            sub_x += search_x1
+            sub_y += search_y1
+            match_x = int(round(sub_x))
+            match_y = int(round(sub_y))
             
             # Calculate offset
             dx = match_x - template_x
@@ -139,20 +576,28 @@ class TemplateMatchingService:
             
             # Check score threshold
             if match_score < min_score:
+                if tracker is not None:
+                    tracker.miss()
                 return MatchResult(
                     success=False,
                     x=match_x,
                     y=match_y,
                     dx=dx,
                     dy=dy,
+                    angle=angle,
                     score=match_score,
-                    method="TM_CCOEFF_NORMED",
+                    sub_x=sub_x,
+                    sub_y=sub_y,
+                    method=method_name,
                     message=f"Match score {match_score:.3f} below threshold {min_score}"
                 )
             
+            if tracker is not None:
+                tracker.update(prepared, sub_x, sub_y, angle)
+            
             logger.info(
                 f"Template matched: pos=({match_x}, {match_y}), "
-                f"offset=({dx:+d}, {dy:+d}), score={match_score:.3f}"
+                f"offset=({dx:+d}, {dy:+d}), angle={angle:+.2f}°, score={match_score:.3f} ({method_name})"
             )
             
             return MatchResult(
@@ -161,9 +606,11 @@ class TemplateMatchingService:
                 y=match_y,
                 dx=dx,
                 dy=dy,
-                angle=0.0,  # TODO: Implement rotation detection
+                angle=angle,
                 score=match_score,
-                method="TM_CCOEFF_NORMED",
+                sub_x=sub_x,
+                sub_y=sub_y,
+                method=method_name,
                 message="Match successful"
             )
             
@@ -174,6 +621,96 @@ class TemplateMatchingService:
                 message=f"Exception: {str(e)}"
             )
     
+    def match_fiducials(
+        self,
+        image: np.ndarray,
+        fiducials: Sequence[Tuple[Union[np.ndarray, PreparedTemplate], int, int]],
+        search_margin: int = 50,
+        min_score: float = 0.7,
+        tracker: Optional[FiducialTracker] = None
+    ) -> Tuple[List[MatchResult], Optional[PanelPose]]:
+        """
+        So khớp nhiều fiducial trên cùng frame và ước lượng tư thế panel
+        - Cửa sổ tìm kiếm gần nhau: chuyển gray một lần cho vùng bao, mỗi fiducial tìm trên view của vùng đó
+        - Các fiducial được tìm song song (thread pool)
+        
+        Args:
+            image: Ảnh đầu vào (panel mới)
+            fiducials: [(template hoặc PreparedTemplate, template_x, template_y)], phần tử đầu = fiducial chính
+            search_margin: Vùng tìm kiếm xung quanh vị trí chuẩn của mỗi fiducial (pixel)
+            min_score: Điểm số tối thiểu để chấp nhận
+            tracker: FiducialTracker của stream cho fiducial chính (xem match_template)
+        
+        Returns:
+            (MatchResult theo thứ tự fiducials, PanelPose từ các fiducial match thành công hoặc None)
+        """
+        if image is None or not fiducials:
+            return [], None
+        try:
+            prepared_list = [self.prepare_template(template) for template, _, _ in fiducials]
+            if self.angle_range > 0:
+                # Bank tạo trước ở thread gọi (không tạo đồng thời trong pool)
+                for prepared in prepared_list:
+                    self.get_rotated_bank(prepared)
+            
+            # Vùng bao các cửa sổ tìm kiếm: chuyển gray một lần, dùng chung khi các cửa sổ
+            # gần nhau (fiducial xa nhau: mỗi match_template chỉ chuyển cửa sổ của nó)
+            img_h, img_w = image.shape[:2]
+            windows = []
+            for prepared, (_, tpl_x, tpl_y) in zip(prepared_list, fiducials):
+                windows.append((max(0, tpl_x - search_margin), max(0, tpl_y - search_margin),
+                                min(img_w, tpl_x + prepared.width + search_margin),
+                                min(img_h, tpl_y + prepared.height + search_margin)))
+            x1, y1 = min(w[0] for w in windows), min(w[1] for w in windows)
+            x2, y2 = max(w[2] for w in windows), max(w[3] for w in windows)
+            window_area = sum(max(0, w[2] - w[0]) * max(0, w[3] - w[1]) for w in windows)
+            if image.ndim == 3 and x2 > x1 and y2 > y1 and (x2 - x1) * (y2 - y1) <= window_area:
+                shared = cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+            else:
+                shared, x1, y1 = image, 0, 0
+            
+            def match_one(index: int) -> MatchResult:
+                _, tpl_x, tpl_y = fiducials[index]
+                if index == 0 and tracker is not None:
+                    # Fiducial chính: cửa sổ tracking trên frame (tọa độ tuyệt đối của tracker)
+                    return self.match_template(image, prepared_list[0], tpl_x, tpl_y,
+                                               search_margin, min_score, tracker=tracker)
+                result = self.match_template(shared, prepared_list[index], tpl_x - x1, tpl_y - y1,
+                                             search_margin, min_score)
+                if not result.method:
+                    # Lỗi trước khi tìm (input / kích thước): không có vị trí để đổi tọa độ
+                    return result
+                return replace(result, x=result.x + x1, y=result.y + y1,
+                               sub_x=result.sub_x + x1, sub_y=result.sub_y + y1)
+            
+            if len(fiducials) == 1 or FIDUCIAL_MAX_WORKERS == 1:
+                results = [match_one(index) for index in range(len(fiducials))]
+            else:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=FIDUCIAL_MAX_WORKERS,
+                                                        thread_name_prefix="fiducial")
+                results = list(self._executor.map(match_one, range(len(fiducials))))
+            
+            # Tâm fiducial: master (vị trí chuẩn) -> frame (vị trí sub-pixel tìm được)
+            master_points, frame_points, angles = [], [], []
+            for prepared, (_, tpl_x, tpl_y), result in zip(prepared_list, fiducials, results):
+                if not result.success:
+                    continue
+                half_w, half_h = (prepared.width - 1) / 2.0, (prepared.height - 1) / 2.0
+                master_points.append((tpl_x + half_w, tpl_y + half_h))
+                frame_points.append((result.sub_x + half_w, result.sub_y + half_h))
+                angles.append(result.angle)
+            pose = estimate_pose(master_points, frame_points, angles)
+            if pose is not None:
+                logger.info(f"Panel pose from {pose.fiducials}/{len(fiducials)} fiducials: "
+                            f"offset=({pose.dx:+.2f}, {pose.dy:+.2f}), angle={pose.angle:+.2f}°, "
+                            f"scale={pose.scale:.4f}, residual={pose.residual:.2f}px")
+            return results, pose
+            
+        except Exception as e:
+            logger.error(f"Fiducial matching error: {e}", exc_info=True)
+            return [MatchResult(success=False, message=f"Exception: {str(e)}") for _ in fiducials], None
+    
     def check_tolerance(
         self,
         match_result: MatchResult,
@@ -201,7 +738,7 @@ class TemplateMatchingService:
         if abs(match_result.dy) > max_dy:
             return False, f"Y offset {match_result.dy:+d} exceeds limit ±{max_dy}"
         
-        # Check angle (TODO: implement rotation detection)
+        # Check angle
         if abs(match_result.angle) > max_angle:
             return False, f"Angle {match_result.angle:+.2f}° exceeds limit ±{max_angle}°"
         
@@ -5,10 +5,27 @@ Simple template system for CCD image processing with barcode scanning
 
 from .template_model import Template, CropRegion
 from .template_service import TemplateService
+from .scan_result import RegionScanResult, PyramidStats
+from .quality_gate import QualityReport
+from .region_crops import RegionCrops
+from .decode_budget import DecodeDeadline
+from .code_tracker import CodeTracker
+from .result_consensus import ResultConsensus, StableResult
+from .decoder_backends import DecoderBackend, available_symbologies
 
 __all__ = [
     'Template',
     'CropRegion',
-    'TemplateService'
+    'TemplateService',
+    'RegionScanResult',
+    'PyramidStats',
+    'QualityReport',
+    'RegionCrops',
+    'DecodeDeadline',
+    'CodeTracker',
+    'ResultConsensus',
+    'StableResult',
+    'DecoderBackend',
+    'available_symbologies'
 ]
 
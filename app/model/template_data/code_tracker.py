@@ -0,0 +1,92 @@
+"""
+Code Tracker - Theo dõi vị trí DataMatrix giữa các frame (streaming)
+Nhớ rect + method thành công gần nhất của từng region để frame sau
+chỉ cần một lần decode rẻ trong cửa sổ nhỏ quanh vị trí cũ
+"""
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from .preprocess_workspace import PreprocessWorkspace
+from .scan_result import RegionScanResult, SCAN_OK
+
+logger = logging.getLogger(__name__)
+
+# Cửa sổ tìm kiếm = rect code mở rộng thêm tỉ lệ này của cạnh code mỗi phía
+TRACK_WINDOW_MARGIN = 0.5
+TRACK_MIN_MARGIN = 16
+
+
+@dataclass
+class TrackedCode:
+    """Trạng thái tracking của một region"""
+    # Bounding rect (x, y, w, h) của các code, tọa độ ảnh
+    rect: Tuple[int, int, int, int]
+    method: int
+    workspace: Optional[PreprocessWorkspace] = None
+    hits: int = 0
+
+
+class CodeTracker:
+    """
+    Tracker cho streaming mode
+    - update(): ghi nhận kết quả scan của region (thành công -> nhớ, miss -> quên)
+    - get_window(): cửa sổ tìm kiếm nhỏ cho frame tiếp theo
+    """
+
+    def __init__(self):
+        self._tracks: Dict[str, TrackedCode] = {}
+
+    def reset(self):
+        """Quên toàn bộ vị trí (đổi template / dừng stream)"""
+        self._tracks.clear()
+
+    def get(self, region_name: str) -> Optional[TrackedCode]:
+        return self._tracks.get(region_name)
+
+    def update(self, result: RegionScanResult):
+        """Cập nhật tracking theo kết quả scan của region"""
+        if result.status != SCAN_OK or not result.rects or result.method is None:
+            if self._tracks.pop(result.region_name, None) is not None:
+                logger.debug(f"Tracking lost for '{result.region_name}'")
+            return
+
+        x1 = min(r[0] for r in result.rects)
+        y1 = min(r[1] for r in result.rects)
+        x2 = max(r[0] + r[2] for r in result.rects)
+        y2 = max(r[1] + r[3] for r in result.rects)
+        rect = (x1, y1, x2 - x1, y2 - y1)
+
+        track = self._tracks.get(result.region_name)
+        if track is None:
+            self._tracks[result.region_name] = TrackedCode(rect=rect, method=result.method, hits=1)
+        else:
+            track.rect = rect
+            track.method = result.method
+            track.hits += 1
+
+    def get_window(self, region_name: str, bounds: Tuple[int, int, int, int]) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Cửa sổ tìm kiếm quanh vị trí code cũ, giới hạn trong region
+
+        Args:
+            region_name: Tên region
+            bounds: Region đã clamp (x, y, w, h), tọa độ ảnh
+
+        Returns:
+            (x, y, w, h) hoặc None nếu region chưa được track
+        """
+        track = self._tracks.get(region_name)
+        if track is None:
+            return None
+
+        x, y, w, h = track.rect
+        margin = max(TRACK_MIN_MARGIN, int(TRACK_WINDOW_MARGIN * max(w, h)))
+        bx, by, bw, bh = bounds
+        x1 = max(bx, x - margin)
+        y1 = max(by, y - margin)
+        x2 = min(bx + bw, x + w + margin)
+        y2 = min(by + bh, y + h + margin)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2 - x1, y2 - y1
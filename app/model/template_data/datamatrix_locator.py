@@ -0,0 +1,140 @@
+"""
+DataMatrix Locator - Định vị nhanh các vùng có thể chứa DataMatrix trong crop region
+Gradient density + morphology blobs, lọc theo độ vuông của contour,
+trả về các patch nhỏ đã cắt sát và xoay thẳng cho decoder (theo thứ tự điểm số)
+"""
+import logging
+import math
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Ảnh làm việc của locator được thu nhỏ về cạnh dài tối đa này (px)
+LOCATOR_WORK_SIZE = 320
+
+# Cạnh code nhỏ nhất (px, ảnh gốc) mà locator xét tới
+LOCATOR_MIN_EDGE = 12
+
+# Quiet zone thêm quanh patch (tỉ lệ theo cạnh code)
+PATCH_PADDING = 0.25
+
+# Ngưỡng lọc contour
+MIN_SQUARENESS = 0.6  # cạnh ngắn / cạnh dài (symbol vuông)
+MIN_RECT_SQUARENESS = 0.2  # symbol chữ nhật (8x18 ... 16x48)
+MIN_FILL_RATIO = 0.5  # diện tích contour / diện tích minAreaRect
+
+
+@dataclass
+class CodeCandidate:
+    """Vùng nghi là DataMatrix"""
+    # Bounding box (x, y, w, h) theo tọa độ ROI
+    bbox: Tuple[int, int, int, int]
+    # Cạnh dài của minAreaRect (px, tọa độ ROI)
+    edge: float
+    # Góc xoay đã bù khi cắt patch (độ)
+    angle: float
+    score: float
+    # Patch đã xoay thẳng, có quiet zone
+    patch: np.ndarray
+
+
+def _extract_patch(gray: np.ndarray, center: Tuple[float, float], size: Tuple[float, float],
+                   angle: float) -> np.ndarray:
+    """Warp chỉ vùng candidate thành patch thẳng (chi phí theo kích thước patch, không theo ROI)"""
+    w, h = size
+    pad = PATCH_PADDING * max(w, h)
+    pw = max(1, int(round(w + 2 * pad)))
+    ph = max(1, int(round(h + 2 * pad)))
+    m = cv2.getRotationMatrix2D(center, angle, 1.0)
+    m[0, 2] += pw / 2.0 - center[0]
+    m[1, 2] += ph / 2.0 - center[1]
+    return cv2.warpAffine(gray, m, (pw, ph), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def locate_datamatrix_candidates(gray: np.ndarray, expected_edge: int = 0, symbol_shape: str = "auto",
+                                 max_candidates: int = 3) -> List[CodeCandidate]:
+    """
+    Tìm các vùng nghi là DataMatrix trong ảnh gray của crop region
+
+    Args:
+        gray: ROI gray image
+        expected_edge: Cạnh code đã học (px), 0 = chưa biết
+        symbol_shape: "auto", "square" hoặc "rect"
+        max_candidates: Số candidate tối đa trả về
+
+    Returns:
+        List of CodeCandidate, điểm cao nhất trước
+    """
+    roi_h, roi_w = gray.shape[:2]
+    scale = min(1.0, LOCATOR_WORK_SIZE / float(max(roi_h, roi_w)))
+    if scale < 1.0:
+        work = cv2.resize(gray, (max(1, int(roi_w * scale)), max(1, int(roi_h * scale))),
+                          interpolation=cv2.INTER_AREA)
+    else:
+        work = gray
+
+    # Vùng code = mật độ gradient cao: morphological gradient -> Otsu -> close thành blob
+    kernel3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    gradient = cv2.morphologyEx(work, cv2.MORPH_GRADIENT, kernel3)
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    close_size = 5
+    if expected_edge > 0:
+        close_size = max(3, int(expected_edge * scale / 6) | 1)
+    blobs = cv2.morphologyEx(
+        edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (close_size, close_size))
+    )
+    blobs = cv2.morphologyEx(blobs, cv2.MORPH_OPEN, kernel3)
+
+    contours, _ = cv2.findContours(blobs, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_squareness = MIN_SQUARENESS if symbol_shape == "square" else MIN_RECT_SQUARENESS
+    if expected_edge > 0:
+        min_edge, max_edge = expected_edge * 0.6, expected_edge * 1.6
+    else:
+        min_edge, max_edge = LOCATOR_MIN_EDGE, 0.95 * max(roi_h, roi_w)
+
+    # Chấm điểm + hình học trước, chỉ warp patch của max_candidates candidate tốt nhất
+    scored = []
+    for contour in contours:
+        (cx, cy), (rw, rh), angle = cv2.minAreaRect(contour)
+        long_side, short_side = max(rw, rh), min(rw, rh)
+        if short_side <= 0:
+            continue
+        edge = long_side / scale
+        if edge < min_edge or edge > max_edge:
+            continue
+        squareness = short_side / long_side
+        if squareness < min_squareness:
+            continue
+        fill = cv2.contourArea(contour) / (rw * rh)
+        if fill < MIN_FILL_RATIO:
+            continue
+
+        x, y, w, h = cv2.boundingRect(contour)
+        density = float(cv2.mean(edges[y:y + h, x:x + w])[0]) / 255.0
+        score = squareness * fill * density
+
+        # Góc của cạnh đầu tiên -> xoay để cạnh đó nằm ngang; kích thước patch lấy theo chính
+        # cạnh 0->1 (ngang) và 1->2 (dọc), không theo (rw, rh) - thứ tự đó không khớp với boxPoints
+        box = cv2.boxPoints(((cx, cy), (rw, rh), angle))
+        dx, dy = box[1][0] - box[0][0], box[1][1] - box[0][1]
+        deskew = math.degrees(math.atan2(dy, dx))
+        size = (math.hypot(dx, dy), math.hypot(box[2][0] - box[1][0], box[2][1] - box[1][1]))
+
+        scored.append((score, edge, deskew, (cx, cy), size, (x, y, w, h)))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    if scored:
+        logger.debug(f"DataMatrix locator: {len(scored)} candidate(s), best score {scored[0][0]:.2f}")
+
+    inv = 1.0 / scale
+    candidates = []
+    for score, edge, deskew, (cx, cy), (sw, sh), (x, y, w, h) in scored[:max_candidates]:
+        patch = _extract_patch(gray, (cx * inv, cy * inv), (sw * inv, sh * inv), deskew)
+        bbox = (int(x * inv), int(y * inv), int(math.ceil(w * inv)), int(math.ceil(h * inv)))
+        candidates.append(CodeCandidate(bbox=bbox, edge=edge, angle=deskew, score=score, patch=patch))
+    return candidates
@@ -0,0 +1,73 @@
+"""
+Decode Budget - Giới hạn thời gian decode cho một lần inspection
+Chia ngân sách cho các region và các attempt, timeout của decoder giảm dần khi gần hết giờ
+"""
+import time
+from typing import Optional
+
+# Timeout mặc định / tối đa của một lần decode (ms) - như testbase.py
+MAX_ATTEMPT_TIMEOUT_MS = 100
+
+# Dưới mức này không đủ thời gian cho một attempt có ý nghĩa
+MIN_ATTEMPT_TIMEOUT_MS = 10
+
+
+class DecodeDeadline:
+    """
+    Deadline cho scan_barcodes
+    - Mỗi region nhận phần đều của thời gian còn lại (phần dư chuyển cho region sau)
+    - Mỗi attempt nhận timeout = min(100ms, thời gian còn lại của region)
+    - exhausted = True khi có attempt/region bị bỏ qua vì hết ngân sách
+    """
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = float(budget_ms)
+        self._start = time.perf_counter()
+        self._deadline = self._start + self.budget_ms / 1000.0
+        self._region_deadline = self._deadline
+        self.exhausted = False
+
+    def remaining_ms(self) -> float:
+        """Thời gian còn lại của toàn bộ inspection (ms)"""
+        return max(0.0, (self._deadline - time.perf_counter()) * 1000.0)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000.0
+
+    def start_region(self, regions_left: int) -> bool:
+        """
+        Bắt đầu một region, chia đều thời gian còn lại
+
+        Args:
+            regions_left: Số region còn phải scan (kể cả region này)
+
+        Returns:
+            False nếu không còn đủ thời gian cho region này
+        """
+        remaining = self.remaining_ms()
+        if remaining < MIN_ATTEMPT_TIMEOUT_MS:
+            self.exhausted = True
+            return False
+        share_ms = remaining / max(1, regions_left)
+        self._region_deadline = time.perf_counter() + share_ms / 1000.0
+        return True
+
+    def region_remaining_ms(self) -> float:
+        deadline = min(self._region_deadline, self._deadline)
+        return max(0.0, (deadline - time.perf_counter()) * 1000.0)
+
+    def attempt_timeout_ms(self, expected_preprocess_ms: float = 0.0) -> Optional[int]:
+        """
+        Timeout cho attempt tiếp theo của region hiện tại
+
+        Args:
+            expected_preprocess_ms: Thời gian tiền xử lý dự kiến của method (đo từ các lần trước)
+
+        Returns:
+            Timeout (ms) cho decoder, hoặc None nếu không đủ thời gian (bỏ qua attempt)
+        """
+        available = self.region_remaining_ms() - expected_preprocess_ms
+        if available < MIN_ATTEMPT_TIMEOUT_MS:
+            self.exhausted = True
+            return None
+        return int(min(MAX_ATTEMPT_TIMEOUT_MS, available))
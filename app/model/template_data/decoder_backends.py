@@ -0,0 +1,251 @@
+"""
+Decoder Backends - Các decoder barcode dùng chung interface cho TemplateService
+Mỗi backend khai báo symbology nó đọc được; backend chỉ được đăng ký khi thư viện có mặt lúc chạy
+"""
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import cv2
+import numpy as np
+
+# Try to import pylibdmtx for DataMatrix support
+try:
+    from pylibdmtx.pylibdmtx import decode as dmtx_decode
+    DMTX_AVAILABLE = True
+except ImportError:
+    DMTX_AVAILABLE = False
+    logging.warning("pylibdmtx not available - DataMatrix detection disabled")
+
+# Optional backends
+try:
+    import zxingcpp
+    ZXING_AVAILABLE = True
+except ImportError:
+    ZXING_AVAILABLE = False
+
+try:
+    from pyzbar import pyzbar
+    PYZBAR_AVAILABLE = True
+except ImportError:
+    PYZBAR_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Symbology của CropRegion
+SYMBOLOGY_DATAMATRIX = "datamatrix"
+SYMBOLOGY_QR = "qr"
+SYMBOLOGY_LINEAR = "barcode"  # 1D: Code128, Code39, EAN, ...
+SYMBOLOGY_AUTO = "auto"  # Phân loại bằng symbology_classifier
+SYMBOLOGIES = (SYMBOLOGY_DATAMATRIX, SYMBOLOGY_QR, SYMBOLOGY_LINEAR)
+
+# (data, (x, y, w, h)) - rect theo tọa độ ảnh đưa vào decoder (gốc trên-trái)
+DecodedSymbol = Tuple[str, Tuple[int, int, int, int]]
+
+
+def _points_to_rect(points) -> Tuple[int, int, int, int]:
+    """Bounding rect của polygon 4 góc"""
+    xs = [float(p[0]) for p in points]
+    ys = [float(p[1]) for p in points]
+    x, y = int(min(xs)), int(min(ys))
+    return x, y, int(max(xs)) - x, int(max(ys)) - y
+
+
+class DecoderBackend(ABC):
+    """
+    Interface decoder
+    - symbologies: các symbology backend đọc được
+    - decode(): nhận ảnh gray (buffer của workspace) + decode kwargs của region,
+      mỗi backend chỉ dùng các tham số nó hiểu
+    """
+
+    name = "base"
+    symbologies: Tuple[str, ...] = ()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    @abstractmethod
+    def decode(self, image: np.ndarray, symbology: str, **kwargs: Any) -> List[DecodedSymbol]:
+        """
+        Decode symbol trong ảnh
+
+        Args:
+            image: Ảnh gray
+            symbology: Symbology cần đọc (một trong self.symbologies)
+            **kwargs: Decode kwargs của region (timeout, max_count, min_edge, ...)
+
+        Returns:
+            List of (data, (x, y, w, h))
+        """
+
+
+class PylibdmtxBackend(DecoderBackend):
+    """DataMatrix qua libdmtx (hỗ trợ timeout, max_count, min/max_edge, shape, shrink)"""
+
+    name = "pylibdmtx"
+    symbologies = (SYMBOLOGY_DATAMATRIX,)
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return DMTX_AVAILABLE
+
+    def decode(self, image: np.ndarray, symbology: str, **kwargs: Any) -> List[DecodedSymbol]:
+        symbols: List[DecodedSymbol] = []
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = 100
+
+        try:
+            dmtx_codes = dmtx_decode(image, **kwargs)
+
+            if dmtx_codes:
+                image_h = image.shape[0]
+                for dmtx_code in dmtx_codes:
+                    data = dmtx_code.data.decode('utf-8', errors='ignore')
+                    if not data or any(data == d for d, _ in symbols):
+                        continue
+                    # libdmtx rect: gốc dưới-trái, width/height có thể âm khi code xoay
+                    left, bottom, rw, rh = dmtx_code.rect
+                    x = min(left, left + rw)
+                    h = abs(rh)
+                    y = image_h - min(bottom, bottom + rh) - h
+                    symbols.append((data, (int(x), int(y), int(abs(rw)), int(h))))
+                    # Log với rect info như testbase.py
+                    logger.info(f"✅ DataMatrix (pylibdmtx) detected: {data}")
+                    logger.info(f"📐 Rect: {dmtx_code.rect}")
+
+        except Exception as e:
+            logger.debug(f"pylibdmtx decode failed: {e}")
+
+        return symbols
+
+
+class OpenCVQRBackend(DecoderBackend):
+    """QR code qua cv2.QRCodeDetector (detector tạo một lần cho mỗi backend)"""
+
+    name = "opencv_qr"
+    symbologies = (SYMBOLOGY_QR,)
+
+    def __init__(self):
+        self._detector = cv2.QRCodeDetector()
+
+    def decode(self, image: np.ndarray, symbology: str, **kwargs: Any) -> List[DecodedSymbol]:
+        symbols: List[DecodedSymbol] = []
+
+        try:
+            retval, decoded_info, points, _ = self._detector.detectAndDecodeMulti(image)
+
+            if retval:
+                for i, data in enumerate(decoded_info):
+                    if not data or any(data == d for d, _ in symbols):
+                        continue
+                    rect = (0, 0, image.shape[1], image.shape[0])
+                    if points is not None and len(points) > i:
+                        rect = _points_to_rect(points[i])
+                    symbols.append((data, rect))
+                    logger.debug(f"QR code detected (OpenCV): {data}")
+
+        except Exception as e:
+            logger.debug(f"OpenCV QR detection failed: {e}")
+
+        return symbols
+
+
+class ZxingCppBackend(DecoderBackend):
+    """zxing-cpp (DataMatrix, QR, 1D) - chỉ dùng khi package zxingcpp được cài"""
+
+    name = "zxingcpp"
+    symbologies = (SYMBOLOGY_DATAMATRIX, SYMBOLOGY_QR, SYMBOLOGY_LINEAR)
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return ZXING_AVAILABLE
+
+    def __init__(self):
+        formats = zxingcpp.BarcodeFormat
+        self._formats = {
+            SYMBOLOGY_DATAMATRIX: formats.DataMatrix,
+            SYMBOLOGY_QR: formats.QRCode,
+            SYMBOLOGY_LINEAR: getattr(formats, 'LinearCodes', None),
+        }
+
+    def decode(self, image: np.ndarray, symbology: str, **kwargs: Any) -> List[DecodedSymbol]:
+        symbols: List[DecodedSymbol] = []
+
+        try:
+            fmt = self._formats.get(symbology)
+            results = zxingcpp.read_barcodes(image, formats=fmt) if fmt is not None else zxingcpp.read_barcodes(image)
+            for result in results:
+                data = result.text
+                if not data or any(data == d for d, _ in symbols):
+                    continue
+                pos = result.position
+                rect = _points_to_rect([(p.x, p.y) for p in (pos.top_left, pos.top_right,
+                                                             pos.bottom_right, pos.bottom_left)])
+                symbols.append((data, rect))
+                logger.debug(f"{symbology} detected (zxing-cpp): {data}")
+
+        except Exception as e:
+            logger.debug(f"zxing-cpp decode failed: {e}")
+
+        return symbols
+
+
+class PyzbarBackend(DecoderBackend):
+    """ZBar (QR, 1D) - chỉ dùng khi package pyzbar được cài"""
+
+    name = "pyzbar"
+    symbologies = (SYMBOLOGY_QR, SYMBOLOGY_LINEAR)
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return PYZBAR_AVAILABLE
+
+    def decode(self, image: np.ndarray, symbology: str, **kwargs: Any) -> List[DecodedSymbol]:
+        symbols: List[DecodedSymbol] = []
+
+        try:
+            for result in pyzbar.decode(image):
+                is_qr = result.type == 'QRCODE'
+                if is_qr != (symbology == SYMBOLOGY_QR):
+                    continue
+                data = result.data.decode('utf-8', errors='ignore')
+                if not data or any(data == d for d, _ in symbols):
+                    continue
+                left, top, width, height = result.rect
+                symbols.append((data, (int(left), int(top), int(width), int(height))))
+                logger.debug(f"{symbology} detected (pyzbar): {data}")
+
+        except Exception as e:
+            logger.debug(f"pyzbar decode failed: {e}")
+
+        return symbols
+
+
+# Thứ tự ưu tiên: backend đầu tiên có mặt lúc chạy đọc symbology đó sẽ được dùng
+BACKEND_PRIORITY: List[Type[DecoderBackend]] = [
+    PylibdmtxBackend,
+    OpenCVQRBackend,
+    ZxingCppBackend,
+    PyzbarBackend,
+]
+
+
+def create_decoder(symbology: str) -> Optional[DecoderBackend]:
+    """
+    Tạo decoder cho symbology (backend ưu tiên cao nhất đang có mặt)
+
+    Returns:
+        DecoderBackend hoặc None nếu không có backend nào đọc được symbology này
+    """
+    for backend_cls in BACKEND_PRIORITY:
+        if symbology in backend_cls.symbologies and backend_cls.is_available():
+            return backend_cls()
+    return None
+
+
+def available_symbologies() -> List[str]:
+    """Các symbology có ít nhất một backend lúc chạy"""
+    return [s for s in SYMBOLOGIES
+            if any(s in b.symbologies and b.is_available() for b in BACKEND_PRIORITY)]
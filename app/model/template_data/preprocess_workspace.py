@@ -0,0 +1,316 @@
+"""
+Preprocess Workspace - Bộ đệm tiền xử lý barcode cho từng region
+Giữ sẵn các buffer đích (dst=) và các đối tượng OpenCV (CLAHE, kernel)
+để quá trình scan liên tục gần như không cấp phát bộ nhớ mới
+"""
+import logging
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from .temporal_denoise import TemporalAverager, temporal_frame_count
+
+logger = logging.getLogger(__name__)
+
+
+# Mỗi method là một chuỗi stage áp dụng lên ảnh gray (xem TemplateService.get_method_name)
+# Các method có chung tiền tố (vd. 9/10/11, 7/8) dùng lại kết quả stage đã tính trong cùng frame
+METHOD_STAGES: Dict[int, Tuple[str, ...]] = {
+    0: (),                                                   # Original - no processing
+    1: ('clahe_strong', 'otsu'),                             # CLAHE + Binarization
+    2: ('clahe_strong', 'nlm', 'otsu'),                      # CLAHE + Light Denoise + Binarization
+    3: ('adaptive11',),                                      # Adaptive threshold
+    4: ('otsu',),                                            # Otsu threshold only
+    5: ('clahe_strong',),                                    # CLAHE only (no binarization)
+    6: ('nlm', 'clahe_strong', 'otsu'),                      # Denoise + CLAHE + Binarization
+    7: ('invert', 'clahe_strong', 'nlm', 'otsu'),            # Invert + CLAHE + Denoise + Binarization
+    8: ('invert',),                                          # Invert only
+    9: ('clahe_soft', 'median3', 'adaptive31', 'close3'),    # Testbase full (+ Morphology)
+    10: ('clahe_soft', 'median3', 'adaptive31'),             # Testbase without morphology
+    11: ('clahe_soft',),                                     # Testbase CLAHE only (clipLimit=2.0)
+}
+
+# Temporal denoise (streaming): các method có NLM dùng ảnh trung bình N frame thay cho
+# fastNlMeansDenoising; CLAHE / invert áp dụng lên ảnh đã trung bình (2 và 6 trở thành như nhau)
+TEMPORAL_METHOD_STAGES: Dict[int, Tuple[str, ...]] = {
+    2: ('temporal', 'clahe_strong', 'otsu'),                 # Temporal average + CLAHE + Binarization
+    6: ('temporal', 'clahe_strong', 'otsu'),                 # Temporal average + CLAHE + Binarization
+    7: ('temporal', 'invert', 'clahe_strong', 'otsu'),       # Temporal average + Invert + CLAHE + Binarization
+}
+
+StageKey = Tuple[str, ...]
+
+# Chi phí ước lượng ban đầu của từng stage (ms / megapixel) khi chưa đo được trên máy:
+# ~2x thời gian đo trên PC xưởng, để method đắt (NLM) không bị coi là miễn phí ở các lần scan đầu
+STAGE_COST_SEED_MS_PER_MPX: Dict[str, float] = {
+    'temporal': 1.0,
+    'invert': 1.0,
+    'clahe_strong': 20.0,
+    'clahe_soft': 20.0,
+    'nlm': 3000.0,
+    'otsu': 2.0,
+    'adaptive11': 15.0,
+    'median3': 2.0,
+    'adaptive31': 25.0,
+    'close3': 2.0,
+    # Stage ngoài tiền xử lý (TemplateService), cũng được tính vào decode budget
+    'presence': 4.0,
+    'quality': 8.0,
+    'locator': 20.0,
+}
+
+
+def method_stage_keys(methods: Iterable[int]) -> Tuple[StageKey, ...]:
+    """Tất cả stage (tiền tố, không trùng) mà các method cần, theo thứ tự tính"""
+    keys = []
+    for method in methods:
+        stages = METHOD_STAGES.get(method, ())
+        for i in range(1, len(stages) + 1):
+            if stages[:i] not in keys:
+                keys.append(stages[:i])
+    return tuple(keys)
+
+
+class StageCosts:
+    """
+    Thời gian tiền xử lý của từng stage (ms / megapixel, EMA), dùng cho decode budget
+    - Khởi tạo bằng ước lượng thận trọng (STAGE_COST_SEED_MS_PER_MPX), thay bằng số đo thật từ lần chạy đầu
+    - Theo stage chứ không theo method: method 6 dùng chi phí NLM đã đo ở method 2
+    - Chuẩn hóa theo diện tích: giữ nguyên khi workspace đổi kích thước, dùng chung giữa các workspace
+    """
+
+    def __init__(self):
+        self.ms_per_mpx: Dict[str, float] = dict(STAGE_COST_SEED_MS_PER_MPX)
+        self._measured: Set[str] = set()
+
+    def record(self, stage: str, elapsed_ms: float, pixels: int):
+        """Cập nhật chi phí stage từ một lần chạy trên ảnh pixels điểm ảnh"""
+        cost = elapsed_ms * 1e6 / max(1, pixels)
+        if stage not in self._measured:
+            self._measured.add(stage)
+            self.ms_per_mpx[stage] = cost
+        else:
+            self.ms_per_mpx[stage] = 0.7 * self.ms_per_mpx[stage] + 0.3 * cost
+
+    def estimate_ms(self, stages: Iterable[str], pixels: int) -> float:
+        """Thời gian dự kiến (ms) của các stage trên ảnh pixels điểm ảnh"""
+        return sum(self.ms_per_mpx.get(stage, 0.0) for stage in stages) * pixels / 1e6
+
+
+class PreprocessWorkspace:
+    """
+    Workspace tiền xử lý cho một crop region
+    - Mỗi stage có buffer riêng (cấp phát theo kích thước region khi load template)
+    - Trong một frame, stage đã tính được dùng lại cho các method sau (memoization theo tiền tố)
+    - CLAHE và structuring element được tạo một lần và dùng lại
+    - Kết quả trả về là buffer nội bộ, chỉ hợp lệ đến lần load tiếp theo
+    """
+
+    def __init__(self, width: int, height: int, preallocate: bool = True,
+                 methods: Iterable[int] = tuple(METHOD_STAGES),
+                 costs: Optional[StageCosts] = None):
+        # Cached OpenCV objects
+        self._clahe_strong = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        self._clahe_soft = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self._close_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+        self._buffers: Dict[StageKey, np.ndarray] = {}
+        # Stage đã tính cho ảnh gray hiện tại
+        self._valid: Set[StageKey] = set()
+        # Thời gian tiền xử lý của từng stage (dùng chung khi service truyền vào) - cho decode budget
+        self.costs = costs if costs is not None else StageCosts()
+        self.shape: Tuple[int, int] = (max(1, int(height)), max(1, int(width)))
+        # Temporal denoise: ring buffer các frame trước (tạo khi dùng lần đầu)
+        self._averager: Optional[TemporalAverager] = None
+        # Ảnh trung bình của frame hiện tại (None = method dùng NLM như bình thường)
+        self._temporal_frame: Optional[np.ndarray] = None
+        # Số thứ tự frame (streaming) lần cuối đưa vào ring buffer - phát hiện frame bị bỏ qua
+        self._temporal_sequence: Optional[int] = None
+
+        if preallocate:
+            self._buffer(())
+            for key in method_stage_keys(methods):
+                self._buffer(key)
+
+    def _buffer(self, key: StageKey) -> np.ndarray:
+        """Get (or lazily allocate) the destination buffer of a stage (() = gray)"""
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = np.empty(self.shape, dtype=np.uint8)
+            self._buffers[key] = buf
+        return buf
+
+    def ensure_shape(self, height: int, width: int):
+        """Re-size buffers nếu ROI thực tế khác kích thước đã cấp phát (ảnh nhỏ hơn template)"""
+        shape = (int(height), int(width))
+        if shape == self.shape:
+            return
+        logger.debug(f"Workspace resized {self.shape} -> {shape}")
+        preallocated = list(self._buffers.keys())
+        self.shape = shape
+        self._buffers = {}
+        self._valid.clear()
+        for key in preallocated:
+            self._buffer(key)
+
+    def estimate_ms(self, method: int) -> float:
+        """Thời gian dự kiến (ms) để chạy method trên frame hiện tại (stage đã tính trong frame thì miễn phí)"""
+        stages = self.method_stages(method)
+        pending = [stages[i - 1] for i in range(1, len(stages) + 1) if stages[:i] not in self._valid]
+        return self.costs.estimate_ms(pending, self.shape[0] * self.shape[1])
+
+    def _update_temporal(self, gray: np.ndarray, temporal_frames: int, sequence: Optional[int] = None):
+        """
+        Đưa frame vào ring buffer (temporal_frames > 0) và lấy ảnh trung bình cho stage 'temporal'
+
+        Args:
+            gray: Ảnh gray của frame hiện tại
+            temporal_frames: Số frame trung bình (<= 0 = tắt)
+            sequence: Số thứ tự frame của stream (None = coi như liên tiếp). Workspace không được
+                load ở mọi frame (vd. độ phân giải gốc khi pyramid decode chỉ lên khi cần):
+                frame không liền kề frame trước thì bỏ lịch sử, không trung bình các frame cách xa nhau
+        """
+        if temporal_frames <= 0:
+            self._temporal_frame = None
+            self._temporal_sequence = None
+            return
+        if self._averager is None or self._averager.frames != temporal_frame_count(temporal_frames):
+            self._averager = TemporalAverager(temporal_frames)
+        if sequence is not None and self._temporal_sequence is not None:
+            if sequence == self._temporal_sequence:
+                # Cùng frame load lại: không cộng hai lần
+                return
+            if sequence != self._temporal_sequence + 1:
+                self._averager.reset()
+        self._temporal_sequence = sequence
+        self._temporal_frame = self._averager.push(gray)
+
+    def reset_temporal(self):
+        """Bỏ lịch sử temporal denoise (streaming dừng / template đổi)"""
+        if self._averager is not None:
+            self._averager.reset()
+        self._temporal_frame = None
+        self._temporal_sequence = None
+
+    def method_stages(self, method: int) -> Tuple[str, ...]:
+        """Stage của method cho frame hiện tại (temporal average thay NLM nếu có)"""
+        if self._temporal_frame is not None and method in TEMPORAL_METHOD_STAGES:
+            return TEMPORAL_METHOD_STAGES[method]
+        return METHOD_STAGES.get(method, ())
+
+    def distinct_methods(self, methods: Iterable[int]) -> Tuple[int, ...]:
+        """Bỏ method có chuỗi stage trùng method trước đó ở frame hiện tại (temporal: 2 và 6 như nhau)"""
+        seen = set()
+        distinct = []
+        for method in methods:
+            stages = self.method_stages(method)
+            if stages not in seen:
+                seen.add(stages)
+                distinct.append(method)
+        return tuple(distinct)
+
+    def load(self, roi: np.ndarray, temporal_frames: int = 0, sequence: Optional[int] = None) -> np.ndarray:
+        """
+        Copy ROI (có thể là view không liên tục) vào buffer gray
+
+        Args:
+            roi: ROI image (mono hoặc BGR)
+            temporal_frames: > 0: trung bình với các frame trước (streaming, thay NLM)
+            sequence: Số thứ tự frame của stream (xem _update_temporal)
+
+        Returns:
+            Gray buffer
+        """
+        self.ensure_shape(roi.shape[0], roi.shape[1])
+        self._valid.clear()
+        gray = self._buffer(())
+        if len(roi.shape) == 3:
+            cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            np.copyto(gray, roi)
+        self._update_temporal(gray, temporal_frames, sequence)
+        return gray
+
+    def load_scaled(self, roi: np.ndarray, scale: float, temporal_frames: int = 0,
+                    sequence: Optional[int] = None) -> np.ndarray:
+        """
+        Thu nhỏ ROI (INTER_AREA) trực tiếp vào buffer gray (pyramid decode)
+
+        Args:
+            roi: ROI image (mono hoặc BGR)
+            scale: Tỉ lệ thu nhỏ (0 < scale < 1)
+            temporal_frames: > 0: trung bình với các frame trước (streaming, thay NLM)
+            sequence: Số thứ tự frame của stream (xem _update_temporal)
+
+        Returns:
+            Gray buffer (kích thước đã thu nhỏ)
+        """
+        src = roi
+        if len(roi.shape) == 3:
+            src = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        height = max(1, int(round(roi.shape[0] * scale)))
+        width = max(1, int(round(roi.shape[1] * scale)))
+        self.ensure_shape(height, width)
+        self._valid.clear()
+        gray = self._buffer(())
+        cv2.resize(src, (width, height), dst=gray, interpolation=cv2.INTER_AREA)
+        self._update_temporal(gray, temporal_frames, sequence)
+        return gray
+
+    def _run_stage(self, stage: str, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        if stage == 'temporal':
+            # Ảnh trung bình N frame (thay cho ảnh gray của frame hiện tại)
+            np.copyto(dst, self._temporal_frame)
+            return dst
+        if stage == 'invert':
+            return cv2.bitwise_not(src, dst=dst)
+        if stage == 'clahe_strong':
+            return self._clahe_strong.apply(src, dst)
+        if stage == 'clahe_soft':
+            return self._clahe_soft.apply(src, dst)
+        if stage == 'nlm':
+            # Light denoising (h=10 is light, h=20 is stronger)
+            cv2.fastNlMeansDenoising(src, dst, h=10, templateWindowSize=7, searchWindowSize=21)
+            return dst
+        if stage == 'otsu':
+            cv2.threshold(src, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
+            return dst
+        if stage == 'adaptive11':
+            # Adaptive threshold (good for varying lighting)
+            return cv2.adaptiveThreshold(src, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                         cv2.THRESH_BINARY, 11, 2, dst=dst)
+        if stage == 'median3':
+            return cv2.medianBlur(src, 3, dst=dst)
+        if stage == 'adaptive31':
+            # Testbase adaptive threshold (testbase.py)
+            return cv2.adaptiveThreshold(src, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                         cv2.THRESH_BINARY, 31, 5, dst=dst)
+        if stage == 'close3':
+            return cv2.morphologyEx(src, cv2.MORPH_CLOSE, self._close_kernel, dst=dst)
+        raise ValueError(f"Unknown preprocessing stage: {stage}")
+
+    def preprocess(self, method: int) -> np.ndarray:
+        """
+        Chạy một method tiền xử lý trên ảnh gray đã load
+
+        Args:
+            method: Preprocessing method number (xem TemplateService.get_method_name)
+
+        Returns:
+            Processed image (buffer nội bộ của workspace)
+        """
+        stages = self.method_stages(method)
+        result = self._buffer(())
+        for i in range(1, len(stages) + 1):
+            key = stages[:i]
+            dst = self._buffer(key)
+            if key not in self._valid:
+                t_stage = time.perf_counter()
+                self._run_stage(stages[i - 1], result, dst)
+                self.costs.record(stages[i - 1], (time.perf_counter() - t_stage) * 1000.0,
+                                  self.shape[0] * self.shape[1])
+                self._valid.add(key)
+            result = dst
+        return result
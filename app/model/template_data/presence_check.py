@@ -0,0 +1,60 @@
+"""
+Presence Check - Kiểm tra nhanh region có code hay không trước khi decode
+So mật độ cạnh + độ tương phản (ảnh thu nhỏ) với giá trị đo trên ảnh master;
+region trống (slot không có hàng / thiếu nhãn) trả về miss ngay, không chạy cascade
+"""
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from .template_model import CropRegion
+
+# Thu nhỏ (trung bình khối, khử nhiễu sensor) PRESENCE_STRIDE lần mỗi chiều (600x600 -> 150x150)
+PRESENCE_STRIDE = 4
+
+# Chênh lệch mức xám giữa hai mẫu kề nhau để tính là một cạnh
+PRESENCE_EDGE_STEP = 24
+
+# Region được coi là trống khi cả hai chỉ số thấp hơn tỉ lệ này so với ảnh master
+PRESENCE_MIN_EDGE_RATIO = 0.25
+PRESENCE_MIN_CONTRAST_RATIO = 0.5
+
+
+def measure_presence(roi: np.ndarray) -> Tuple[float, float]:
+    """
+    Đo mật độ cạnh và độ tương phản của ROI trên ảnh thu nhỏ
+
+    Args:
+        roi: ROI image (mono hoặc BGR, có thể là view)
+
+    Returns:
+        (edge_density 0-1, contrast = độ lệch chuẩn mức xám)
+    """
+    if roi.ndim == 3:
+        roi = roi[..., 1]
+    sample_w, sample_h = roi.shape[1] // PRESENCE_STRIDE, roi.shape[0] // PRESENCE_STRIDE
+    if sample_w < 2 or sample_h < 2:
+        return 0.0, 0.0
+    sample = cv2.resize(roi, (sample_w, sample_h), interpolation=cv2.INTER_AREA)
+
+    values = sample.astype(np.int16)
+    edges_x = np.abs(np.diff(values, axis=1)) > PRESENCE_EDGE_STEP
+    edges_y = np.abs(np.diff(values, axis=0)) > PRESENCE_EDGE_STEP
+    density = (float(edges_x.mean()) + float(edges_y.mean())) / 2.0
+    return density, float(values.std())
+
+
+def code_absent(roi: np.ndarray, region: CropRegion) -> bool:
+    """
+    True nếu region rõ ràng không có code (cần thống kê đã học từ ảnh master)
+
+    Args:
+        roi: ROI image của region
+        region: Crop region (presence_edge_density = 0 -> luôn False)
+    """
+    if region.presence_edge_density <= 0:
+        return False
+    density, contrast = measure_presence(roi)
+    return (density < PRESENCE_MIN_EDGE_RATIO * region.presence_edge_density and
+            contrast < PRESENCE_MIN_CONTRAST_RATIO * region.presence_contrast)
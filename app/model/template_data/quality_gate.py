@@ -0,0 +1,166 @@
+"""
+Quality Gate - Đánh giá chất lượng ảnh của region trước khi decode
+Focus (variance of Laplacian trên ảnh thu nhỏ), clipping (pixel cháy sáng / tối hẳn) và contrast;
+frame quá kém bị loại (streaming chờ frame sau), frame kém vừa chỉ chạy các method hợp với lỗi
+"""
+from dataclasses import dataclass
+from typing import Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Ảnh làm việc được thu nhỏ về cạnh dài tối đa này (px)
+QUALITY_WORK_SIZE = 160
+
+# Focus: so với focus của region trên ảnh master (chưa học: dùng ngưỡng tuyệt đối)
+FOCUS_MIN_RATIO = 0.35
+FOCUS_REJECT_RATIO = 0.15
+FOCUS_MIN_ABS = 40.0
+FOCUS_REJECT_ABS = 10.0
+
+# Clipping: tỉ lệ pixel <= 2 hoặc >= 253
+CLIP_MAX_FRACTION = 0.25
+CLIP_REJECT_FRACTION = 0.6
+
+# Contrast: khoảng mức xám p2-p98 (so với ảnh master nếu đã học, không vượt ngưỡng tuyệt đối)
+CONTRAST_MIN_RATIO = 0.5
+CONTRAST_REJECT_RATIO = 0.2
+CONTRAST_MIN = 40
+CONTRAST_REJECT = 12
+
+# Loại lỗi
+ISSUE_BLUR = "blur"
+ISSUE_CLIPPED = "clipped"
+ISSUE_LOW_CONTRAST = "low_contrast"
+
+# Method hợp với từng loại lỗi (theo thứ tự thử)
+# - blur: adaptive threshold / morphology giữ được module bị nhòe
+# - clipped: threshold toàn cục + invert, CLAHE chỉ khuếch đại vùng cháy
+# - low_contrast: CLAHE trước khi binarize
+ISSUE_METHODS = {
+    ISSUE_BLUR: (9, 10, 3, 0),
+    ISSUE_CLIPPED: (4, 3, 8, 0),
+    ISSUE_LOW_CONTRAST: (11, 9, 5, 1, 2),
+}
+
+# Method luôn giữ trong bộ rút gọn (testbase_full - method đọc được nhiều nhất), thử trước
+# nếu bộ của lỗi chưa có
+QUALITY_KEEP_METHODS = (9,)
+
+
+@dataclass(frozen=True)
+class QualityReport:
+    """Chất lượng ảnh của một region"""
+    focus: float
+    clipped: float
+    contrast: float
+    issues: Tuple[str, ...] = ()
+    # Lỗi nặng: không đáng decode (streaming bỏ frame)
+    reject: bool = False
+    # ROI gần như phẳng (contrast dưới ngưỡng loại): không có code / thiếu nhãn - region trống,
+    # không phải frame hỏng (streaming đếm như region không có code, không bỏ frame)
+    flat: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    def summary(self) -> str:
+        return (f"focus={self.focus:.0f}, clipped={self.clipped:.0%}, contrast={self.contrast:.0f}"
+                + (f" [{', '.join(self.issues)}]" if self.issues else ""))
+
+
+def measure_focus(gray: np.ndarray) -> float:
+    """Variance of Laplacian (ảnh đã thu nhỏ)"""
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+def _work_image(roi: np.ndarray) -> np.ndarray:
+    if roi.ndim == 3:
+        roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    roi_h, roi_w = roi.shape[:2]
+    scale = min(1.0, QUALITY_WORK_SIZE / float(max(roi_h, roi_w)))
+    if scale < 1.0:
+        return cv2.resize(roi, (max(1, int(roi_w * scale)), max(1, int(roi_h * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return roi
+
+
+def measure_quality(roi: np.ndarray) -> Tuple[float, float, float]:
+    """
+    Đo focus / clipping / contrast của ROI trên ảnh thu nhỏ
+
+    Returns:
+        (focus, tỉ lệ pixel bị clip 0-1, contrast p2-p98)
+    """
+    work = _work_image(roi)
+    focus = measure_focus(work)
+
+    hist = cv2.calcHist([work], [0], None, [256], [0, 256]).ravel()
+    total = float(hist.sum()) or 1.0
+    clipped = float(hist[:3].sum() + hist[253:].sum()) / total
+    cdf = np.cumsum(hist) / total
+    contrast = float(np.searchsorted(cdf, 0.98) - np.searchsorted(cdf, 0.02))
+    return focus, clipped, contrast
+
+
+def assess_quality(roi: np.ndarray, reference_focus: float = 0.0,
+                   reference_contrast: float = 0.0) -> QualityReport:
+    """
+    Đánh giá focus / clipping / contrast của ROI
+
+    Args:
+        roi: ROI image (mono hoặc BGR)
+        reference_focus: Focus của region trên ảnh master (0 = chưa học)
+        reference_contrast: Contrast của region trên ảnh master (0 = chưa học)
+
+    Returns:
+        QualityReport
+    """
+    focus, clipped, contrast = measure_quality(roi)
+
+    if reference_focus > 0:
+        focus_min, focus_reject = FOCUS_MIN_RATIO * reference_focus, FOCUS_REJECT_RATIO * reference_focus
+    else:
+        focus_min, focus_reject = FOCUS_MIN_ABS, FOCUS_REJECT_ABS
+    if reference_contrast > 0:
+        # Code nhỏ trong region nền phẳng: contrast của master có thể thấp hơn ngưỡng tuyệt đối
+        contrast_min = min(CONTRAST_MIN, CONTRAST_MIN_RATIO * reference_contrast)
+        contrast_reject = min(CONTRAST_REJECT, CONTRAST_REJECT_RATIO * reference_contrast)
+    else:
+        contrast_min, contrast_reject = CONTRAST_MIN, CONTRAST_REJECT
+
+    issues = []
+    if clipped > CLIP_MAX_FRACTION:
+        issues.append(ISSUE_CLIPPED)
+    if contrast < contrast_min:
+        issues.append(ISSUE_LOW_CONTRAST)
+    if focus < focus_min and ISSUE_LOW_CONTRAST not in issues:
+        # Ảnh thiếu tương phản luôn có Laplacian thấp: chỉ coi là blur khi contrast đủ
+        issues.append(ISSUE_BLUR)
+
+    flat = contrast < contrast_reject
+    reject = (clipped > CLIP_REJECT_FRACTION or
+              (ISSUE_BLUR in issues and focus < focus_reject))
+    return QualityReport(focus=focus, clipped=clipped, contrast=contrast, issues=tuple(issues),
+                         reject=reject, flat=flat)
+
+
+def methods_for_quality(report: QualityReport, methods: Sequence[int]) -> Tuple[int, ...]:
+    """
+    Method tiền xử lý cho frame có chất lượng report
+
+    Args:
+        report: Kết quả assess_quality
+        methods: Method của region (thứ tự bình thường)
+
+    Returns:
+        methods nếu ảnh tốt, ngược lại bộ method rút gọn hợp với lỗi đầu tiên
+        (luôn có QUALITY_KEEP_METHODS)
+    """
+    if report.ok:
+        return tuple(methods)
+    issue_methods = ISSUE_METHODS[report.issues[0]]
+    keep = tuple(m for m in QUALITY_KEEP_METHODS if m not in issue_methods)
+    reduced = tuple(m for m in keep + issue_methods if m in methods)
+    return reduced or tuple(methods)
@@ -0,0 +1,90 @@
+"""
+Region Crops - Vùng cắt của template trên một ảnh, không copy pixel
+Bounds được clamp một lần cho mỗi (template, kích thước ảnh); ảnh crop là view chỉ đọc,
+chỉ được tạo khi truy cập
+"""
+from collections.abc import Mapping
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+from .template_model import CropRegion
+
+Bounds = Tuple[int, int, int, int]
+
+
+def clamp_region_bounds(region: CropRegion, img_w: int, img_h: int) -> Bounds:
+    """
+    Clamp vùng của region vào ảnh
+
+    Returns:
+        (x, y, w, h) nằm trong ảnh, w/h >= 1
+    """
+    x = max(0, min(region.x, img_w - 1))
+    y = max(0, min(region.y, img_h - 1))
+    w = max(1, min(region.width, img_w - x))
+    h = max(1, min(region.height, img_h - y))
+    return x, y, w, h
+
+
+class RegionCrops(Mapping):
+    """
+    {region_name: cropped_image} lazy
+    - Mỗi phần tử là view chỉ đọc của ảnh gốc (tạo khi truy cập, không copy)
+    - View chỉ hợp lệ khi ảnh gốc chưa bị ghi đè; dùng copy_all() nếu cần giữ lại
+    """
+
+    def __init__(self, image: np.ndarray, bounds: Dict[str, Bounds]):
+        self._image = image
+        self._bounds = bounds
+
+    def __getitem__(self, region_name: str) -> np.ndarray:
+        x, y, w, h = self._bounds[region_name]
+        view = self._image[y:y+h, x:x+w]
+        view.flags.writeable = False
+        return view
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._bounds)
+
+    def __len__(self) -> int:
+        return len(self._bounds)
+
+    def bounds(self, region_name: str) -> Bounds:
+        """(x, y, w, h) của region trên ảnh"""
+        return self._bounds[region_name]
+
+    def copy_all(self) -> Dict[str, np.ndarray]:
+        """Copy tất cả vùng crop (độc lập với ảnh gốc)"""
+        return {name: self[name].copy() for name in self._bounds}
+
+
+def bounds_area(bounds: Bounds) -> int:
+    return bounds[2] * bounds[3]
+
+
+def bounds_union(a: Bounds, b: Bounds) -> Bounds:
+    """Bounding box chung của hai vùng"""
+    x1, y1 = min(a[0], b[0]), min(a[1], b[1])
+    x2, y2 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return x1, y1, x2 - x1, y2 - y1
+
+
+def bounds_overlap(a: Bounds, b: Bounds) -> bool:
+    """True nếu hai vùng có chung pixel"""
+    return (a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and
+            a[1] < b[1] + b[3] and b[1] < a[1] + a[3])
+
+
+def rect_inside(rect: Bounds, bounds: Bounds, tolerance: int = 2) -> bool:
+    """True nếu rect nằm trọn trong bounds (cho phép lệch vài pixel do làm tròn rect của decoder)"""
+    x, y, w, h = rect
+    bx, by, bw, bh = bounds
+    return (x >= bx - tolerance and y >= by - tolerance and
+            x + w <= bx + bw + tolerance and y + h <= by + bh + tolerance)
+
+
+def rect_center_inside(rect: Bounds, bounds: Bounds) -> bool:
+    cx, cy = rect[0] + rect[2] / 2.0, rect[1] + rect[3] / 2.0
+    bx, by, bw, bh = bounds
+    return bx <= cx < bx + bw and by <= cy < by + bh
@@ -0,0 +1,137 @@
+"""
+Result Consensus - Bỏ phiếu kết quả barcode qua nhiều frame (streaming)
+Giữ giá trị ổn định cho từng region, phát sự kiện khi đủ K frame đồng ý
+(PASS khi mọi region đọc được, FAIL khi region thiếu code ổn định hoặc panel không ổn định quá lâu)
+"""
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StableResult:
+    """Kết quả ổn định của tất cả region (sự kiện consensus)"""
+    barcodes: Dict[str, List[str]]
+    # Tỉ lệ phiếu của giá trị ổn định trong cửa sổ (0-1)
+    confidence: Dict[str, float] = field(default_factory=dict)
+    # True nếu mọi region có code; False = FAIL (region trống ổn định / hết thời gian chờ)
+    passed: bool = True
+    # FAIL do panel không đạt consensus sau fail_after frame (barcodes = giá trị ổn định hiện có)
+    timed_out: bool = False
+
+
+class _RegionVotes:
+    """Cửa sổ phiếu của một region"""
+
+    def __init__(self, window: int):
+        self.votes: Deque[Tuple[str, ...]] = deque(maxlen=window)
+        self.stable: Optional[Tuple[str, ...]] = None
+        self.confidence = 0.0
+
+
+class ResultConsensus:
+    """
+    Consensus theo thời gian cho từng region
+    - Mỗi frame là một phiếu: tuple các code (rỗng = không đọc được)
+    - Giá trị ổn định chỉ đổi khi một giá trị khác đạt min_agree phiếu trong cửa sổ,
+      nên một frame đọc sai hoặc miss không làm kết quả nhấp nháy
+    - Mọi region trống ổn định = không có panel (không phát sự kiện)
+    - Mỗi panel phát tối đa một FAIL (region trống ổn định, hoặc chưa ổn định sau fail_after frame
+      kể từ khi thấy code đầu tiên); PASS sau đó vẫn được phát nếu panel đọc được đầy đủ
+    """
+
+    def __init__(self, window: int = 5, min_agree: int = 3, fail_after: int = 15):
+        self.window = max(1, int(window))
+        self.min_agree = max(1, min(int(min_agree), self.window))
+        # 0 = tắt timeout (chỉ phát FAIL khi region trống ổn định)
+        self.fail_after = max(0, int(fail_after))
+        self._regions: Dict[str, _RegionVotes] = {}
+        self._last_emitted: Optional[Dict[str, Tuple[str, ...]]] = None
+        # Số frame kể từ khi panel hiện tại xuất hiện (có code) mà chưa phát sự kiện
+        self._pending_frames = 0
+
+    def reset(self):
+        """Xóa toàn bộ phiếu (đổi template / dừng stream)"""
+        self._regions.clear()
+        self._last_emitted = None
+        self._pending_frames = 0
+
+    def update(self, barcode_results: Dict[str, List[str]],
+               abstain: Iterable[str] = ()) -> Optional[StableResult]:
+        """
+        Thêm kết quả một frame
+
+        Args:
+            barcode_results: {region_name: [barcode_data, ...]} của frame
+            abstain: Region không bỏ phiếu ở frame này (ảnh quá kém, không decode) - giữ nguyên
+                     phiếu cũ, các region khác vẫn được tính
+
+        Returns:
+            StableResult khi có kết quả ổn định mới của panel (PASS hoặc FAIL), ngược lại None
+        """
+        abstain = set(abstain)
+        for region_name, codes in barcode_results.items():
+            region = self._regions.get(region_name)
+            if region is None:
+                # Region mới chưa có phiếu (stable = None) chặn PASS/FAIL cho tới khi được đọc
+                region = _RegionVotes(self.window)
+                self._regions[region_name] = region
+            if region_name in abstain:
+                continue
+            region.votes.append(tuple(sorted(codes)))
+
+            value, count = Counter(region.votes).most_common(1)[0]
+            if count >= self.min_agree:
+                if value != region.stable:
+                    logger.debug(f"Consensus for '{region_name}': {list(value)} ({count}/{len(region.votes)})")
+                region.stable = value
+            if region.stable is not None:
+                region.confidence = region.votes.count(region.stable) / float(self.window)
+
+        # Bỏ region không còn trong template
+        for region_name in list(self._regions.keys()):
+            if region_name not in barcode_results and region_name not in abstain:
+                del self._regions[region_name]
+
+        stable = {name: r.stable for name, r in self._regions.items()}
+        if not stable:
+            return None
+        if all(value == () for value in stable.values()):
+            # Panel đã rời vị trí: panel tiếp theo sẽ phát sự kiện mới
+            self._last_emitted = None
+            self._pending_frames = 0
+            return None
+
+        if self._last_emitted is None and (self._pending_frames or
+                                           any(codes for name, codes in barcode_results.items()
+                                               if name not in abstain)):
+            self._pending_frames += 1
+
+        if all(value is not None for value in stable.values()):
+            passed = all(stable.values())
+            # FAIL chỉ phát một lần cho mỗi panel (panel rời đi từng phần không tạo FAIL giả)
+            if stable == self._last_emitted or (not passed and self._last_emitted is not None):
+                return None
+            return self._emit(stable, passed)
+
+        if self.fail_after and self._last_emitted is None and self._pending_frames >= self.fail_after:
+            logger.debug(f"No consensus after {self._pending_frames} frames, reporting FAIL")
+            return self._emit({name: value or () for name, value in stable.items()}, False, timed_out=True)
+        return None
+
+    def _emit(self, stable: Dict[str, Tuple[str, ...]], passed: bool, timed_out: bool = False) -> StableResult:
+        self._last_emitted = stable
+        self._pending_frames = 0
+        return StableResult(
+            barcodes={name: list(value) for name, value in stable.items()},
+            confidence={name: r.confidence for name, r in self._regions.items()},
+            passed=passed,
+            timed_out=timed_out
+        )
+
+    def current(self) -> Dict[str, List[str]]:
+        """Giá trị ổn định hiện tại của từng region ([] nếu chưa có)"""
+        return {name: list(r.stable or ()) for name, r in self._regions.items()}
@@ -0,0 +1,57 @@
+"""
+Scan Result - Kết quả scan barcode của từng region
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from .quality_gate import QualityReport
+
+# Region status
+SCAN_OK = "ok"
+SCAN_NOT_FOUND = "not_found"
+SCAN_BUDGET_EXHAUSTED = "budget_exhausted"
+SCAN_ERROR = "error"
+# Region không có code (presence check), bỏ qua decode
+SCAN_EMPTY = "empty"
+# Ảnh region quá kém (mờ / cháy sáng), không decode - streaming chờ frame sau
+SCAN_REJECTED = "rejected"
+
+
+@dataclass
+class RegionScanResult:
+    """Kết quả scan một crop region"""
+    region_name: str
+    codes: List[str] = field(default_factory=list)
+    # Rect (x, y, w, h) của từng code, theo tọa độ ảnh đầy đủ
+    rects: List[Tuple[int, int, int, int]] = field(default_factory=list)
+    status: str = SCAN_NOT_FOUND
+    # Method tiền xử lý tìm ra code (None = không tìm thấy)
+    method: Optional[int] = None
+    attempts: int = 0
+    elapsed_ms: float = 0.0
+    # Tỉ lệ ảnh decode ra code (pyramid decode, 1.0 = độ phân giải gốc)
+    scale: float = 1.0
+    # Chất lượng ảnh của region (None = quality gate tắt)
+    quality: Optional[QualityReport] = None
+
+    def add_code(self, data: str, rect: Tuple[int, int, int, int]) -> bool:
+        """Add decoded code (bỏ qua nếu trùng). Returns True nếu là code mới"""
+        if data in self.codes:
+            return False
+        self.codes.append(data)
+        self.rects.append(rect)
+        return True
+
+
+@dataclass
+class PyramidStats:
+    """Thống kê pyramid decode (coarse-to-fine) của một region"""
+    # Tỉ lệ thu nhỏ dùng cho lần thử đầu (1.0 = region luôn decode ở độ phân giải gốc)
+    scale: float = 1.0
+    # Số lần tìm đủ code ngay ở ảnh thu nhỏ / phải lên độ phân giải gốc
+    scaled_hits: int = 0
+    escalations: int = 0
+    # Thời gian scan ở độ phân giải gốc (ms, EMA) - mốc để tính thời gian tiết kiệm
+    full_res_ms: float = 0.0
+    # Tổng thời gian tiết kiệm được (ms)
+    saved_ms: float = 0.0
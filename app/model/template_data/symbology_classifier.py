@@ -0,0 +1,96 @@
+"""
+Symbology Classifier - Đoán nhanh loại code trong crop region (cho region symbology="auto")
+- QR: có >= 2 finder pattern (3 hình vuông lồng nhau)
+- 1D barcode: gradient gần như một hướng (structure tensor coherence cao)
+- Còn lại: DataMatrix
+"""
+import logging
+
+import cv2
+import numpy as np
+
+from .decoder_backends import SYMBOLOGY_DATAMATRIX, SYMBOLOGY_LINEAR, SYMBOLOGY_QR
+
+logger = logging.getLogger(__name__)
+
+# Ảnh làm việc được thu nhỏ về cạnh dài tối đa này (px)
+CLASSIFIER_WORK_SIZE = 320
+
+# Coherence (0 = đẳng hướng, 1 = một hướng) trên vùng có gradient để coi là 1D barcode
+LINEAR_MIN_COHERENCE = 0.75
+
+# Finder pattern: contour vuông có ít nhất 2 contour con lồng nhau
+FINDER_MIN_SQUARENESS = 0.7
+FINDER_MIN_SIDE = 6
+
+
+def _count_finder_patterns(binary: np.ndarray) -> int:
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return 0
+    hierarchy = hierarchy[0]
+
+    count = 0
+    for i, contour in enumerate(contours):
+        # Độ sâu lồng nhau: contour -> con -> cháu
+        child = hierarchy[i][2]
+        depth = 0
+        while child >= 0 and depth < 2:
+            depth += 1
+            child = hierarchy[child][2]
+        if depth < 2:
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        if min(w, h) < FINDER_MIN_SIDE or min(w, h) / float(max(w, h)) < FINDER_MIN_SQUARENESS:
+            continue
+        count += 1
+    return count
+
+
+def _gradient_coherence(gray: np.ndarray) -> float:
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude = gx * gx + gy * gy
+    # Chỉ xét pixel có gradient mạnh (cạnh của code), bỏ nền
+    mask = magnitude >= max(float(np.percentile(magnitude, 90)), 1.0)
+    if not np.any(mask):
+        return 0.0
+    jxx = float(np.sum(gx[mask] * gx[mask]))
+    jyy = float(np.sum(gy[mask] * gy[mask]))
+    jxy = float(np.sum(gx[mask] * gy[mask]))
+    trace = jxx + jyy
+    if trace <= 0:
+        return 0.0
+    return float(np.sqrt((jxx - jyy) ** 2 + 4.0 * jxy * jxy) / trace)
+
+
+def classify_symbology(gray: np.ndarray) -> str:
+    """
+    Phân loại symbology của code trong ROI
+
+    Args:
+        gray: ROI gray image
+
+    Returns:
+        SYMBOLOGY_QR, SYMBOLOGY_LINEAR hoặc SYMBOLOGY_DATAMATRIX
+    """
+    roi_h, roi_w = gray.shape[:2]
+    scale = min(1.0, CLASSIFIER_WORK_SIZE / float(max(roi_h, roi_w)))
+    work = gray
+    if scale < 1.0:
+        work = cv2.resize(gray, (max(1, int(roi_w * scale)), max(1, int(roi_h * scale))),
+                          interpolation=cv2.INTER_AREA)
+
+    coherence = _gradient_coherence(work)
+    if coherence >= LINEAR_MIN_COHERENCE:
+        logger.debug(f"Symbology classified as 1D barcode (coherence {coherence:.2f})")
+        return SYMBOLOGY_LINEAR
+
+    _, binary = cv2.threshold(work, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    finders = max(_count_finder_patterns(binary), _count_finder_patterns(cv2.bitwise_not(binary)))
+    if finders >= 2:
+        logger.debug(f"Symbology classified as QR ({finders} finder patterns)")
+        return SYMBOLOGY_QR
+
+    logger.debug(f"Symbology classified as DataMatrix (coherence {coherence:.2f}, {finders} finder patterns)")
+    return SYMBOLOGY_DATAMATRIX
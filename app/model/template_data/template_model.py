@@ -19,6 +19,37 @@ class CropRegion:
     height: int
     enabled: bool = True
     scan_barcode: bool = True  # Có scan barcode trong vùng này không
+    # Loại code: "datamatrix", "qr", "barcode" (1D) hoặc "auto" (phân loại khi scan)
+    symbology: str = "datamatrix"
+    
+    # Code geometry learned from the master image (0 / "auto" = chưa học, decoder tìm toàn bộ)
+    expected_count: int = 0  # Số code trong vùng
+    code_edge: int = 0  # Cạnh code (pixel) đo trên ảnh master
+    symbol_shape: str = "auto"  # "auto", "square" hoặc "rect"
+    # Rect [x, y, w, h] của từng code trên ảnh master (đếm code không trùng khi region chồng nhau)
+    code_rects: List[List[int]] = field(default_factory=list)
+    
+    # Thống kê vùng có code trên ảnh master (0 = chưa học, không kiểm tra region trống)
+    presence_edge_density: float = 0.0
+    presence_contrast: float = 0.0
+    # Focus (variance of Laplacian) và contrast của region trên ảnh master, mốc cho quality gate
+    quality_focus: float = 0.0
+    quality_contrast: float = 0.0
+    
+    def has_code_geometry(self) -> bool:
+        """True nếu region đã học kích thước code từ ảnh master"""
+        return self.expected_count > 0 and self.code_edge > 0
+    
+    def clear_code_geometry(self):
+        """Xóa geometry đã học (khi ROI thay đổi)"""
+        self.expected_count = 0
+        self.code_edge = 0
+        self.symbol_shape = "auto"
+        self.code_rects = []
+        self.presence_edge_density = 0.0
+        self.presence_contrast = 0.0
+        self.quality_focus = 0.0
+        self.quality_contrast = 0.0
     
     def to_dict(self) -> Dict[str, Any]:
         return asdict(self)
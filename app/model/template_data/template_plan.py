@@ -0,0 +1,152 @@
+"""
+Template Plan - Kế hoạch scan đã biên dịch của template cho một kích thước ảnh
+Mọi thứ không đổi giữa các frame (bounds đã clamp, slice, decode kwargs, danh sách method,
+workspace) được tính một lần; scan mỗi frame chỉ còn là vòng lặp trên các RegionPlan
+"""
+from dataclasses import dataclass, fields
+from typing import Any, List, Mapping, Tuple
+
+from .preprocess_workspace import PreprocessWorkspace
+from .region_crops import Bounds, bounds_area, bounds_overlap, bounds_union, rect_center_inside, rect_inside
+from .template_model import CropRegion, Template
+
+
+@dataclass(frozen=True)
+class RegionPlan:
+    """
+    Công việc đã chuẩn bị sẵn cho một region scan barcode
+    Các region chồng nhau được gộp thành một RegionPlan (region = vùng gộp, không thuộc template),
+    decode một lần rồi chia code về từng member theo vị trí
+    """
+    region: CropRegion
+    # Bounds (x, y, w, h) đã clamp và slice tương ứng: image[window]
+    bounds: Bounds
+    window: Tuple[slice, slice]
+    # Decode kwargs (chỉ đọc) từ geometry đã học
+    decode_kwargs: Mapping[str, Any]
+    # Method tiền xử lý theo thứ tự thử
+    methods: Tuple[int, ...]
+    workspace: PreprocessWorkspace
+    # Pyramid decode: tỉ lệ thử đầu (1.0 = độ phân giải gốc) và decode kwargs theo tỉ lệ đó
+    pyramid_scale: float
+    scaled_decode_kwargs: Mapping[str, Any]
+    # (tên region, bounds) của các region trong template dùng chung lần decode này
+    members: Tuple[Tuple[str, Bounds], ...]
+
+    @property
+    def name(self) -> str:
+        return self.region.name
+
+    @property
+    def merged(self) -> bool:
+        return len(self.members) > 1
+
+
+@dataclass(frozen=True)
+class TemplatePlan:
+    """
+    Kế hoạch scan của một template trên ảnh kích thước image_size
+    Khóa theo nội dung region (template_fingerprint): template khác / region bị sửa -> biên dịch lại
+    """
+    fingerprint: Tuple[Any, ...]
+    image_size: Tuple[int, int]
+    # Bounds của mọi region enabled (crop), theo thứ tự template
+    crop_bounds: Mapping[str, Bounds]
+    # Các lần decode (region đơn hoặc nhóm region chồng nhau)
+    scan_regions: Tuple[RegionPlan, ...]
+    # Tên các region scan barcode theo thứ tự template (thứ tự kết quả)
+    region_order: Tuple[str, ...]
+
+    def matches(self, fingerprint: Tuple[Any, ...], img_w: int, img_h: int) -> bool:
+        return self.image_size == (img_w, img_h) and self.fingerprint == fingerprint
+
+
+def _frozen(value: Any) -> Any:
+    """List (vd. code_rects) -> tuple để so sánh / hash được"""
+    if isinstance(value, list):
+        return tuple(_frozen(item) for item in value)
+    return value
+
+
+def template_fingerprint(template: Template) -> Tuple[Any, ...]:
+    """
+    Nội dung các crop region của template (tên, rect, symbology, geometry / thống kê đã học),
+    dùng làm khóa kế hoạch scan thay cho id(template)
+    """
+    return tuple(
+        tuple(_frozen(getattr(region, f.name)) for f in fields(region))
+        for region in template.crop_regions
+    )
+
+
+def group_overlapping_regions(entries: List[Tuple[CropRegion, Bounds]]) -> List[List[Tuple[CropRegion, Bounds]]]:
+    """
+    Gộp các region chồng nhau (cùng symbology) thành nhóm decode chung
+    Chỉ gộp khi bounding box chung không lớn hơn tổng diện tích các phần (decode riêng),
+    để việc gộp không bao giờ tốn thêm pixel
+
+    Args:
+        entries: (region, bounds đã clamp) theo thứ tự template
+
+    Returns:
+        Các nhóm, theo thứ tự region đầu tiên của nhóm trong template
+    """
+    groups = [[entry] for entry in entries]
+    unions = [bounds for _, bounds in entries]
+    costs = [bounds_area(bounds) for _, bounds in entries]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                if groups[i][0][0].symbology != groups[j][0][0].symbology:
+                    continue
+                if not bounds_overlap(unions[i], unions[j]):
+                    continue
+                union = bounds_union(unions[i], unions[j])
+                if bounds_area(union) > costs[i] + costs[j]:
+                    continue
+                groups[i].extend(groups.pop(j))
+                unions[i] = union
+                costs[i] += costs.pop(j)
+                unions.pop(j)
+                merged = True
+                break
+            if merged:
+                break
+
+    return groups
+
+
+def distinct_code_count(members: List[Tuple[CropRegion, Bounds]]) -> int:
+    """
+    Số code không trùng trong nhóm region chồng nhau (code nằm ở phần chung chỉ đếm một lần)
+    - Mọi member có rect code đã học: gộp rect, bỏ rect có tâm nằm trong rect đã đếm
+    - Geometry cũ (chưa có rect): bỏ member nằm trọn trong member khác (code đã được
+      member bao ngoài đếm), cộng số code các member còn lại
+
+    Args:
+        members: (region đã học geometry, bounds đã clamp)
+
+    Returns:
+        Số code mong đợi của vùng gộp
+    """
+    if all(region.code_rects for region, _ in members):
+        counted: List[Bounds] = []
+        for region, _ in members:
+            for rect in region.code_rects:
+                rect = tuple(rect)
+                if not any(rect_center_inside(rect, other) for other in counted):
+                    counted.append(rect)
+        return len(counted)
+
+    total = 0
+    for index, (region, bounds) in enumerate(members):
+        nested = any(
+            rect_inside(bounds, other_bounds, tolerance=0) and (bounds != other_bounds or other_index < index)
+            for other_index, (_, other_bounds) in enumerate(members) if other_index != index
+        )
+        if not nested:
+            total += region.expected_count
+    return total
@@ -1,24 +1,101 @@
 import os
 import json
 import logging
-from typing import List, Optional, Dict, Any, Tuple
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import List, Optional, Dict, Any, Sequence, Tuple
 from pathlib import Path
 from datetime import datetime
 import numpy as np
 import cv2
 
-# Try to import pylibdmtx for DataMatrix support
-try:
-    from pylibdmtx.pylibdmtx import decode as dmtx_decode
-    DMTX_AVAILABLE = True
-except ImportError:
-    DMTX_AVAILABLE = False
-    logging.warning("pylibdmtx not available - DataMatrix detection disabled")
-
 from .template_model import Template, CropRegion
+from .decoder_backends import DecoderBackend, create_decoder, SYMBOLOGY_AUTO, SYMBOLOGY_DATAMATRIX
+from .symbology_classifier import classify_symbology
+from .preprocess_workspace import PreprocessWorkspace, StageCosts
+from .decode_budget import DecodeDeadline
+from .datamatrix_locator import locate_datamatrix_candidates
+from .code_tracker import CodeTracker
+from .region_crops import (
+    RegionCrops, Bounds, clamp_region_bounds, bounds_union, rect_inside, rect_center_inside
+)
+from .template_plan import (RegionPlan, TemplatePlan, distinct_code_count, group_overlapping_regions,
+                            template_fingerprint)
+from .presence_check import code_absent, measure_presence
+from .quality_gate import assess_quality, measure_quality, methods_for_quality
+from .temporal_denoise import TEMPORAL_DEFAULT_FRAMES
+from .scan_result import (
+    RegionScanResult, PyramidStats, SCAN_OK, SCAN_NOT_FOUND, SCAN_BUDGET_EXHAUSTED, SCAN_ERROR,
+    SCAN_EMPTY, SCAN_REJECTED
+)
 
 logger = logging.getLogger(__name__)
 
+# pylibdmtx DmtxSymbolSize values cho symbol_shape của CropRegion
+DMTX_SHAPES = {
+    'auto': -1,    # DmtxSymbolShapeAuto
+    'square': -2,  # DmtxSymbolSquareAuto
+    'rect': -3,    # DmtxSymbolRectAuto
+}
+
+# Sai số cho phép của cạnh code so với cạnh đã học trên ảnh master
+CODE_EDGE_TOLERANCE = 0.3
+
+# Code có cạnh >= giá trị này (px) được decode với shrink=2
+DMTX_SHRINK_MIN_EDGE = 120
+
+# Preprocessing method priority: theo testbase.py
+# Method 9: Testbase full (CLAHE + MedianBlur + AdaptiveThresh + Morphology) - BEST
+# Method 10: Testbase no morph (CLAHE + MedianBlur + AdaptiveThresh)
+# Method 11: Testbase CLAHE only (clipLimit=2.0)
+# Method 0: Original (gray)
+# Method 2: CLAHE + Denoise + Binarization
+# Method 7: Invert + CLAHE + Denoise + Binarization (white-on-dark)
+# Method 1: CLAHE + Binarization
+# Method 6: Denoise + CLAHE + Binarization
+# Method 8: Invert only
+# Method 3: Adaptive threshold
+# Method 4: Otsu threshold
+# Method 5: CLAHE only
+# Streaming (temporal_denoise): Denoise của method 2/6/7 = trung bình N frame thay NLM
+METHOD_PRIORITY = [9, 10, 11, 0, 2, 7, 1, 6, 8, 3, 4, 5]
+
+# Method names for logging / logccd filenames
+METHOD_NAMES = {
+    0: "original",
+    1: "clahe_binary",
+    2: "clahe_denoise_binary",
+    3: "adaptive_thresh",
+    4: "otsu_thresh",
+    5: "clahe_only",
+    6: "denoise_clahe_binary",
+    7: "invert_clahe_denoise_binary",
+    8: "invert_only",
+    9: "testbase_full",  # CLAHE + MedianBlur + AdaptiveThresh + Morphology
+    10: "testbase_no_morph",  # CLAHE + MedianBlur + AdaptiveThresh
+    11: "testbase_clahe"  # CLAHE only (clipLimit=2.0)
+}
+
+# Candidate localization: dùng khi diện tích ROI >= tỉ lệ này x diện tích code đã học,
+# hoặc (chưa học) cạnh ngắn của ROI >= LOCATOR_MIN_ROI_SIDE
+LOCATOR_MIN_AREA_RATIO = 6.0
+LOCATOR_MIN_ROI_SIDE = 240
+LOCATOR_MAX_CANDIDATES = 3
+# Method thử trên mỗi patch: original, testbase_full
+LOCATOR_PATCH_METHODS = (0, 9)
+# Số workspace patch giữ lại (theo kích thước patch, dùng lại giữa các frame)
+PATCH_WORKSPACE_POOL_SIZE = 16
+
+# Pyramid decode: ROI có cạnh ngắn >= PYRAMID_MIN_ROI_SIDE được thử trước ở ảnh thu nhỏ,
+# chỉ lên độ phân giải gốc khi ảnh thu nhỏ không đủ code
+PYRAMID_MIN_ROI_SIDE = 300
+# Tỉ lệ thử (nhỏ nhất trước) - chọn tỉ lệ nhỏ nhất mà module vẫn >= PYRAMID_MIN_MODULE_PX
+PYRAMID_SCALES = (0.25, 0.5)
+PYRAMID_MIN_MODULE_PX = 2.0
+# Ước lượng module = cạnh code / số module (pylibdmtx không trả về kích thước symbol)
+PYRAMID_ASSUMED_MODULES = 20
+
 
 class TemplateService:
     """
@@ -29,7 +106,8 @@ class TemplateService:
     - Scan barcodes
     """
     
-    def __init__(self):
+    def __init__(self, pyramid_decode: bool = True, save_processed_images: bool = True,
+                 quality_gate: bool = True, temporal_denoise_frames: int = TEMPORAL_DEFAULT_FRAMES):
         # Get AppData path
         self.templates_dir = self._get_templates_directory()
         
@@ -39,12 +117,45 @@ class TemplateService:
         # Current template
         self._current_template: Optional[Template] = None
         
-        # Log directory for processed images
-        self.logccd_dir = self._get_logccd_directory()
-        os.makedirs(self.logccd_dir, exist_ok=True)
+        # Preprocess workspaces per region (allocated when template loads)
+        self._workspaces: Dict[str, PreprocessWorkspace] = {}
+        # Chi phí tiền xử lý theo stage, dùng chung cho mọi workspace và giữ qua các lần đổi template
+        self._stage_costs = StageCosts()
+        
+        # Pyramid decode: thử ảnh thu nhỏ trước (workspace riêng cho ảnh thu nhỏ)
+        self.pyramid_decode = pyramid_decode
+        self._scaled_workspaces: Dict[str, PreprocessWorkspace] = {}
+        self._pyramid_stats: Dict[str, PyramidStats] = {}
+        
+        # Workspace cho patch của DataMatrix locator, theo (width, height), LRU
+        self._patch_workspaces: "OrderedDict[Tuple[int, int], PreprocessWorkspace]" = OrderedDict()
+        
+        # Quality gate: đánh giá focus / clipping / contrast trước khi decode
+        self.quality_gate = quality_gate
+        
+        # Temporal denoise (streaming): trung bình N frame thay NLM ở method 2/6/7 (0 = tắt)
+        self.temporal_denoise_frames = max(0, int(temporal_denoise_frames))
+        # Số thứ tự frame streaming (workspace bỏ lịch sử khi bị bỏ qua frame)
+        self._temporal_sequence = 0
+        
+        # Decoder backend theo symbology (None = không có backend lúc chạy)
+        self._decoders: Dict[str, Optional[DecoderBackend]] = {}
+        # Symbology đã phân loại của các region symbology="auto"
+        self._region_symbology: Dict[str, str] = {}
+        
+        # Kế hoạch scan đã biên dịch của template hiện tại (theo kích thước ảnh)
+        self._plan: Optional[TemplatePlan] = None
+        
+        # Log directory for processed images (batch/headless: tắt để không ghi ảnh mỗi attempt)
+        self.save_processed_images = save_processed_images
+        self.logccd_dir = None
+        if save_processed_images:
+            self.logccd_dir = self._get_logccd_directory()
+            os.makedirs(self.logccd_dir, exist_ok=True)
         
         logger.info(f"TemplateService initialized, templates dir: {self.templates_dir}")
-        logger.info(f"LogCCD directory: {self.logccd_dir}")
+        if self.logccd_dir:
+            logger.info(f"LogCCD directory: {self.logccd_dir}")
     
     def _get_logccd_directory(self) -> str:
         """Get logccd directory for saving processed images"""
@@ -181,231 +292,337 @@ class TemplateService:
     def set_current_template(self, template: Template):
         """Set current template"""
         self._current_template = template
+        self._build_workspaces(template)
         logger.info(f"Current template set: {template.name}")
     
     def get_current_template(self) -> Optional[Template]:
         """Get current template"""
         return self._current_template
     
-    def crop_image_regions(self, image: np.ndarray, template: Template) -> Dict[str, np.ndarray]:
+    def invalidate_plan(self):
+        """Hủy kế hoạch scan đã biên dịch (sau khi sửa region / geometry)"""
+        self._plan = None
+    
+    def reset_temporal_denoise(self):
+        """Bỏ các frame đã tích lũy cho temporal denoise (streaming dừng / đổi sản phẩm)"""
+        for workspace in list(self._workspaces.values()) + list(self._scaled_workspaces.values()):
+            workspace.reset_temporal()
+        if self._plan is not None:
+            for region_plan in self._plan.scan_regions:
+                region_plan.workspace.reset_temporal()
+    
+    def _get_plan(self, template: Template, img_w: int, img_h: int) -> TemplatePlan:
         """
-        Crop image regions based on template
-        
-        Args:
-            image: Input image
-            template: Template with crop regions
-        
-        Returns:
-            Dictionary of {region_name: cropped_image}
+        Kế hoạch scan của template cho kích thước ảnh, biên dịch lại chỉ khi
+        nội dung region / kích thước ảnh đổi hoặc sau invalidate_plan()
         """
-        cropped_images = {}
+        fingerprint = template_fingerprint(template)
+        if self._plan is not None and self._plan.matches(fingerprint, img_w, img_h):
+            return self._plan
         
+        crop_bounds = {}
+        scan_entries = []
         for region in template.crop_regions:
             if not region.enabled:
                 continue
+            bounds = clamp_region_bounds(region, img_w, img_h)
+            crop_bounds[region.name] = bounds
+            if region.scan_barcode:
+                scan_entries.append((region, bounds))
+        
+        # Region chồng nhau: decode vùng gộp một lần
+        scan_regions = []
+        for members in group_overlapping_regions(scan_entries):
+            if len(members) == 1:
+                region, bounds = members[0]
+                decode_kwargs = self._dmtx_decode_kwargs(region)
+            else:
+                region, bounds = self._merged_region(members)
+                decode_kwargs = self._merged_decode_kwargs(members)
+                logger.info(f"Overlapping regions decoded together: {region.name} {bounds}")
             
-            try:
-                # Crop region
-                x, y, w, h = region.x, region.y, region.width, region.height
-                
-                # Validate bounds
-                img_h, img_w = image.shape[:2]
-                x = max(0, min(x, img_w - 1))
-                y = max(0, min(y, img_h - 1))
-                w = max(1, min(w, img_w - x))
-                h = max(1, min(h, img_h - y))
-                
-                # Crop
-                cropped = image[y:y+h, x:x+w].copy()
-                cropped_images[region.name] = cropped
-                
-                logger.debug(f"Cropped region '{region.name}': {w}x{h}")
-                
-            except Exception as e:
-                logger.error(f"Failed to crop region '{region.name}': {e}")
+            x, y, w, h = bounds
+            workspace = self._get_workspace(region, w, h)
+            workspace.ensure_shape(h, w)
+            scale = self._pyramid_scale(region, w, h)
+            scan_regions.append(RegionPlan(
+                region=region,
+                bounds=bounds,
+                window=(slice(y, y + h), slice(x, x + w)),
+                decode_kwargs=MappingProxyType(decode_kwargs),
+                methods=tuple(METHOD_PRIORITY),
+                workspace=workspace,
+                pyramid_scale=scale,
+                scaled_decode_kwargs=MappingProxyType(self._scale_decode_kwargs(decode_kwargs, scale)),
+                members=tuple((r.name, b) for r, b in members)
+            ))
         
-        return cropped_images
+        self._plan = TemplatePlan(
+            fingerprint=fingerprint,
+            image_size=(img_w, img_h),
+            crop_bounds=MappingProxyType(crop_bounds),
+            scan_regions=tuple(scan_regions),
+            region_order=tuple(r.name for r, _ in scan_entries)
+        )
+        logger.debug(f"Template plan compiled for {img_w}x{img_h}: {len(scan_regions)} scan region(s)")
+        return self._plan
     
-    def _preprocess_for_barcode(self, roi: np.ndarray, method: int) -> np.ndarray:
-        # Image is already grayscale (mono mode), no conversion needed
-        if len(roi.shape) == 3:
-            gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    def _merged_region(self, members: List[Tuple[CropRegion, Bounds]]) -> Tuple[CropRegion, Bounds]:
+        """Region ảo (không thuộc template) bao các region chồng nhau"""
+        regions = [r for r, _ in members]
+        bounds = members[0][1]
+        for _, member_bounds in members[1:]:
+            bounds = bounds_union(bounds, member_bounds)
+        
+        merged = CropRegion(
+            name="+".join(r.name for r in regions),
+            x=bounds[0], y=bounds[1], width=bounds[2], height=bounds[3],
+            symbology=regions[0].symbology
+        )
+        if all(r.has_code_geometry() for r in regions):
+            # Code ở phần chồng nhau chỉ đếm một lần (region lồng nhau không cộng dồn)
+            merged.expected_count = distinct_code_count(members)
+            merged.code_edge = min(r.code_edge for r in regions)
+            shapes = {r.symbol_shape for r in regions}
+            merged.symbol_shape = shapes.pop() if len(shapes) == 1 else "auto"
         else:
-            gray = roi.copy()
-        
-        if method == 0:
-            # Original - no processing
-            return gray
-        
-        elif method == 1:
-            # CLAHE (Contrast Limited Adaptive Histogram Equalization) + Binarization
-            # Tăng tương phản với CLAHE, sau đó nhị phân hóa
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(gray)
-            _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            return binary
-        
-        elif method == 2:
-            # CLAHE + Light Denoise + Binarization (RECOMMENDED for mono images)
-            # Tăng tương phản CLAHE, giảm nhiễu nhẹ, nhị phân hóa
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(gray)
-            # Light denoising (h=10 is light, h=20 is stronger)
-            denoised = cv2.fastNlMeansDenoising(enhanced, None, h=10, templateWindowSize=7, searchWindowSize=21)
-            _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            return binary
-        
-        elif method == 3:
-            # Adaptive threshold (good for varying lighting)
-            return cv2.adaptiveThreshold(
-                gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                cv2.THRESH_BINARY, 11, 2
-            )
+            # Chưa học: scan đến khi mỗi region có ít nhất một code
+            merged.expected_count = len(regions)
+        return merged, bounds
+    
+    def _merged_decode_kwargs(self, members: List[Tuple[CropRegion, Bounds]]) -> Dict[str, Any]:
+        """dmtx_decode kwargs cho vùng gộp: đủ rộng cho code của mọi region member"""
+        kwargs = self._dmtx_decode_kwargs(None)
+        regions = [r for r, _ in members]
+        if not all(r.has_code_geometry() for r in regions):
+            return kwargs
         
-        elif method == 4:
-            # Otsu threshold only
-            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            return binary
-        
-        elif method == 5:
-            # CLAHE only (no binarization)
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            return clahe.apply(gray)
-        
-        elif method == 6:
-            # Denoise + CLAHE + Binarization
-            denoised = cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(denoised)
-            _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            return binary
-        
-        elif method == 7:
-            # Invert + CLAHE + Denoise + Binarization (for white-on-dark barcodes)
-            # Invert image first (white barcode on dark background -> dark on white)
-            inverted = cv2.bitwise_not(gray)
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(inverted)
-            denoised = cv2.fastNlMeansDenoising(enhanced, None, h=10, templateWindowSize=7, searchWindowSize=21)
-            _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            return binary
-        
-        elif method == 8:
-            # Invert only (for white-on-dark barcodes)
-            return cv2.bitwise_not(gray)
-        
-        elif method == 9:
-            # Testbase method: CLAHE + Median Blur + Adaptive Threshold + Morphology
-            # Theo đúng testbase.py
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            contrast = clahe.apply(gray)
-            denoise = cv2.medianBlur(contrast, 3)
-            binary = cv2.adaptiveThreshold(
-                denoise, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY, 31, 5
-            )
-            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-            morph = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-            return morph
-        
-        elif method == 10:
-            # Testbase method without morphology: CLAHE + Median Blur + Adaptive Threshold
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            contrast = clahe.apply(gray)
-            denoise = cv2.medianBlur(contrast, 3)
-            binary = cv2.adaptiveThreshold(
-                denoise, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY, 31, 5
-            )
-            return binary
+        per_region = [self._dmtx_decode_kwargs(r) for r in regions]
+        kwargs['max_count'] = distinct_code_count(members)
+        kwargs['min_edge'] = min(k['min_edge'] for k in per_region)
+        kwargs['max_edge'] = max(k['max_edge'] for k in per_region)
+        shapes = {k.get('shape') for k in per_region}
+        if len(shapes) == 1 and None not in shapes:
+            kwargs['shape'] = shapes.pop()
+        if all('shrink' in k for k in per_region):
+            kwargs['shrink'] = 2
+        return kwargs
+    
+    def _split_merged_result(self, result: RegionScanResult,
+                             members: Tuple[Tuple[str, Bounds], ...]) -> Dict[str, RegionScanResult]:
+        """
+        Chia kết quả decode vùng gộp về từng region: code thuộc các region chứa trọn rect của nó
+        (không region nào chứa trọn thì theo tâm rect)
+        """
+        split = {
+            name: RegionScanResult(region_name=name, attempts=result.attempts,
+                                   elapsed_ms=result.elapsed_ms, scale=result.scale, quality=result.quality)
+            for name, _ in members
+        }
+        for data, rect in zip(result.codes, result.rects):
+            owners = [name for name, bounds in members if rect_inside(rect, bounds)]
+            if not owners:
+                owners = [name for name, bounds in members if rect_center_inside(rect, bounds)]
+            for name in owners:
+                split[name].add_code(data, rect)
         
-        elif method == 11:
-            # Testbase method: CLAHE only (clipLimit=2.0 như testbase)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            return clahe.apply(gray)
+        for region_result in split.values():
+            if region_result.codes:
+                region_result.status = SCAN_OK
+                region_result.method = result.method
+            else:
+                region_result.status = SCAN_BUDGET_EXHAUSTED if result.status == SCAN_BUDGET_EXHAUSTED else SCAN_NOT_FOUND
+        return split
+    
+    def get_region_crops(self, image: np.ndarray, template: Template) -> RegionCrops:
+        """
+        Crop regions lazily (view chỉ đọc, tạo khi truy cập)
         
-        return gray
+        Args:
+            image: Input image
+            template: Template with crop regions
+        
+        Returns:
+            RegionCrops mapping {region_name: cropped_view}
+        """
+        img_h, img_w = image.shape[:2]
+        return RegionCrops(image, self._get_plan(template, img_w, img_h).crop_bounds)
     
-    def _detect_qr_opencv(self, roi: np.ndarray) -> List[str]:
+    def crop_image_regions(self, image: np.ndarray, template: Template) -> Dict[str, np.ndarray]:
         """
-        Detect QR code using OpenCV QRCodeDetector
+        Crop image regions based on template
         
         Args:
-            roi: Input ROI image
+            image: Input image
+            template: Template with crop regions
         
         Returns:
-            List of QR code data strings
+            Dictionary of {region_name: cropped_image} (bản copy, độc lập với ảnh gốc)
         """
-        qr_data_list = []
+        cropped_images = self.get_region_crops(image, template).copy_all()
+        for name, cropped in cropped_images.items():
+            logger.debug(f"Cropped region '{name}': {cropped.shape[1]}x{cropped.shape[0]}")
+        return cropped_images
+    
+    def _preprocess_for_barcode(self, roi: np.ndarray, method: int,
+                                workspace: Optional[PreprocessWorkspace] = None) -> np.ndarray:
+        """
+        Preprocess ROI cho barcode detection
+
+        Args:
+            roi: Input ROI image (mono hoặc BGR)
+            method: Preprocessing method number
+            workspace: Workspace của region (None = tạo workspace tạm, cấp phát mới)
+
+        Returns:
+            Processed image (buffer của workspace, chỉ hợp lệ đến lần preprocess tiếp theo)
+        """
+        if workspace is None:
+            workspace = PreprocessWorkspace(roi.shape[1], roi.shape[0], preallocate=False)
+        workspace.load(roi)
+        return workspace.preprocess(method)
+    
+    def _build_workspaces(self, template: Template):
+        """Cấp phát workspace cho các region scan barcode, theo kích thước CropRegion"""
+        self._workspaces = {}
+        for region in template.crop_regions:
+            if not region.enabled or not region.scan_barcode:
+                continue
+            self._workspaces[region.name] = PreprocessWorkspace(region.width, region.height, costs=self._stage_costs)
+        self._scaled_workspaces = {}
+        self._pyramid_stats = {}
+        self._region_symbology = {}
+        self._plan = None
+        logger.debug(f"Preprocess workspaces allocated: {len(self._workspaces)}")
+    
+    def _get_workspace(self, region: CropRegion, width: int, height: int) -> PreprocessWorkspace:
+        """Get workspace của region (tạo mới nếu template chưa được set current)"""
+        workspace = self._workspaces.get(region.name)
+        if workspace is None:
+            workspace = PreprocessWorkspace(width, height, costs=self._stage_costs)
+            self._workspaces[region.name] = workspace
+        return workspace
+    
+    def _get_scaled_workspace(self, region: CropRegion, width: int, height: int) -> PreprocessWorkspace:
+        """Get workspace cho ảnh thu nhỏ của region (pyramid decode)"""
+        workspace = self._scaled_workspaces.get(region.name)
+        if workspace is None:
+            workspace = PreprocessWorkspace(width, height, costs=self._stage_costs)
+            self._scaled_workspaces[region.name] = workspace
+        return workspace
+    
+    def _get_patch_workspace(self, width: int, height: int) -> PreprocessWorkspace:
+        """Workspace cho patch locator kích thước width x height (pool LRU, chỉ buffer của LOCATOR_PATCH_METHODS)"""
+        key = (width, height)
+        workspace = self._patch_workspaces.get(key)
+        if workspace is None:
+            workspace = PreprocessWorkspace(width, height, methods=LOCATOR_PATCH_METHODS, costs=self._stage_costs)
+            self._patch_workspaces[key] = workspace
+            if len(self._patch_workspaces) > PATCH_WORKSPACE_POOL_SIZE:
+                self._patch_workspaces.popitem(last=False)
+        else:
+            self._patch_workspaces.move_to_end(key)
+        return workspace
+    
+    def _pyramid_scale(self, region: CropRegion, roi_w: int, roi_h: int) -> float:
+        """
+        Tỉ lệ thu nhỏ cho lần thử đầu của region
         
-        try:
-            # Initialize QRCode detector
-            qr_detector = cv2.QRCodeDetector()
-            
-            # Detect and decode
-            retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(roi)
-            
-            if retval:
-                for data in decoded_info:
-                    if data and data not in qr_data_list:
-                        qr_data_list.append(data)
-                        logger.debug(f"QR code detected (OpenCV): {data}")
-            
-        except Exception as e:
-            logger.debug(f"OpenCV QR detection failed: {e}")
+        Returns:
+            Scale < 1.0, hoặc 1.0 nếu region phải decode ở độ phân giải gốc
+            (ROI nhỏ, hoặc module sau khi thu nhỏ dưới PYRAMID_MIN_MODULE_PX)
+        """
+        if not self.pyramid_decode or min(roi_w, roi_h) < PYRAMID_MIN_ROI_SIDE:
+            return 1.0
+        if region.code_edge <= 0:
+            # Chưa học geometry: chỉ thử một bậc
+            return 0.5
+        module_px = region.code_edge / float(PYRAMID_ASSUMED_MODULES)
+        for scale in PYRAMID_SCALES:
+            if module_px * scale >= PYRAMID_MIN_MODULE_PX:
+                return scale
+        return 1.0
+    
+    def get_pyramid_stats(self) -> Dict[str, PyramidStats]:
+        """Thống kê pyramid decode của từng region (tỉ lệ đã chọn, thời gian tiết kiệm)"""
+        return dict(self._pyramid_stats)
+    
+    def _get_decoder(self, symbology: str) -> Optional[DecoderBackend]:
+        """Get decoder backend cho symbology (tạo một lần cho mỗi service)"""
+        if symbology not in self._decoders:
+            decoder = create_decoder(symbology)
+            if decoder is None:
+                logger.warning(f"No decoder backend available for symbology '{symbology}'")
+            else:
+                logger.info(f"Decoder for '{symbology}': {decoder.name}")
+            self._decoders[symbology] = decoder
+        return self._decoders[symbology]
+    
+    def _resolve_symbology(self, region: CropRegion, gray: Optional[np.ndarray] = None) -> Optional[str]:
+        """
+        Symbology của region: giá trị khai báo, hoặc (symbology="auto") kết quả phân loại
+        
+        Args:
+            region: Crop region
+            gray: ROI gray để phân loại (None = chỉ dùng kết quả đã có)
         
-        return qr_data_list
+        Returns:
+            Symbology, hoặc None nếu region "auto" chưa được phân loại
+        """
+        if region.symbology != SYMBOLOGY_AUTO:
+            return region.symbology
+        symbology = self._region_symbology.get(region.name)
+        if symbology is None and gray is not None:
+            symbology = classify_symbology(gray)
+            self._region_symbology[region.name] = symbology
+            logger.info(f"Region '{region.name}' classified as {symbology}")
+        return symbology
     
-    def _detect_datamatrix_pylibdmtx(self, roi: np.ndarray) -> List[str]:
+    def _dmtx_decode_kwargs(self, region: Optional[CropRegion], timeout: int = 100) -> Dict[str, Any]:
         """
-        Detect DataMatrix using pylibdmtx
+        Build pylibdmtx decode() arguments từ geometry đã học của region
         
         Args:
-            roi: Input ROI image
+            region: Crop region (None hoặc chưa học geometry = tìm toàn bộ)
+            timeout: Decoder timeout (ms)
         
         Returns:
-            List of DataMatrix data strings
+            kwargs cho dmtx_decode
         """
-        dmtx_data_list = []
+        kwargs: Dict[str, Any] = {'timeout': timeout}
+        if region is None or not region.has_code_geometry():
+            return kwargs
         
-        if not DMTX_AVAILABLE:
-            return dmtx_data_list
+        # Dừng ngay khi đủ số code mong đợi
+        kwargs['max_count'] = region.expected_count
         
-        try:
-            # Decode DataMatrix với timeout như testbase.py
-            dmtx_codes = dmtx_decode(roi, timeout=100)
-            
-            if dmtx_codes:
-                for dmtx_code in dmtx_codes:
-                    data = dmtx_code.data.decode('utf-8', errors='ignore')
-                    if data and data not in dmtx_data_list:
-                        dmtx_data_list.append(data)
-                        # Log với rect info như testbase.py
-                        logger.info(f"✅ DataMatrix (pylibdmtx) detected: {data}")
-                        logger.info(f"📐 Rect: {dmtx_code.rect}")
+        # Chỉ chấp nhận candidate có cạnh gần với cạnh đã học (±30%)
+        kwargs['min_edge'] = max(1, int(region.code_edge * (1.0 - CODE_EDGE_TOLERANCE)))
+        kwargs['max_edge'] = int(region.code_edge * (1.0 + CODE_EDGE_TOLERANCE)) + 1
         
-        except Exception as e:
-            logger.debug(f"pylibdmtx decode failed: {e}")
-        
-        return dmtx_data_list
-    
-    def _get_method_name(self, method: int) -> str:
-        """Get method name for logging"""
-        method_names = {
-            0: "original",
-            1: "clahe_binary",
-            2: "clahe_denoise_binary",
-            3: "adaptive_thresh",
-            4: "otsu_thresh",
-            5: "clahe_only",
-            6: "denoise_clahe_binary",
-            7: "invert_clahe_denoise_binary",
-            8: "invert_only",
-            9: "testbase_full",  # CLAHE + MedianBlur + AdaptiveThresh + Morphology
-            10: "testbase_no_morph",  # CLAHE + MedianBlur + AdaptiveThresh
-            11: "testbase_clahe"  # CLAHE only (clipLimit=2.0)
-        }
-        return method_names.get(method, f"method{method}")
+        shape = DMTX_SHAPES.get(region.symbol_shape)
+        if shape is not None:
+            kwargs['shape'] = shape
+        
+        # Code lớn: quét ở độ phân giải giảm (module vẫn đủ pixel)
+        if region.code_edge >= DMTX_SHRINK_MIN_EDGE:
+            kwargs['shrink'] = 2
+        
+        return kwargs
+    
+    def _scale_decode_kwargs(self, decode_kwargs: Dict[str, Any], scale: float) -> Dict[str, Any]:
+        """dmtx_decode kwargs cho ảnh đã thu nhỏ (cạnh code theo tỉ lệ, ảnh đã nhỏ nên bỏ shrink)"""
+        kwargs = dict(decode_kwargs)
+        kwargs.pop('shrink', None)
+        if 'min_edge' in kwargs:
+            kwargs['min_edge'] = max(1, int(kwargs['min_edge'] * scale))
+        if 'max_edge' in kwargs:
+            kwargs['max_edge'] = int(kwargs['max_edge'] * scale) + 1
+        return kwargs
+    
+    def get_method_name(self, method: int) -> str:
+        """Tên preprocessing method (log, ảnh debug, báo cáo batch_rescan)"""
+        return METHOD_NAMES.get(method, f"method{method}")
     
     def _save_processed_image(self, processed_roi: np.ndarray, region_name: str, method: int, attempt: int):
         """
@@ -420,7 +637,7 @@ class TemplateService:
         try:
             # Create filename with timestamp
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # milliseconds
-            method_name = self._get_method_name(method)
+            method_name = self.get_method_name(method)
             filename = f"{timestamp}_{region_name}_{method_name}_attempt{attempt+1}.png"
             filepath = os.path.join(self.logccd_dir, filename)
             
@@ -431,118 +648,536 @@ class TemplateService:
         except Exception as e:
             logger.warning(f"Failed to save processed image: {e}")
     
-    def scan_barcodes(self, image: np.ndarray, template: Template, max_attempts: int = 12) -> Dict[str, List[str]]:
+    def _scan_region(self, roi: np.ndarray, region: CropRegion, workspace: PreprocessWorkspace,
+                     max_attempts: int, decode_kwargs: Dict[str, Any],
+                     offset: Tuple[int, int] = (0, 0),
+                     deadline: Optional[DecodeDeadline] = None,
+                     save_images: bool = True, scale: float = 1.0,
+                     result: Optional[RegionScanResult] = None,
+                     methods: Sequence[int] = METHOD_PRIORITY,
+                     temporal_frames: int = 0) -> RegionScanResult:
+        """
+        Chạy cascade tiền xử lý + decode trên một ROI
+        
+        Args:
+            roi: ROI image (view)
+            region: Crop region
+            workspace: Workspace của region (theo kích thước sau khi thu nhỏ)
+            max_attempts: Maximum preprocessing attempts
+            decode_kwargs: Tham số dmtx_decode (đã đổi theo scale)
+            offset: Vị trí (x, y) của ROI trên ảnh (để đổi rect sang tọa độ ảnh)
+            deadline: Decode budget (None = không giới hạn, timeout 100ms/attempt)
+            save_images: Lưu ảnh đã xử lý vào logccd/
+            scale: Tỉ lệ thu nhỏ ROI trước khi decode (1.0 = độ phân giải gốc)
+            result: Kết quả một phần để scan tiếp (None = kết quả mới)
+            methods: Method tiền xử lý theo thứ tự thử
+            temporal_frames: > 0: method 2/6/7 dùng trung bình các frame trước thay NLM (streaming)
+        
+        Returns:
+            RegionScanResult
+        """
+        t_start = time.perf_counter()
+        if result is None:
+            result = RegionScanResult(region_name=region.name)
+        if scale == 1.0:
+            gray = workspace.load(roi, temporal_frames, self._temporal_sequence)
+        else:
+            gray = workspace.load_scaled(roi, scale, temporal_frames, self._temporal_sequence)
+        if temporal_frames > 0:
+            # Method 2 và 6 trùng chuỗi stage khi dùng ảnh trung bình: chỉ thử một lần
+            methods = workspace.distinct_methods(methods)
+        
+        # Chỉ chạy decoder của symbology region (không có backend = không tốn attempt nào)
+        symbology = self._resolve_symbology(region, gray)
+        decoder = self._get_decoder(symbology)
+        if decoder is None:
+            result.status = SCAN_NOT_FOUND
+            return result
+        
+        # Region đã học số code: scan tiếp đến khi đủ; chưa học: dừng ở lần đầu tìm thấy
+        expected_count = max(1, region.expected_count)
+        
+        # ROI lớn so với code: decode các patch DataMatrix đã định vị trước, quét toàn ROI sau
+        budget_skipped = False
+        if symbology == SYMBOLOGY_DATAMATRIX and self._use_locator(region, gray.shape[1], gray.shape[0], scale):
+            budget_skipped = self._scan_candidates(
+                gray, region, decoder, result, decode_kwargs, offset, deadline, expected_count, scale
+            )
+        
+        # Try multiple preprocessing methods (prioritize best methods first)
+        for attempt, method in enumerate(methods[:max_attempts]):
+            if len(result.codes) >= expected_count:
+                break
+            
+            # Decode budget: bỏ qua method nếu không đủ thời gian (method rẻ hơn phía sau vẫn được thử)
+            attempt_kwargs = decode_kwargs
+            if deadline is not None:
+                timeout = deadline.attempt_timeout_ms(workspace.estimate_ms(method))
+                if timeout is None:
+                    budget_skipped = True
+                    continue
+                attempt_kwargs = dict(decode_kwargs, timeout=timeout)
+            
+            # Preprocess
+            processed_roi = workspace.preprocess(method)
+            result.attempts += 1
+            
+            # Save processed image to logccd/
+            if save_images and self.save_processed_images:
+                self._save_processed_image(processed_roi, region.name, method, attempt)
+            
+            # Decode với backend của symbology
+            for data, rect in decoder.decode(processed_roi, symbology, **attempt_kwargs):
+                if result.add_code(data, self._to_image_rect(rect, offset, scale)):
+                    if result.method is None:
+                        result.method = method
+                    logger.info(f"{symbology} ({decoder.name}) found in '{region.name}' (method {method}, attempt {attempt+1}): {data}")
+        
+        # Phân loại sai (hoặc code đã đổi loại): phân loại lại ở lần scan sau
+        if not result.codes and region.symbology == SYMBOLOGY_AUTO:
+            self._region_symbology.pop(region.name, None)
+        
+        if result.codes:
+            result.status = SCAN_OK
+        elif budget_skipped:
+            result.status = SCAN_BUDGET_EXHAUSTED
+        else:
+            result.status = SCAN_NOT_FOUND
+        result.elapsed_ms += (time.perf_counter() - t_start) * 1000.0
+        return result
+    
+    def _to_image_rect(self, rect: Tuple[int, int, int, int], offset: Tuple[int, int],
+                       scale: float = 1.0) -> Tuple[int, int, int, int]:
+        """Đổi rect từ ảnh decode (có thể đã thu nhỏ) sang tọa độ ảnh đầy đủ"""
+        x, y, w, h = rect
+        if scale != 1.0:
+            x, y = int(x / scale), int(y / scale)
+            w, h = int(np.ceil(w / scale)), int(np.ceil(h / scale))
+        return x + offset[0], y + offset[1], w, h
+    
+    def _use_locator(self, region: CropRegion, roi_w: int, roi_h: int, scale: float = 1.0) -> bool:
+        """Candidate localization chỉ có lợi khi code chiếm phần nhỏ của ROI"""
+        if region.code_edge > 0:
+            code_edge = region.code_edge * scale
+            return roi_w * roi_h >= LOCATOR_MIN_AREA_RATIO * code_edge * code_edge
+        return min(roi_w, roi_h) >= LOCATOR_MIN_ROI_SIDE * scale
+    
+    def _scan_candidates(self, gray: np.ndarray, region: CropRegion, decoder: DecoderBackend,
+                         result: RegionScanResult,
+                         decode_kwargs: Dict[str, Any], offset: Tuple[int, int],
+                         deadline: Optional[DecodeDeadline], expected_count: int,
+                         scale: float = 1.0) -> bool:
+        """
+        Decode các patch DataMatrix đã định vị (theo thứ tự điểm số)
+        
+        Returns:
+            True nếu có patch bị bỏ qua vì hết decode budget
+        """
+        # Locator chỉ chạy khi còn đủ thời gian cho nó và ít nhất một attempt
+        pixels = gray.shape[0] * gray.shape[1]
+        if deadline is not None and deadline.attempt_timeout_ms(
+                self._stage_costs.estimate_ms(('locator',), pixels)) is None:
+            return True
+        t_stage = time.perf_counter()
+        candidates = locate_datamatrix_candidates(
+            gray, int(region.code_edge * scale), region.symbol_shape,
+            max_candidates=max(LOCATOR_MAX_CANDIDATES, expected_count)
+        )
+        self._stage_costs.record('locator', (time.perf_counter() - t_stage) * 1000.0, pixels)
+        # Mỗi patch chứa tối đa một code
+        patch_kwargs = dict(decode_kwargs, max_count=1)
+        
+        for candidate in candidates:
+            if len(result.codes) >= expected_count:
+                break
+            
+            patch_workspace = self._get_patch_workspace(candidate.patch.shape[1], candidate.patch.shape[0])
+            patch_workspace.load(candidate.patch)
+            bbox = self._to_image_rect(candidate.bbox, offset, scale)
+            
+            for method in LOCATOR_PATCH_METHODS:
+                if deadline is not None:
+                    timeout = deadline.attempt_timeout_ms(patch_workspace.estimate_ms(method))
+                    if timeout is None:
+                        return True
+                    patch_kwargs['timeout'] = timeout
+                
+                result.attempts += 1
+                symbols = decoder.decode(patch_workspace.preprocess(method), SYMBOLOGY_DATAMATRIX, **patch_kwargs)
+                for data, _ in symbols:
+                    if result.add_code(data, bbox):
+                        if result.method is None:
+                            result.method = method
+                        logger.info(f"DataMatrix ({decoder.name}) found in '{region.name}' (located patch, method {method}): {data}")
+                if symbols:
+                    break
+        
+        return False
+    
+    def _scan_region_pyramid(self, roi: np.ndarray, region_plan: RegionPlan, max_attempts: int,
+                             deadline: Optional[DecodeDeadline],
+                             methods: Optional[Sequence[int]] = None,
+                             temporal_frames: int = 0) -> RegionScanResult:
         """
-        Scan DataMatrix only in crop regions (nếu scan_barcode=True)
+        Coarse-to-fine: scan ảnh thu nhỏ trước, chỉ lên độ phân giải gốc khi chưa đủ code
+        Ghi lại tỉ lệ đã chọn và thời gian tiết kiệm vào PyramidStats của region
+        """
+        region = region_plan.region
+        workspace = region_plan.workspace
+        decode_kwargs = region_plan.decode_kwargs
+        if methods is None:
+            methods = region_plan.methods
+        offset = region_plan.bounds[:2]
+        scale = region_plan.pyramid_scale
+        stats = self._pyramid_stats.setdefault(region.name, PyramidStats())
+        stats.scale = scale
+        
+        if scale >= 1.0:
+            return self._scan_region(roi, region, workspace, max_attempts, decode_kwargs,
+                                     offset=offset, deadline=deadline, methods=methods,
+                                     temporal_frames=temporal_frames)
+        
+        roi_h, roi_w = roi.shape[:2]
+        scaled_workspace = self._get_scaled_workspace(
+            region, max(1, int(round(roi_w * scale))), max(1, int(round(roi_h * scale)))
+        )
+        result = self._scan_region(
+            roi, region, scaled_workspace, max_attempts, region_plan.scaled_decode_kwargs,
+            offset=offset, deadline=deadline, scale=scale, methods=methods,
+            temporal_frames=temporal_frames
+        )
+        
+        if len(result.codes) >= max(1, region.expected_count):
+            result.scale = scale
+            stats.scaled_hits += 1
+            # Chưa đo được độ phân giải gốc: ước lượng theo số pixel
+            baseline_ms = stats.full_res_ms or result.elapsed_ms / (scale * scale)
+            stats.saved_ms += max(0.0, baseline_ms - result.elapsed_ms)
+            logger.debug(f"Pyramid decode hit in '{region.name}' at scale {scale} ({result.elapsed_ms:.1f} ms)")
+            return result
+        
+        # Ảnh thu nhỏ chưa đủ code: scan tiếp ở độ phân giải gốc (giữ code đã tìm được)
+        stats.escalations += 1
+        scaled_ms = result.elapsed_ms
+        result = self._scan_region(roi, region, workspace, max_attempts, decode_kwargs,
+                                   offset=offset, deadline=deadline, result=result, methods=methods,
+                                   temporal_frames=temporal_frames)
+        full_ms = result.elapsed_ms - scaled_ms
+        if result.codes:
+            stats.full_res_ms = full_ms if not stats.full_res_ms else 0.7 * stats.full_res_ms + 0.3 * full_ms
+        logger.debug(f"Pyramid decode escalated to full resolution in '{region.name}' (+{full_ms:.1f} ms)")
+        return result
+    
+    def _scan_tracked(self, image: np.ndarray, region: CropRegion, tracker: CodeTracker,
+                      bounds: Tuple[int, int, int, int], decode_kwargs: Dict[str, Any],
+                      deadline: Optional[DecodeDeadline],
+                      temporal_frames: int = 0) -> Optional[RegionScanResult]:
+        """
+        Một lần decode rẻ: cửa sổ nhỏ quanh vị trí cũ + method thành công lần trước
+        
+        Returns:
+            RegionScanResult nếu đủ code, None nếu miss (caller quét toàn region)
+        """
+        track = tracker.get(region.name)
+        window = tracker.get_window(region.name, bounds)
+        symbology = self._resolve_symbology(region)
+        decoder = self._get_decoder(symbology) if symbology is not None else None
+        if track is None or window is None or decoder is None:
+            return None
+        
+        t_start = time.perf_counter()
+        wx, wy, ww, wh = window
+        if track.workspace is None:
+            track.workspace = PreprocessWorkspace(ww, wh, costs=self._stage_costs)
+        track.workspace.load(image[wy:wy+wh, wx:wx+ww], temporal_frames, self._temporal_sequence)
+        
+        attempt_kwargs = decode_kwargs
+        if deadline is not None:
+            timeout = deadline.attempt_timeout_ms(track.workspace.estimate_ms(track.method))
+            if timeout is None:
+                return None
+            attempt_kwargs = dict(decode_kwargs, timeout=timeout)
+        
+        processed = track.workspace.preprocess(track.method)
+        
+        result = RegionScanResult(region_name=region.name, method=track.method, attempts=1)
+        for data, (rx, ry, rw, rh) in decoder.decode(processed, symbology, **attempt_kwargs):
+            result.add_code(data, (rx + wx, ry + wy, rw, rh))
+        result.elapsed_ms = (time.perf_counter() - t_start) * 1000.0
+        
+        if len(result.codes) < max(1, region.expected_count):
+            logger.debug(f"Tracking miss in '{region.name}', falling back to full search")
+            return None
+        
+        result.status = SCAN_OK
+        return result
+    
+    def scan_regions(self, image: np.ndarray, template: Template, max_attempts: int = 12,
+                     deadline: Optional[DecodeDeadline] = None,
+                     tracker: Optional[CodeTracker] = None,
+                     reject_poor_quality: bool = False,
+                     temporal_denoise: bool = False) -> Dict[str, RegionScanResult]:
+        """
+        Scan barcodes in crop regions (nếu scan_barcode=True, theo symbology của region), trả về chi tiết từng region
         Saves processed images to logccd/ directory
         
         Args:
             image: Input image (already grayscale/mono)
             template: Template with crop regions
-            max_attempts: Maximum preprocessing attempts (default: 9)
+            max_attempts: Maximum preprocessing attempts (default: 12)
+            deadline: Decode budget cho cả lần scan (None = không giới hạn)
+            tracker: Code tracker (streaming) - thử cửa sổ nhỏ quanh vị trí cũ trước
+            reject_poor_quality: Không decode region có ảnh quá kém (streaming: chờ frame sau)
+            temporal_denoise: Frame liên tiếp của cùng cảnh (streaming) - trung bình thay NLM
         
         Returns:
-            Dictionary of {region_name: [barcode_data, ...]}
+            Dictionary of {region_name: RegionScanResult}
         """
-        barcode_results = {}
-        
-        # Preprocessing method priority: theo testbase.py
-        # Method 9: Testbase full (CLAHE + MedianBlur + AdaptiveThresh + Morphology) - BEST
-        # Method 10: Testbase no morph (CLAHE + MedianBlur + AdaptiveThresh)
-        # Method 11: Testbase CLAHE only (clipLimit=2.0)
-        # Method 0: Original (gray)
-        # Method 2: CLAHE + Denoise + Binarization
-        # Method 7: Invert + CLAHE + Denoise + Binarization (white-on-dark)
-        # Method 1: CLAHE + Binarization
-        # Method 6: Denoise + CLAHE + Binarization
-        # Method 8: Invert only
-        # Method 3: Adaptive threshold
-        # Method 4: Otsu threshold
-        # Method 5: CLAHE only
-        method_priority = [9, 10, 11, 0, 2, 7, 1, 6, 8, 3, 4, 5]
+        region_results: Dict[str, RegionScanResult] = {}
+        img_h, img_w = image.shape[:2]
+        plan = self._get_plan(template, img_w, img_h)
+        scan_regions = plan.scan_regions
+        temporal_frames = self.temporal_denoise_frames if temporal_denoise else 0
+        if temporal_frames:
+            self._temporal_sequence += 1
         
-        for region in template.crop_regions:
-            if not region.enabled or not region.scan_barcode:
+        for index, region_plan in enumerate(scan_regions):
+            region = region_plan.region
+            # Hết ngân sách: trả kết quả một phần, region còn lại đánh dấu budget_exhausted
+            if deadline is not None and not deadline.start_region(len(scan_regions) - index):
+                logger.warning(f"Decode budget exhausted before '{region.name}'")
+                for name, _ in region_plan.members:
+                    region_results[name] = RegionScanResult(region_name=name, status=SCAN_BUDGET_EXHAUSTED)
                 continue
             
             try:
-                # Extract ROI
-                x, y, w, h = region.x, region.y, region.width, region.height
+                roi = image[region_plan.window]
+                pixels = roi.shape[0] * roi.shape[1]
                 
-                # Validate bounds
-                img_h, img_w = image.shape[:2]
-                x = max(0, min(x, img_w - 1))
-                y = max(0, min(y, img_h - 1))
-                w = max(1, min(w, img_w - x))
-                h = max(1, min(h, img_h - y))
+                # Presence check + quality gate cũng tính vào budget: không đủ thời gian cho chúng
+                # và một attempt thì bỏ region như khi hết ngân sách
+                gate_stages = ((('presence',) if region.presence_edge_density > 0 else ()) +
+                               (('quality',) if self.quality_gate else ()))
+                if deadline is not None and gate_stages and deadline.attempt_timeout_ms(
+                        self._stage_costs.estimate_ms(gate_stages, pixels)) is None:
+                    logger.warning(f"Decode budget exhausted before '{region.name}'")
+                    for name, _ in region_plan.members:
+                        region_results[name] = RegionScanResult(region_name=name, status=SCAN_BUDGET_EXHAUSTED)
+                    continue
+                
+                # Region trống (không có hàng / thiếu nhãn): miss ngay, không chạy cascade
+                t_stage = time.perf_counter()
+                absent = code_absent(roi, region)
+                if region.presence_edge_density > 0:
+                    self._stage_costs.record('presence', (time.perf_counter() - t_stage) * 1000.0, pixels)
+                if absent:
+                    logger.debug(f"No code present in '{region.name}', decode skipped")
+                    for name, _ in region_plan.members:
+                        region_results[name] = RegionScanResult(region_name=name, status=SCAN_EMPTY)
+                    if tracker is not None:
+                        tracker.update(RegionScanResult(region_name=region.name, status=SCAN_EMPTY))
+                    continue
                 
-                # Extract ROI
-                roi = image[y:y+h, x:x+w].copy()
+                # Quality gate: ảnh quá kém -> bỏ frame (streaming), kém vừa -> bộ method rút gọn
+                quality = None
+                methods = region_plan.methods
+                if self.quality_gate:
+                    t_stage = time.perf_counter()
+                    quality = assess_quality(roi, region.quality_focus, region.quality_contrast)
+                    self._stage_costs.record('quality', (time.perf_counter() - t_stage) * 1000.0, pixels)
+                    if reject_poor_quality and quality.flat:
+                        # ROI phẳng (thiếu nhãn, region chưa học presence / nhóm gộp): region trống
+                        logger.debug(f"Flat image in '{region.name}', treated as empty: {quality.summary()}")
+                        for name, _ in region_plan.members:
+                            region_results[name] = RegionScanResult(
+                                region_name=name, status=SCAN_EMPTY, quality=quality
+                            )
+                        if tracker is not None:
+                            tracker.update(RegionScanResult(region_name=region.name, status=SCAN_EMPTY))
+                        continue
+                    if reject_poor_quality and quality.reject:
+                        logger.debug(f"Frame rejected for '{region.name}': {quality.summary()}")
+                        for name, _ in region_plan.members:
+                            region_results[name] = RegionScanResult(
+                                region_name=name, status=SCAN_REJECTED, quality=quality
+                            )
+                        continue
+                    methods = methods_for_quality(quality, methods)
+                    if not quality.ok:
+                        logger.debug(f"Image quality in '{region.name}': {quality.summary()}, methods {list(methods)}")
                 
-                barcode_data_list = []
-                found = False
+                # Streaming: thử vị trí + method của frame trước, miss mới quét toàn region
+                result = None
+                if tracker is not None:
+                    result = self._scan_tracked(image, region, tracker, region_plan.bounds,
+                                                region_plan.decode_kwargs, deadline, temporal_frames)
                 
-                # Try multiple preprocessing methods (prioritize best methods first)
-                for attempt in range(min(max_attempts, len(method_priority))):
-                    if found:
-                        break
-                    
-                    # Use priority order
-                    method = method_priority[attempt]
-                    
-                    # Preprocess
-                    processed_roi = self._preprocess_for_barcode(roi, method)
-                    
-                    # Save processed image to logccd/
-                    self._save_processed_image(processed_roi, region.name, method, attempt)
-                    
-                    # Try pylibdmtx DataMatrix (only method for DataMatrix)
-                    if DMTX_AVAILABLE:
-                        dmtx_data = self._detect_datamatrix_pylibdmtx(processed_roi)
-                        if dmtx_data:
-                            for data in dmtx_data:
-                                if data and data not in barcode_data_list:
-                                    barcode_data_list.append(data)
-                                    logger.info(f"DataMatrix (pylibdmtx) found in '{region.name}' (method {method}, attempt {attempt+1}): {data}")
-                                    found = True
+                if result is None:
+                    # Decode ROI (view) với geometry đã học (ảnh thu nhỏ trước)
+                    result = self._scan_region_pyramid(roi, region_plan, max_attempts, deadline, methods,
+                                                       temporal_frames)
+                result.quality = quality
                 
-                if not barcode_data_list:
-                    logger.warning(f"No DataMatrix found in '{region.name}' after {min(max_attempts, len(method_priority))} attempts")
+                if tracker is not None:
+                    tracker.update(result)
                 
-                barcode_results[region.name] = barcode_data_list
+                if result.status == SCAN_BUDGET_EXHAUSTED:
+                    logger.warning(f"No barcode found in '{region.name}': decode budget exhausted after {result.attempts} attempts")
+                elif not result.codes:
+                    logger.warning(f"No barcode found in '{region.name}' after {result.attempts} attempts")
+                
+                if region_plan.merged:
+                    region_results.update(self._split_merged_result(result, region_plan.members))
+                else:
+                    region_results[region.name] = result
                 
             except Exception as e:
-                logger.error(f"Failed to scan DataMatrix in '{region.name}': {e}", exc_info=True)
-                barcode_results[region.name] = []
+                logger.error(f"Failed to scan barcode in '{region.name}': {e}", exc_info=True)
+                for name, _ in region_plan.members:
+                    region_results[name] = RegionScanResult(region_name=name, status=SCAN_ERROR)
         
-        return barcode_results
+        # Thứ tự kết quả theo template (nhóm gộp có thể xen giữa các region khác)
+        return {name: region_results[name] for name in plan.region_order if name in region_results}
     
-    def process_image_with_template(self, image: np.ndarray, template: Template) -> Dict[str, Any]:
+    def scan_barcodes(self, image: np.ndarray, template: Template, max_attempts: int = 12,
+                      deadline: Optional[DecodeDeadline] = None) -> Dict[str, List[str]]:
+        """
+        Scan barcodes in crop regions (nếu scan_barcode=True, theo symbology của region)
+        Saves processed images to logccd/ directory
+        
+        Args:
+            image: Input image (already grayscale/mono)
+            template: Template with crop regions
+            max_attempts: Maximum preprocessing attempts (default: 12)
+            deadline: Decode budget cho cả lần scan (None = không giới hạn)
+        
+        Returns:
+            Dictionary of {region_name: [barcode_data, ...]}
+        """
+        region_results = self.scan_regions(image, template, max_attempts, deadline)
+        return {name: result.codes for name, result in region_results.items()}
+    
+    def learn_code_geometry(self, master_image: np.ndarray, template: Template,
+                            region_names: Optional[List[str]] = None) -> int:
+        """
+        Học số lượng code, cạnh code và hình dạng symbol của từng region từ ảnh master
+        (scan toàn bộ, không dùng hint), lưu vào CropRegion
+        
+        Args:
+            master_image: Ảnh master (panel chuẩn)
+            template: Template cần học
+            region_names: Chỉ học các region này (None = tất cả)
+        
+        Returns:
+            Số region học thành công
+        """
+        learned = 0
+        img_h, img_w = master_image.shape[:2]
+        
+        for region in template.crop_regions:
+            if not region.enabled or not region.scan_barcode:
+                continue
+            if region_names is not None and region.name not in region_names:
+                continue
+            
+            region.clear_code_geometry()
+            try:
+                x, y, w, h = clamp_region_bounds(region, img_w, img_h)
+                roi = master_image[y:y+h, x:x+w]
+                
+                workspace = PreprocessWorkspace(w, h, preallocate=False, costs=self._stage_costs)
+                result = self._scan_region(
+                    roi, region, workspace, len(METHOD_PRIORITY),
+                    self._dmtx_decode_kwargs(None), offset=(x, y), save_images=False
+                )
+                if not result.codes:
+                    logger.warning(f"Code geometry not learned for '{region.name}': no code on master image")
+                    continue
+                
+                edges = sorted(max(rw, rh) for _, _, rw, rh in result.rects)
+                aspects = [max(rw, rh) / max(1, min(rw, rh)) for _, _, rw, rh in result.rects]
+                
+                region.expected_count = len(result.codes)
+                region.code_edge = int(edges[len(edges) // 2])
+                region.symbol_shape = "square" if max(aspects) < 1.3 else "rect"
+                region.code_rects = [list(rect) for rect in result.rects]
+                region.presence_edge_density, region.presence_contrast = measure_presence(roi)
+                region.quality_focus, _, region.quality_contrast = measure_quality(roi)
+                learned += 1
+                
+                logger.info(
+                    f"Code geometry learned for '{region.name}': count={region.expected_count}, "
+                    f"edge={region.code_edge}px, shape={region.symbol_shape}, "
+                    f"edge density={region.presence_edge_density:.3f}, contrast={region.presence_contrast:.1f}, "
+                    f"focus={region.quality_focus:.0f}"
+                )
+            
+            except Exception as e:
+                logger.error(f"Failed to learn code geometry for '{region.name}': {e}", exc_info=True)
+        
+        # Decode kwargs trong plan phụ thuộc geometry
+        self.invalidate_plan()
+        return learned
+    
+    def process_image_with_template(self, image: np.ndarray, template: Template,
+                                    budget_ms: Optional[float] = None,
+                                    tracker: Optional[CodeTracker] = None,
+                                    reject_poor_quality: bool = False,
+                                    temporal_denoise: bool = False) -> Dict[str, Any]:
         """
         Process image with template: crop regions + scan barcodes
         
         Args:
             image: Input image
             template: Template
+            budget_ms: Tổng thời gian cho phép để decode (vd. check_timeout_ms của PLC).
+                       None = không giới hạn
+            tracker: Code tracker cho streaming (None = luôn quét toàn region)
+            reject_poor_quality: Bỏ qua region có ảnh quá kém (mờ / cháy sáng) thay vì decode
+            temporal_denoise: Frame streaming liên tiếp - khử nhiễu bằng trung bình nhiều frame
         
         Returns:
             Dictionary with results:
             {
-                'cropped_images': {region_name: image},
+                'cropped_images': RegionCrops {region_name: view chỉ đọc, tạo khi truy cập},
                 'barcodes': {region_name: [data, ...]},
+                'region_results': {region_name: RegionScanResult},
+                'quality': {region_name: QualityReport},
+                'status': 'ok' | 'budget_exhausted',
+                'budget_exhausted': bool,
+                'rejected': bool,
+                'rejected_regions': [region_name, ...] (ảnh quá kém, không decode - streaming: không bỏ phiếu),
                 'success': bool
             }
         """
         try:
-            # Crop regions
-            cropped_images = self.crop_image_regions(image, template)
+            # Crop regions (lazy views - không copy trên hot path)
+            cropped_images = self.get_region_crops(image, template)
             
             # Scan barcodes
-            barcodes = self.scan_barcodes(image, template)
+            deadline = DecodeDeadline(budget_ms) if budget_ms is not None else None
+            region_results = self.scan_regions(image, template, deadline=deadline, tracker=tracker,
+                                               reject_poor_quality=reject_poor_quality,
+                                               temporal_denoise=temporal_denoise)
+            barcodes = {name: result.codes for name, result in region_results.items()}
+            quality = {name: result.quality for name, result in region_results.items()
+                       if result.quality is not None}
+            rejected_regions = [name for name, r in region_results.items() if r.status == SCAN_REJECTED]
+            rejected = bool(rejected_regions)
+            
+            budget_exhausted = any(r.status == SCAN_BUDGET_EXHAUSTED for r in region_results.values())
+            if budget_exhausted:
+                logger.warning(f"Decode budget of {budget_ms:.0f} ms exhausted, returning partial result")
             
             return {
                 'cropped_images': cropped_images,
                 'barcodes': barcodes,
+                'region_results': region_results,
+                'quality': quality,
+                'status': SCAN_BUDGET_EXHAUSTED if budget_exhausted else SCAN_OK,
+                'budget_exhausted': budget_exhausted,
+                'rejected': rejected,
+                'rejected_regions': rejected_regions,
                 'success': True
             }
             
@@ -552,6 +1187,12 @@ class TemplateService:
             return {
                 'cropped_images': {},
                 'barcodes': {},
+                'region_results': {},
+                'quality': {},
+                'status': SCAN_ERROR,
+                'budget_exhausted': False,
+                'rejected': False,
+                'rejected_regions': [],
                 'success': False,
                 'error': str(e)
             }
@@ -0,0 +1,115 @@
+"""
+Temporal Denoise - Khử nhiễu bằng trung bình N frame gần nhất của một region
+Panel đứng yên + camera 30 FPS: nhiễu sensor giảm ~sqrt(N) với chi phí một phép cộng/trừ mỗi frame,
+thay cho fastNlMeansDenoising (stage đắt nhất của cascade) ở các method 2 / 6 / 7
+"""
+import logging
+from typing import Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Số frame trung bình mặc định
+TEMPORAL_DEFAULT_FRAMES = 4
+
+# Tổng cộng dồn là uint16: N * 255 + N // 2 (làm tròn) phải <= 65535
+TEMPORAL_MAX_FRAMES = 256
+
+# Frame lệch trung bình quá mức này (mức xám, ảnh thu nhỏ) so với frame trước = cảnh đã đổi
+# (panel mới / rung), bỏ lịch sử và bắt đầu lại
+TEMPORAL_MAX_MEAN_DIFF = 6.0
+
+# Ảnh so sánh cảnh được thu nhỏ TEMPORAL_CHECK_STRIDE lần mỗi chiều
+TEMPORAL_CHECK_STRIDE = 8
+
+
+def temporal_frame_count(frames: int) -> int:
+    """Số frame thực dùng cho N yêu cầu (2..TEMPORAL_MAX_FRAMES)"""
+    return min(TEMPORAL_MAX_FRAMES, max(2, int(frames)))
+
+
+class TemporalAverager:
+    """
+    Ring buffer N frame gray (cùng kích thước) của một region + tổng cộng dồn
+    - push(): thêm frame, trả về ảnh trung bình (buffer nội bộ) khi có >= 2 frame cùng cảnh
+    - Frame chỉ được coi là thẳng hàng khi cảnh không đổi (vùng crop cố định, panel đứng yên)
+    """
+
+    def __init__(self, frames: int = TEMPORAL_DEFAULT_FRAMES):
+        self.frames = temporal_frame_count(frames)
+        self._shape = None
+        self._ring: Optional[np.ndarray] = None
+        self._sum: Optional[np.ndarray] = None
+        self._quotient: Optional[np.ndarray] = None
+        self._average: Optional[np.ndarray] = None
+        self._last_small: Optional[np.ndarray] = None
+        self._count = 0
+        self._head = 0
+
+    def _allocate(self, shape):
+        self._shape = shape
+        self._ring = np.empty((self.frames,) + shape, dtype=np.uint8)
+        self._sum = np.zeros(shape, dtype=np.uint16)
+        self._quotient = np.empty(shape, dtype=np.uint16)
+        self._average = np.empty(shape, dtype=np.uint8)
+        self.reset()
+
+    def reset(self):
+        """Bỏ lịch sử (cảnh đổi / template đổi)"""
+        self._count = 0
+        self._head = 0
+        self._last_small = None
+        if self._sum is not None:
+            self._sum.fill(0)
+
+    @property
+    def count(self) -> int:
+        """Số frame đang được trung bình"""
+        return self._count
+
+    def _scene_changed(self, gray: np.ndarray) -> bool:
+        small_w = max(1, gray.shape[1] // TEMPORAL_CHECK_STRIDE)
+        small_h = max(1, gray.shape[0] // TEMPORAL_CHECK_STRIDE)
+        small = cv2.resize(gray, (small_w, small_h), interpolation=cv2.INTER_AREA)
+        previous, self._last_small = self._last_small, small
+        if previous is None:
+            return False
+        return float(cv2.absdiff(small, previous).mean()) > TEMPORAL_MAX_MEAN_DIFF
+
+    def push(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Thêm một frame gray của region
+
+        Args:
+            gray: Ảnh gray (uint8) của region ở frame hiện tại
+
+        Returns:
+            Ảnh trung bình (buffer nội bộ, hợp lệ đến lần push tiếp theo), None nếu mới có 1 frame
+        """
+        if gray.shape != self._shape:
+            self._allocate(gray.shape)
+        if self._scene_changed(gray):
+            logger.debug(f"Temporal denoise reset: scene changed ({self._count} frames dropped)")
+            self._count = 0
+            self._head = 0
+            self._sum.fill(0)
+
+        slot = self._ring[self._head]
+        if self._count == self.frames:
+            # Ring đầy: bỏ frame cũ nhất khỏi tổng
+            np.subtract(self._sum, slot, out=self._sum)
+        else:
+            self._count += 1
+        np.copyto(slot, gray)
+        np.add(self._sum, slot, out=self._sum)
+        self._head = (self._head + 1) % self.frames
+
+        if self._count < 2:
+            return None
+        # Trung bình làm tròn: (sum + count/2) // count
+        np.add(self._sum, self._count // 2, out=self._quotient)
+        np.floor_divide(self._quotient, self._count, out=self._quotient)
+        np.copyto(self._average, self._quotient, casting='unsafe')
+        return self._average
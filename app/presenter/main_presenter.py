@@ -4,17 +4,18 @@ Theo MVP: Presenter chứa logic, không biết chi tiết UI
 """
 import logging
 import os
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 import numpy as np
 import cv2
 from PySide6.QtCore import QObject, QTimer
 from app.view.view_interface import IView, IPresenter
 from app.model import CameraConnectionService
-from app.model.qr import QRDetectionService, QRDetectionResult
+from app.model.qr import QRDetectionService, QRDetectionResult, ROIRegion
 from app.model.recipe import RecipeService, Recipe, TemplateRegion, QRROIRegion, Tolerance
-from app.model.template import TemplateMatchingService, MatchResult
-from app.model.template_data import TemplateService, Template, CropRegion
+from app.model.template import TemplateMatchingService, MatchResult, PanelPose, FiducialTracker
+from app.model.template_data import TemplateService, Template, CropRegion, CodeTracker, ResultConsensus
 from .state_machine import StateMachine, AppState
 from services.remoteTcpServer import RemoteTcpClient
 from services.logService import getLogger
@@ -48,10 +49,28 @@ class MainPresenter(QObject):
         self._recipe_service = RecipeService()
         
         # Template Matching Service
-        self._template_matching_service = TemplateMatchingService()
+        tm_cfg = (settings.get('template_matching', {}) or {})
+        self._template_matching_service = TemplateMatchingService(
+            use_pyramid=bool(tm_cfg.get('pyramid', True)),
+            angle_range=float(tm_cfg.get('angle_range', 5.0)),
+            angle_step=float(tm_cfg.get('angle_step', 0.5))
+        )
+        
+        # Recipe trong setting: Running Mode định vị panel theo fiducial, decode QR ROI theo tư thế panel
+        recipe_cfg = (settings.get('recipe', {}) or {})
+        self._active_recipe_name = str(recipe_cfg.get('active', '') or '')
+        self._recipe_search_margin = int(recipe_cfg.get('search_margin', 50))
+        self._last_pose: Optional[PanelPose] = None
+        # Streaming: fiducial chính chỉ tìm trong cửa sổ nhỏ quanh vị trí dự đoán từ frame trước
+        self._fiducial_tracker = FiducialTracker()
         
         # Template Service (NEW - Simple template system)
-        self._template_service = TemplateService()
+        barcode_cfg = (settings.get('barcode', {}) or {})
+        self._template_service = TemplateService(
+            pyramid_decode=bool(barcode_cfg.get('pyramid_decode', True)),
+            quality_gate=bool(barcode_cfg.get('quality_gate', True)),
+            temporal_denoise_frames=int(barcode_cfg.get('temporal_denoise_frames', 4))
+        )
         
         # Camera Settings Service
         from services.cameraSettingsService import CameraSettingsService
@@ -65,6 +84,22 @@ class MainPresenter(QObject):
         # Running mode state
         self._last_match_result = None
         
+        # Streaming: nhớ vị trí DataMatrix giữa các frame
+        self._code_tracker = CodeTracker()
+        
+        # Streaming: consensus kết quả qua nhiều frame
+        self._result_consensus = ResultConsensus(
+            window=barcode_cfg.get('consensus_window', 5),
+            min_agree=barcode_cfg.get('consensus_min_agree', 3),
+            fail_after=barcode_cfg.get('consensus_fail_after', 15)
+        )
+        # Gửi kết quả ổn định lên TCP server (mặc định tắt: PLC chờ một phản hồi cho mỗi lần check)
+        self._send_on_stable = bool(barcode_cfg.get('send_on_stable', False))
+        
+        # Streaming: bỏ frame mờ / cháy sáng, chờ frame sau
+        self._reject_poor_frames = bool(barcode_cfg.get('reject_poor_frames', True))
+        self._last_quality_notice = ""
+        
         # Test image for running mode (without camera)
         self._test_image = None
         self._test_image_path = None
@@ -105,6 +140,10 @@ class MainPresenter(QObject):
         self._view.update_template_list(templates)
         logger.info(f"Loaded {len(templates)} template(s)")
         
+        # Recipe đang dùng (thay cho template ở Running Mode)
+        if self._active_recipe_name:
+            self._load_active_recipe(self._active_recipe_name)
+        
         # Load camera settings if available
         settings = self._camera_settings_service.load_settings()
         if settings:
@@ -217,6 +256,7 @@ class MainPresenter(QObject):
         template = self._template_service.load_template(template_name)
         if template:
             self._template_service.set_current_template(template)
+            self._reset_stream_tracking()
             self._view.update_current_template_info(self._build_template_info(template))
             # Ensure Template Mode shows the right panels when a template is loaded (auto-load from combo)
             if hasattr(self._view, "_set_template_tab_mode"):
@@ -252,10 +292,13 @@ class MainPresenter(QObject):
                 name=name, x=x, y=y, width=width, height=height,
                 enabled=True, scan_barcode=scan_barcode
             ))
+            self._relearn_region_geometry(template, template.crop_regions[-1])
+            self._template_service.invalidate_plan()
 
             if self._template_service.save_template(template):
                 # Keep current template in memory updated
                 self._template_service.set_current_template(template)
+                self._reset_stream_tracking()
                 self._view.update_current_template_info(self._build_template_info(template))
                 if hasattr(self._view, "update_template_regions_table"):
                     self._view.update_template_regions_table(template.crop_regions)
@@ -284,9 +327,13 @@ class MainPresenter(QObject):
             region.width = int(width)
             region.height = int(height)
             region.scan_barcode = bool(scan_barcode)
+            self._relearn_region_geometry(template, region)
+            # Plan đã biên dịch giữ bounds / decode kwargs cũ của region
+            self._template_service.invalidate_plan()
 
             if self._template_service.save_template(template):
                 self._template_service.set_current_template(template)
+                self._reset_stream_tracking()
                 self._view.update_current_template_info(self._build_template_info(template))
                 if hasattr(self._view, "update_template_regions_table"):
                     self._view.update_template_regions_table(template.crop_regions)
@@ -297,6 +344,18 @@ class MainPresenter(QObject):
             logger.error(f"Failed to update region in current template: {e}", exc_info=True)
             self._view.show_message(f"Error updating region: {e}", "error")
 
+    def _relearn_region_geometry(self, template: Template, region: CropRegion):
+        """Re-learn code geometry for an edited region (needs a master image of the same size)."""
+        region.clear_code_geometry()
+        master = self._template_master_image
+        if master is None:
+            return
+        h, w = master.shape[:2]
+        if (w, h) != (template.master_image_width, template.master_image_height):
+            logger.info(f"Master image size differs from template, geometry of '{region.name}' cleared")
+            return
+        self._template_service.learn_code_geometry(master, template, region_names=[region.name])
+
     def on_current_template_region_deleted(self, index: int):
         """Delete a region from the currently loaded template."""
         template = self._template_service.get_current_template()
@@ -311,9 +370,11 @@ class MainPresenter(QObject):
         try:
             region_name = template.crop_regions[index].name
             template.crop_regions.pop(index)
+            self._template_service.invalidate_plan()
 
             if self._template_service.save_template(template):
                 self._template_service.set_current_template(template)
+                self._reset_stream_tracking()
                 self._view.update_current_template_info(self._build_template_info(template))
                 if hasattr(self._view, "update_template_regions_table"):
                     self._view.update_template_regions_table(template.crop_regions)
@@ -389,6 +450,7 @@ class MainPresenter(QObject):
                             log_text += f"[OK] {region_name}: {barcode_data}\n"
                     else:
                         log_text += f"[NG] {region_name}: No barcode found\n"
+                log_text += self._format_quality_issues(results)
                 
                 if log_text:
                     logger.info(f"Barcode detection results:\n{log_text}")
@@ -414,6 +476,7 @@ class MainPresenter(QObject):
         - Hiển thị kết quả lên Barcode Results
         """
         logger.info("Manual Start (capture + process) clicked")
+        t_start = time.perf_counter()
 
         # Validate camera state
         if not (self._state_machine.is_connected() or self._state_machine.is_streaming()):
@@ -421,9 +484,10 @@ class MainPresenter(QObject):
             logger.warning("Manual start requested but camera is not connected")
             return
 
-        # Validate template
+        # Validate template (recipe đang dùng: không cần template)
+        current_recipe = self._recipe_service.get_current_recipe()
         current_template = self._template_service.get_current_template()
-        if current_template is None:
+        if current_recipe is None and current_template is None:
             self._view.show_message("Please load a template first", "warning")
             logger.warning("Manual start requested but no template is loaded")
             return
@@ -437,21 +501,24 @@ class MainPresenter(QObject):
                 logger.warning("Manual start: failed to get frame from camera")
                 return
 
-            # Save captured image to screenccd folder
-            saved_path = self._save_captured_image(frame)
-            if saved_path:
-                logger.info(f"Image saved to: {saved_path}")
-
             display_frame = frame.copy()
 
-            # Process with template: crop regions + scan barcodes
-            results = self._template_service.process_image_with_template(
-                frame, current_template
-            )
+            if current_recipe is not None:
+                # Recipe: định vị panel theo fiducial, decode QR ROI theo tư thế panel
+                results = {"success": True, "barcodes": self._inspect_with_recipe(frame, current_recipe)}
+            else:
+                # Process with template: crop regions + scan barcodes
+                # Decode budget: kết quả phải gửi được trước check timeout của PLC
+                elapsed_ms = (time.perf_counter() - t_start) * 1000.0
+                results = self._template_service.process_image_with_template(
+                    frame, current_template, budget_ms=self._get_decode_budget_ms(elapsed_ms)
+                )
 
             if results["success"]:
-                # Draw template regions on image if enabled
-                if self._view.get_show_regions_enabled():
+                # Draw template / recipe regions on image if enabled
+                if current_recipe is not None and self._view.get_show_regions_enabled():
+                    self._draw_recipe_regions(display_frame, current_recipe)
+                elif self._view.get_show_regions_enabled():
                     display_frame = self._template_service.draw_template_regions(
                         display_frame, current_template, draw_regions=True
                     )
@@ -474,9 +541,13 @@ class MainPresenter(QObject):
                             log_text += f"[OK] {region_name}: {barcode_data}\n"
                     else:
                         log_text += f"[NG] {region_name}: No barcode found\n"
+                log_text += self._format_quality_issues(results)
                 if log_text:
                     logger.info(f"Manual barcode detection results:\n{log_text}")
                 
+                if results.get("budget_exhausted"):
+                    self._view.show_message("Decode budget exhausted - partial result", "warning")
+
                 # Gửi kết quả scan đến server
                 self._send_scan_result_to_server(barcode_results)
             else:
@@ -484,6 +555,11 @@ class MainPresenter(QObject):
                 self._view.show_message(f"Processing failed: {error_msg}", "error")
                 logger.error(f"Manual template processing failed: {error_msg}")
 
+            # Save captured image to screenccd folder (sau khi đã gửi kết quả)
+            saved_path = self._save_captured_image(frame)
+            if saved_path:
+                logger.info(f"Image saved to: {saved_path}")
+
         except Exception as e:
             logger.error(f"Manual capture + process failed: {e}", exc_info=True)
             self._view.show_message(f"Error: {str(e)}", "error")
@@ -557,6 +633,10 @@ class MainPresenter(QObject):
             master_image_height=h
         )
         
+        # Learn code count / size / shape per region from the master image
+        learned = self._template_service.learn_code_geometry(self._template_master_image, template)
+        logger.info(f"Code geometry learned for {learned} region(s)")
+        
         # Save template
         if self._template_service.save_template(template):
             self._view.show_message(f"Template '{template_name}' saved successfully", "success")
@@ -646,6 +726,13 @@ class MainPresenter(QObject):
                             results_text += f"{region_name}: No barcode detected\n"
                             logger.info(f"{region_name}: No barcode detected")
                 
+                # Image quality
+                quality = results.get('quality', {})
+                if quality:
+                    results_text += "\n=== Image Quality ===\n"
+                    for region_name, report in quality.items():
+                        results_text += f"{region_name}: {report.summary()}\n"
+                
                 if not results_text:
                     results_text = "No results"
 
@@ -671,6 +758,53 @@ class MainPresenter(QObject):
     
     # ========== Private Methods ==========
     
+    def _reset_stream_tracking(self):
+        """Forget cross-frame decode state (template changed / streaming stopped)."""
+        self._code_tracker.reset()
+        self._fiducial_tracker.reset()
+        self._result_consensus.reset()
+        self._template_service.reset_temporal_denoise()
+        self._last_quality_notice = ""
+    
+    def _format_quality_issues(self, results: dict) -> str:
+        """Dòng log cho các region có ảnh kém (mờ / cháy sáng / thiếu tương phản)"""
+        text = ""
+        for region_name, report in results.get('quality', {}).items():
+            if not report.ok:
+                text += f"[Q] {region_name}: {report.summary()}\n"
+        return text
+    
+    def _notify_quality(self, results: dict):
+        """Streaming: báo lỗi chất lượng ảnh lên status bar / log khi tình trạng thay đổi"""
+        issues = sorted({issue for report in results.get('quality', {}).values() for issue in report.issues})
+        notice = ", ".join(issues)
+        if notice == self._last_quality_notice:
+            return
+        self._last_quality_notice = notice
+        if notice:
+            action = "waiting for next frame" if results.get('rejected') else "reduced decode methods"
+            logger.info(f"Poor image quality ({notice}) - {action}:\n{self._format_quality_issues(results)}")
+            self._view.show_message(f"Image quality: {notice} ({action})", "info")
+        else:
+            logger.info("Image quality back to normal")
+            self._view.show_message("Image quality OK", "info")
+    
+    def _get_decode_budget_ms(self, elapsed_ms: float = 0.0) -> Optional[float]:
+        """
+        Decode budget cho một lần check: check_timeout_ms của TCP server trừ dự phòng
+        và thời gian đã dùng (capture). TCP server không bật: barcode.manual_budget_ms
+        (0 = không giới hạn, trả về None).
+        """
+        tcp_cfg = (self._settings.get("tcp_server", {}) or {})
+        if not tcp_cfg.get("enabled", False):
+            manual_budget_ms = float((self._settings.get("barcode", {}) or {}).get("manual_budget_ms", 0))
+            if manual_budget_ms <= 0:
+                return None
+            return max(0.0, manual_budget_ms - elapsed_ms)
+        check_timeout_ms = float(tcp_cfg.get("check_timeout_ms", 1500))
+        margin_ms = float(tcp_cfg.get("decode_margin_ms", 300))
+        return max(0.0, check_timeout_ms - margin_ms - elapsed_ms)
+    
     def _get_screenccd_directory(self) -> str:
         """Get screenccd directory for saving captured images"""
         # Use current working directory or create screenccd folder there
@@ -836,6 +970,7 @@ class MainPresenter(QObject):
             
             # Stop timer
             self._stream_timer.stop()
+            self._reset_stream_tracking()
             
             # Stop grabbing
             self._camera_service.stop_streaming()
@@ -863,15 +998,26 @@ class MainPresenter(QObject):
                     self._last_camera_frame = frame
                 display_frame = frame.copy()
                 
-                # Process based on mode - use template for barcode detection
+                # Process based on mode - use recipe / template for barcode detection
+                current_recipe = self._recipe_service.get_current_recipe()
                 current_template = self._template_service.get_current_template()
                 
+                if self._barcode_enabled and current_recipe is not None:
+                    # Recipe: định vị panel theo fiducial, QR ROI warp theo tư thế panel
+                    self._update_stream_consensus(
+                        self._inspect_with_recipe(frame, current_recipe, tracker=self._fiducial_tracker)
+                    )
+                    if self._view.get_show_regions_enabled():
+                        self._draw_recipe_regions(display_frame, current_recipe)
+                
                 # Running mode with template loaded - process with template (same as template mode)
-                if self._barcode_enabled and current_template is not None:
+                elif self._barcode_enabled and current_template is not None:
                     # Process image with template (crop regions + scan barcodes)
                     # Dùng chung đường dẫn với template mode
                     results = self._template_service.process_image_with_template(
-                        frame, current_template
+                        frame, current_template, tracker=self._code_tracker,
+                        reject_poor_quality=self._reject_poor_frames,
+                        temporal_denoise=True
                     )
                     
                     if results['success']:
@@ -885,14 +1031,16 @@ class MainPresenter(QObject):
                         # Get barcode results
                         barcode_results = results.get('barcodes', {})
                         
-                        # Update barcode results display
-                        self._view.update_barcode_results(barcode_results)
-                        
                         # Log results (chỉ log khi có barcode mới để tránh spam)
                         for region_name, barcode_list in barcode_results.items():
                             if barcode_list:
                                 for barcode_data in barcode_list:
                                     logger.debug(f"DataMatrix found in '{region_name}': {barcode_data}")
+                        
+                        self._notify_quality(results)
+                        
+                        # Region bị loại (mờ / cháy sáng) không bỏ phiếu, region khác vẫn được tính
+                        self._update_stream_consensus(barcode_results, results.get('rejected_regions', ()))
                     else:
                         error_msg = results.get('error', 'Unknown error')
                         logger.warning(f"Template processing failed in streaming: {error_msg}")
@@ -906,6 +1054,17 @@ class MainPresenter(QObject):
             logger.error(f"Error in stream timer: {e}", exc_info=True)
             # Không stop streaming ngay, cho phép retry
 
+    def _update_stream_consensus(self, barcode_results: dict, abstain=()):
+        """Consensus qua nhiều frame: hiển thị giá trị ổn định (không nhấp nháy), gửi khi ổn định"""
+        stable = self._result_consensus.update(barcode_results, abstain=abstain)
+        self._view.update_barcode_results(self._result_consensus.current())
+        
+        if stable is not None:
+            verdict = "PASS" if stable.passed else ("FAIL (timeout)" if stable.timed_out else "FAIL")
+            logger.info(f"Stable barcode result ({verdict}): {stable.barcodes}")
+            if self._send_on_stable:
+                self._send_scan_result_to_server(stable.barcodes)
+
     def _on_remote_message(self, msg: str):
         """Handle incoming messages from TCP server (if needed)."""
         logger.debug(f"Received message from server: {msg}")
@@ -1025,7 +1184,83 @@ class MainPresenter(QObject):
             logger.error(f"Capture failed: {e}", exc_info=True)
             self._view.show_message(f"Capture failed: {e}", "error")
     
-    def _detect_qr_with_recipe(self, frame, recipe: Recipe, match_result: MatchResult):
+    def _load_active_recipe(self, recipe_name: str):
+        """Load recipe trong setting làm recipe hiện tại (Running Mode dùng recipe thay cho template)"""
+        if self._qr_service is None:
+            logger.warning(f"Recipe '{recipe_name}' not used: QR service not configured")
+            self._view.show_message("QR service not configured - recipe not used", "warning")
+            return
+        
+        recipe = self._recipe_service.load_recipe(recipe_name)
+        if recipe is None:
+            self._view.show_message(f"Failed to load recipe '{recipe_name}'", "error")
+            return
+        
+        self._recipe_service.set_current_recipe(recipe)
+        self._reset_stream_tracking()
+        self._view.show_message(f"Recipe '{recipe_name}' loaded", "success")
+    
+    def _inspect_with_recipe(self, frame, recipe: Recipe,
+                             tracker: Optional[FiducialTracker] = None) -> Dict[str, List[str]]:
+        """
+        Kiểm tra một frame theo recipe
+        - Định vị panel: match_fiducials (fiducial chính + fiducial phụ) -> tư thế panel;
+          streaming truyền tracker: fiducial chính tìm quanh vị trí dự đoán từ frame trước
+        - Panel ngoài tolerance / không tìm thấy: mọi QR ROI rỗng
+        - Decode QR ROI theo tư thế panel (_detect_qr_with_recipe)
+        
+        Returns:
+            {roi_name: [qr_data, ...]} cho các QR ROI enabled
+        """
+        barcode_results = {qr_roi.name: [] for qr_roi in recipe.qr_roi_regions if qr_roi.enabled}
+        fiducials = recipe.get_fiducials()
+        if not fiducials:
+            logger.warning(f"Recipe '{recipe.name}' has no template image")
+            return barcode_results
+        
+        tolerance = recipe.tolerance
+        matches, pose = self._template_matching_service.match_fiducials(
+            frame, fiducials, self._recipe_search_margin, tolerance.min_match_score, tracker=tracker
+        )
+        match_result = matches[0]
+        self._last_match_result = match_result
+        self._last_pose = pose
+        
+        within, message = self._template_matching_service.check_tolerance(
+            match_result, tolerance.max_dx, tolerance.max_dy, tolerance.max_angle
+        )
+        if not within:
+            logger.debug(f"Panel not located with recipe '{recipe.name}': {message}")
+            return barcode_results
+        
+        for result in self._detect_qr_with_recipe(frame, recipe, match_result, pose):
+            codes = barcode_results.setdefault(result.roi_name, [])
+            if result.success and result.data and result.data not in codes:
+                codes.append(result.data)
+        return barcode_results
+    
+    def _draw_recipe_regions(self, image: np.ndarray, recipe: Recipe):
+        """
+        Vẽ fiducial và QR ROI theo tư thế panel của frame vừa kiểm tra (vùng xoay đúng như patch
+        được warp để decode); chưa định vị được panel thì không vẽ
+        """
+        pose = self._last_pose
+        if pose is None or self._last_match_result is None or not self._last_match_result.success:
+            return
+        template_x, template_y = recipe.template_region.x, recipe.template_region.y
+        outlines = [(region, (0, 255, 0)) for region in [recipe.template_region] + recipe.fiducial_regions]
+        outlines += [(TemplateRegion(template_x + qr_roi.relative_x, template_y + qr_roi.relative_y,
+                                     qr_roi.width, qr_roi.height, qr_roi.name), (255, 0, 0))
+                     for qr_roi in recipe.qr_roi_regions if qr_roi.enabled]
+        for region, color in outlines:
+            corners = pose.map_corners(region.x, region.y, region.width, region.height)
+            polygon = np.round(np.array(corners)).astype(np.int32)
+            cv2.polylines(image, [polygon], True, color, 2)
+            cv2.putText(image, region.name, (int(polygon[0][0]), int(polygon[0][1]) - 5),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    
+    def _detect_qr_with_recipe(self, frame, recipe: Recipe, match_result: MatchResult,
+                               pose: Optional[PanelPose] = None):
         """
         Detect QR codes using recipe with transformed ROIs
         
@@ -1033,6 +1268,8 @@ class MainPresenter(QObject):
             frame: Input frame
             recipe: Current recipe
             match_result: Template matching result
+            pose: Tư thế panel từ match_fiducials (None = chỉ tịnh tiến theo match_result,
+                  có pose: ROI được warp thành patch thẳng trục)
         
         Returns:
             List of QRDetectionResult
@@ -1040,7 +1277,15 @@ class MainPresenter(QObject):
         if self._qr_service is None:
             return []
         
-        # Temporarily update QR service ROI regions based on recipe + offset
+        # Có tư thế panel: warp riêng từng ROI thành patch thẳng trục rồi decode
+        if pose is not None:
+            patches = [
+                (qr_roi.name, qr_roi.extract_patch(frame, recipe.template_region.x,
+                                                   recipe.template_region.y, pose))
+                for qr_roi in recipe.qr_roi_regions if qr_roi.enabled
+            ]
+            return self._qr_service.detect_qr_in_patches(patches)
+        
         # Transform QR ROIs based on template match offset
         transformed_rois = []
         for qr_roi in recipe.qr_roi_regions:
@@ -1054,7 +1299,6 @@ class MainPresenter(QObject):
             )
             
             # Create temporary ROI for QR service
-            from app.model.qr.qr_detection_service import ROIRegion
             temp_roi = ROIRegion(
                 name=qr_roi.name,
                 enabled=True,
@@ -1066,19 +1310,8 @@ class MainPresenter(QObject):
             )
             transformed_rois.append(temp_roi)
         
-        # Backup original ROIs
-        original_rois = self._qr_service.roi_regions
-        
-        # Set transformed ROIs
-        self._qr_service.roi_regions = transformed_rois
-        
-        # Detect QR codes
-        qr_results = self._qr_service.detect_qr_codes(frame)
-        
-        # Restore original ROIs
-        self._qr_service.roi_regions = original_rois
-        
-        return qr_results
+        # Detect QR codes (ROI truyền trực tiếp, không đổi roi_regions của service)
+        return self._qr_service.detect_qr_in_rois(frame, transformed_rois)
     
     def on_barcode_enabled_changed(self, enabled: bool):
         """User toggled barcode detection"""
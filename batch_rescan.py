@@ -0,0 +1,181 @@
+"""
+Batch Re-scan - Chạy lại template trên thư mục ảnh đã lưu (screenccd/), không cần Qt
+Mỗi worker process giữ một TemplateService riêng, kết quả được ghi dần ra JSONL hoặc CSV
+
+Usage:
+    python batch_rescan.py <template> [image_dir] [-o results.jsonl] [--workers N]
+                           [--pattern "*.png"] [--recursive] [--budget-ms 1200]
+
+    template: đường dẫn file .json hoặc tên template trong AppData
+    image_dir: mặc định ./screenccd
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import cv2
+
+from app.model.template_data import Template, TemplateService
+
+logger = logging.getLogger("batch_rescan")
+
+CSV_FIELDS = ['image', 'region', 'status', 'codes', 'method', 'method_name', 'attempts', 'elapsed_ms', 'scale', 'quality']
+
+# State của từng worker process (tạo trong _init_worker)
+_service: Optional[TemplateService] = None
+_template: Optional[Template] = None
+_budget_ms: Optional[float] = None
+
+
+def load_template(template_arg: str) -> Optional[Template]:
+    """Load template từ file .json, hoặc theo tên trong thư mục templates của AppData"""
+    if template_arg.lower().endswith('.json') or os.path.isfile(template_arg):
+        with open(template_arg, 'r', encoding='utf-8') as f:
+            return Template.from_json(f.read())
+    return TemplateService(save_processed_images=False).load_template(template_arg)
+
+
+def find_images(image_dir: str, pattern: str, recursive: bool) -> List[str]:
+    """List ảnh cần scan, sắp xếp theo tên (ảnh screenccd có timestamp trong tên)"""
+    root = Path(image_dir)
+    paths = root.rglob(pattern) if recursive else root.glob(pattern)
+    return sorted(str(p) for p in paths if p.is_file())
+
+
+def _init_worker(template: Template, budget_ms: Optional[float], log_level: int):
+    global _service, _template, _budget_ms
+    logging.basicConfig(level=log_level, format="%(processName)s %(levelname)s %(name)s: %(message)s")
+    _service = TemplateService(save_processed_images=False)
+    _service.set_current_template(template)
+    _template = template
+    _budget_ms = budget_ms
+
+
+def _scan_image(image_path: str) -> Dict[str, Any]:
+    """Scan một ảnh với template của worker, trả về một record kết quả"""
+    record: Dict[str, Any] = {'image': image_path, 'success': False, 'status': 'error', 'regions': {}}
+    t_start = time.perf_counter()
+
+    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        record['error'] = "cannot read image"
+        return record
+    if len(image.shape) == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+    results = _service.process_image_with_template(image, _template, budget_ms=_budget_ms)
+    record['success'] = results['success']
+    record['status'] = results['status']
+    if 'error' in results:
+        record['error'] = results['error']
+
+    for name, result in results['region_results'].items():
+        record['regions'][name] = {
+            'status': result.status,
+            'codes': list(result.codes),
+            'method': result.method,
+            'method_name': _service.get_method_name(result.method) if result.method is not None else None,
+            'attempts': result.attempts,
+            'elapsed_ms': round(result.elapsed_ms, 2),
+            'scale': result.scale,
+            'quality': result.quality.summary() if result.quality is not None else None,
+        }
+
+    record['elapsed_ms'] = round((time.perf_counter() - t_start) * 1000.0, 2)
+    return record
+
+
+class _ResultWriter:
+    """Ghi record ra JSONL (một dòng / ảnh) hoặc CSV (một dòng / region)"""
+
+    def __init__(self, path: str, fmt: str):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, record: Dict[str, Any]):
+        if self._csv is None:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        elif not record['regions']:
+            self._csv.writerow({'image': record['image'], 'status': record['status']})
+        else:
+            for name, region in record['regions'].items():
+                row = dict(region, image=record['image'], region=name)
+                row['codes'] = "|".join(region['codes'])
+                self._csv.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-scan archived CCD images with a template (headless)")
+    parser.add_argument('template', help="Template .json path or template name in AppData")
+    parser.add_argument('image_dir', nargs='?', default=os.path.join(os.getcwd(), "screenccd"))
+    parser.add_argument('-o', '--output', default="rescan_results.jsonl",
+                        help="Output file (.jsonl or .csv)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help="Output format (default: theo đuôi file output)")
+    parser.add_argument('--pattern', default="*.png")
+    parser.add_argument('--recursive', action='store_true')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="Decode budget mỗi ảnh (mặc định: không giới hạn)")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=log_level, format="%(levelname)s %(name)s: %(message)s")
+
+    template = load_template(args.template)
+    if template is None:
+        logger.error(f"Template not found: {args.template}")
+        return 1
+
+    images = find_images(args.image_dir, args.pattern, args.recursive)
+    if not images:
+        logger.error(f"No images matching '{args.pattern}' in {args.image_dir}")
+        return 1
+
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    workers = max(1, args.workers)
+    print(f"Re-scanning {len(images)} image(s) with template '{template.name}' "
+          f"({workers} worker(s)) -> {args.output}")
+
+    writer = _ResultWriter(args.output, fmt)
+    t_start = time.perf_counter()
+    scanned = 0
+    all_found = 0
+    try:
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(template, args.budget_ms, log_level)) as pool:
+            chunksize = max(1, min(16, len(images) // (workers * 4)))
+            for record in pool.imap(_scan_image, images, chunksize=chunksize):
+                writer.write(record)
+                scanned += 1
+                if record['regions'] and all(r['codes'] for r in record['regions'].values()):
+                    all_found += 1
+                if scanned % 100 == 0:
+                    print(f"  {scanned}/{len(images)}")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - t_start
+    print(f"Done: {scanned} image(s) in {elapsed:.1f} s ({scanned / max(elapsed, 1e-6):.1f} img/s), "
+          f"all regions decoded: {all_found}/{scanned}")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Benchmark: preprocessing cascade before (per-call preprocessing, như TemplateService._preprocess_for_barcode
+trước khi có workspace) và sau (PreprocessWorkspace dùng lại)
+Reports allocations (tracemalloc) and time per scan for one region, kiểm tra output giống hệt nhau
+
+Usage:
+    python test/bench_preprocess_workspace.py [image_path] [--size 600] [--scans 20]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.model.template_data.preprocess_workspace import PreprocessWorkspace  # noqa: E402
+
+METHOD_PRIORITY = [9, 10, 11, 0, 2, 7, 1, 6, 8, 3, 4, 5]
+
+
+def load_roi(path, size):
+    if path and os.path.exists(path):
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        return img[:size, :size]
+    # Synthetic ROI: noisy background + checker pattern (giống DataMatrix)
+    rng = np.random.default_rng(0)
+    roi = rng.integers(90, 140, (size, size), dtype=np.uint8)
+    cell = 8
+    pattern = (np.indices((20, 20)).sum(axis=0) % 2).astype(np.uint8) * 200
+    block = np.kron(pattern, np.ones((cell, cell), dtype=np.uint8))
+    roi[50:50 + block.shape[0], 50:50 + block.shape[1]] = block
+    return roi
+
+
+def baseline_preprocess(roi, method):
+    """Bản gốc của TemplateService._preprocess_for_barcode: mỗi lần gọi tạo ảnh, CLAHE, kernel mới"""
+    if len(roi.shape) == 3:
+        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = roi.copy()
+
+    if method == 0:
+        return gray
+    elif method == 1:
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        enhanced = clahe.apply(gray)
+        _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+    elif method == 2:
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        enhanced = clahe.apply(gray)
+        denoised = cv2.fastNlMeansDenoising(enhanced, None, h=10, templateWindowSize=7, searchWindowSize=21)
+        _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+    elif method == 3:
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+    elif method == 4:
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+    elif method == 5:
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        return clahe.apply(gray)
+    elif method == 6:
+        denoised = cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        enhanced = clahe.apply(denoised)
+        _, binary = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+    elif method == 7:
+        inverted = cv2.bitwise_not(gray)
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        enhanced = clahe.apply(inverted)
+        denoised = cv2.fastNlMeansDenoising(enhanced, None, h=10, templateWindowSize=7, searchWindowSize=21)
+        _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+    elif method == 8:
+        return cv2.bitwise_not(gray)
+    elif method in (9, 10):
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        contrast = clahe.apply(gray)
+        denoise = cv2.medianBlur(contrast, 3)
+        binary = cv2.adaptiveThreshold(denoise, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 5)
+        if method == 10:
+            return binary
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        return cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    elif method == 11:
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        return clahe.apply(gray)
+    return gray
+
+
+def scan_baseline(roi):
+    """Trước: ROI copy + mỗi attempt cấp phát ảnh trung gian + CLAHE/kernel mới"""
+    roi = roi.copy()
+    for method in METHOD_PRIORITY:
+        baseline_preprocess(roi, method)
+
+
+def make_scan_reused(roi):
+    ws = PreprocessWorkspace(roi.shape[1], roi.shape[0])
+
+    def scan(r):
+        """Sau: workspace sống theo template, buffer dst= được dùng lại"""
+        ws.load(r)
+        for method in METHOD_PRIORITY:
+            ws.preprocess(method)
+
+    return scan
+
+
+def measure(label, scan, roi, scans):
+    scan(roi)  # warm-up (workspace allocation, OpenCV init)
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    t0 = time.perf_counter()
+    for _ in range(scans):
+        scan(roi)
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0 / scans
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = snapshot_after.compare_to(snapshot_before, 'filename')
+    blocks = sum(max(0, s.count_diff) for s in stats)
+    print(f"{label:<12} time/scan: {elapsed_ms:8.2f} ms   "
+          f"peak traced: {peak / 1024:9.1f} KiB   retained blocks: {blocks}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image', nargs='?', default=None)
+    parser.add_argument('--size', type=int, default=600)
+    parser.add_argument('--scans', type=int, default=20)
+    args = parser.parse_args()
+
+    roi = load_roi(args.image, args.size)
+    print(f"ROI {roi.shape[1]}x{roi.shape[0]}, {len(METHOD_PRIORITY)} methods/scan, {args.scans} scans")
+
+    ws = PreprocessWorkspace(roi.shape[1], roi.shape[0])
+    ws.load(roi)
+    mismatched = [m for m in METHOD_PRIORITY if not np.array_equal(baseline_preprocess(roi, m), ws.preprocess(m))]
+    print("outputs identical" if not mismatched else f"outputs differ for methods {mismatched}")
+
+    measure("before", scan_baseline, roi, args.scans)
+    measure("after", make_scan_reused(roi), roi, args.scans)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: TemplateMatchingService exhaustive search vs coarse-to-fine pyramid search
+(+ angle estimation with the rotated template bank, + frame-to-frame fiducial tracking)
+Reports time per match, position / angle error (sub-pixel) and score for random panel offsets
+
+Usage:
+    python test/bench_template_matching.py [image_path] [--template 200] [--margin 150] [--runs 20] [--full]
+                                           [--max-angle 0]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.model.template.template_matching_service import TemplateMatchingService  # noqa: E402
+from app.model.template.fiducial_tracker import FiducialTracker  # noqa: E402
+
+
+def load_image(path):
+    if path and os.path.exists(path):
+        return cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    # Synthetic panel: nền nhiễu + các linh kiện (hình chữ nhật) + fiducial tròn
+    rng = np.random.default_rng(0)
+    img = rng.integers(60, 90, (1536, 2048), dtype=np.uint8)
+    for _ in range(120):
+        x, y = int(rng.integers(0, 1980)), int(rng.integers(0, 1480))
+        w, h = int(rng.integers(10, 60)), int(rng.integers(10, 60))
+        cv2.rectangle(img, (x, y), (x + w, y + h), int(rng.integers(120, 230)), -1)
+    cv2.circle(img, (700, 500), 40, 240, -1)
+    cv2.circle(img, (700, 500), 18, 30, -1)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+
+def shift_image(img, dx, dy, angle, center):
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    matrix[0, 2] += dx
+    matrix[1, 2] += dy
+    return cv2.warpAffine(img, matrix, (img.shape[1], img.shape[0]), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REFLECT)
+
+
+def measure(label, service, cases, template, tpl_x, tpl_y, margin):
+    service.match_template(cases[0][0], template, tpl_x, tpl_y, margin)  # warm-up
+    times, errors, angle_errors, scores, failures = [], [], [], [], 0
+    for image, dx, dy, angle in cases:
+        t0 = time.perf_counter()
+        result = service.match_template(image, template, tpl_x, tpl_y, margin)
+        times.append((time.perf_counter() - t0) * 1000.0)
+        if not result.success:
+            failures += 1
+            continue
+        errors.append(np.hypot(result.sub_x - tpl_x - dx, result.sub_y - tpl_y - dy))
+        angle_errors.append(abs(result.angle - angle))
+        scores.append(result.score)
+    print(f"{label:<12} time/match: {np.mean(times):8.2f} ms (max {np.max(times):7.2f})   "
+          f"error: mean {np.mean(errors):.3f} px, max {np.max(errors):.3f} px, "
+          f"angle max {np.max(angle_errors):.2f} deg   "
+          f"score: {np.mean(scores):.4f}   failures: {failures}")
+
+
+def measure_tracking(service, image, template, tpl_x, tpl_y, margin, runs, center):
+    # Part nằm trong fixture: lệch cố định + rung nhỏ (±0.5 px) + trôi chậm giữa các frame
+    rng = np.random.default_rng(2)
+    base_dx, base_dy = rng.uniform(-20, 20, 2)
+    frames = []
+    for i in range(runs):
+        dx = base_dx + 0.05 * i + rng.uniform(-0.5, 0.5)
+        dy = base_dy - 0.03 * i + rng.uniform(-0.5, 0.5)
+        frames.append((shift_image(image, dx, dy, 0.0, center), dx, dy))
+    tracker = FiducialTracker()
+    times, errors, tracked = [], [], 0
+    for image_i, dx, dy in frames:
+        t0 = time.perf_counter()
+        result = service.match_template(image_i, template, tpl_x, tpl_y, margin, tracker=tracker)
+        times.append((time.perf_counter() - t0) * 1000.0)
+        tracked += result.method.endswith("tracked")
+        if result.success:
+            errors.append(np.hypot(result.sub_x - tpl_x - dx, result.sub_y - tpl_y - dy))
+    steady = times[1:] or times
+    print(f"{'tracking':<12} time/match: {np.mean(steady):8.2f} ms (first {times[0]:7.2f})   "
+          f"error: mean {np.mean(errors):.3f} px, max {np.max(errors):.3f} px   "
+          f"tracked: {tracked}/{len(frames)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image', nargs='?', default=None)
+    parser.add_argument('--template', type=int, default=200, help="Template side (px)")
+    parser.add_argument('--x', type=int, default=600)
+    parser.add_argument('--y', type=int, default=400)
+    parser.add_argument('--margin', type=int, default=150, help="Search margin (px)")
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--full', action='store_true', help="Search the entire image (invalid window fallback)")
+    parser.add_argument('--max-angle', type=float, default=0.0, help="Random panel rotation (deg)")
+    args = parser.parse_args()
+
+    image = load_image(args.image)
+    template = image[args.y:args.y + args.template, args.x:args.x + args.template].copy()
+    margin = max(image.shape[:2]) if args.full else args.margin
+
+    rng = np.random.default_rng(1)
+    center = (args.x + (args.template - 1) / 2.0, args.y + (args.template - 1) / 2.0)
+    limit = min(args.margin * 0.8, 40.0)
+    cases = []
+    for _ in range(args.runs):
+        dx, dy = rng.uniform(-limit, limit, 2)
+        angle = rng.uniform(-args.max_angle, args.max_angle)
+        cases.append((shift_image(image, dx, dy, angle, center), dx, dy, angle))
+
+    print(f"Image {image.shape[1]}x{image.shape[0]}, template {args.template}px, "
+          f"search {'entire image' if args.full else f'margin {margin}px'}, {args.runs} runs")
+    measure("exhaustive", TemplateMatchingService(use_pyramid=False, angle_range=0),
+            cases, template, args.x, args.y, margin)
+    measure("pyramid", TemplateMatchingService(use_pyramid=True, angle_range=0),
+            cases, template, args.x, args.y, margin)
+    measure("pyr+angle", TemplateMatchingService(use_pyramid=True), cases, template, args.x, args.y, margin)
+    measure_tracking(TemplateMatchingService(use_pyramid=True), image, template, args.x, args.y, margin,
+                     args.runs, center)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Pytest fixtures dùng chung
+- Thêm thư mục gốc repo vào sys.path (như các script bench) để import app.*
+- Ảnh QR tổng hợp (cv2.QRCodeEncoder): decode được khi không có pylibdmtx
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def render_qr(text: str, module_px: int = 5) -> np.ndarray:
+    """Ảnh QR mono (nền trắng, quiet zone của encoder), mỗi module module_px pixel"""
+    code = cv2.QRCodeEncoder.create().encode(text)
+    return cv2.resize(code, None, fx=module_px, fy=module_px, interpolation=cv2.INTER_NEAREST)
+
+
+def paste(image: np.ndarray, patch: np.ndarray, x: int, y: int) -> np.ndarray:
+    """Dán patch mono vào image (mono hoặc BGR) tại (x, y)"""
+    h, w = patch.shape[:2]
+    image[y:y + h, x:x + w] = patch[..., None] if image.ndim == 3 else patch
+    return image
+
+
+@pytest.fixture
+def qr_panel():
+    """Panel BGR 800x600 nền xám có QR 'PANEL-123' tại (100, 100); trả về (ảnh, rect QR)"""
+    image = np.full((600, 800, 3), 200, dtype=np.uint8)
+    code = render_qr("PANEL-123")
+    paste(image, code, 100, 100)
+    return image, (100, 100, code.shape[1], code.shape[0])
+
+
+@pytest.fixture
+def template_service(monkeypatch, tmp_path):
+    """TemplateService ghi template vào tmp_path, không lưu ảnh tiền xử lý (không cần logccd)"""
+    from app.model.template_data.template_service import TemplateService
+    monkeypatch.setattr(TemplateService, '_get_templates_directory', lambda self: str(tmp_path))
+    return TemplateService(save_processed_images=False)
+
+
+def textured_panel(width: int = 640, height: int = 480, seed: int = 0) -> np.ndarray:
+    """Ảnh mono có texture (nhiễu làm mờ) - template matching định vị được cả khi xoay"""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    panel = cv2.GaussianBlur(noise, (0, 0), 3)
+    return cv2.normalize(panel, None, 0, 255, cv2.NORM_MINMAX)
+
+
+def move_panel(image: np.ndarray, dx: float, dy: float, angle: float = 0.0,
+               center=(0.0, 0.0)) -> np.ndarray:
+    """Panel dịch (dx, dy) và xoay angle độ quanh center (như cv2.getRotationMatrix2D)"""
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    matrix[0, 2] += dx
+    matrix[1, 2] += dy
+    return cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]),
+                          flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+
+def render_datamatrix_like(modules: int = 16, module_px: int = 6, seed: int = 0) -> np.ndarray:
+    """Symbol giống DataMatrix (L finder + timing + module ngẫu nhiên), không decode được - cho locator"""
+    rng = np.random.default_rng(seed)
+    grid = rng.integers(0, 2, (modules, modules), dtype=np.uint8)
+    grid[:, 0] = 1
+    grid[-1, :] = 1
+    grid[0, ::2] = 1
+    grid[0, 1::2] = 0
+    grid[1::2, -1] = 0
+    grid[::2, -1] = 1
+    symbol = np.where(grid == 1, 0, 255).astype(np.uint8)
+    return cv2.resize(symbol, None, fx=module_px, fy=module_px, interpolation=cv2.INTER_NEAREST)
@@ -0,0 +1,63 @@
+"""batch_rescan: chạy lại template trên thư mục ảnh, ghi JSONL / CSV"""
+import csv
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+import batch_rescan
+from app.model.template_data import CropRegion, Template, TemplateService
+
+from conftest import paste, render_qr
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """Template .json + 2 ảnh có QR + 1 ảnh trống + 1 file hỏng"""
+    monkeypatch.setattr(TemplateService, '_get_templates_directory', lambda self: str(tmp_path / "templates"))
+    template = Template(name='T', crop_regions=[CropRegion('Q', 80, 80, 180, 180, symbology='qr')])
+    template_path = tmp_path / "T.json"
+    template_path.write_text(template.to_json(), encoding='utf-8')
+
+    image_dir = tmp_path / "screenccd"
+    image_dir.mkdir()
+    for index, text in enumerate(["SN-0001", "PANEL-123"]):
+        image = np.full((400, 400), 200, dtype=np.uint8)
+        paste(image, render_qr(text), 100, 100)
+        cv2.imwrite(str(image_dir / f"img_{index}.png"), image)
+    cv2.imwrite(str(image_dir / "img_2.png"), np.full((400, 400), 200, dtype=np.uint8))
+    (image_dir / "img_3.png").write_bytes(b"not an image")
+    return template_path, image_dir
+
+
+def test_jsonl_record_per_image(archive, tmp_path):
+    template_path, image_dir = archive
+    output = tmp_path / "out.jsonl"
+
+    assert batch_rescan.main([str(template_path), str(image_dir), '-o', str(output), '--workers', '2']) == 0
+
+    records = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    assert [r['image'].rsplit('img_', 1)[1] for r in records] == ['0.png', '1.png', '2.png', '3.png']
+    assert [r['regions'].get('Q', {}).get('codes') for r in records] == [['SN-0001'], ['PANEL-123'], [], None]
+    assert records[0]['regions']['Q']['method_name']
+    assert records[3]['error'] == "cannot read image" and not records[3]['success']
+
+
+def test_csv_row_per_region(archive, tmp_path):
+    template_path, image_dir = archive
+    output = tmp_path / "out.csv"
+
+    assert batch_rescan.main([str(template_path), str(image_dir), '-o', str(output), '--workers', '1',
+                              '--pattern', 'img_[01].png']) == 0
+
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['region'], row['codes']) for row in rows] == [('Q', 'SN-0001'), ('Q', 'PANEL-123')]
+
+
+def test_missing_images_or_template(archive, tmp_path):
+    template_path, image_dir = archive
+
+    assert batch_rescan.main([str(template_path), str(image_dir), '--pattern', '*.bmp']) == 1
+    assert batch_rescan.main(['no_such_template', str(image_dir)]) == 1
@@ -0,0 +1,45 @@
+"""Code geometry học từ ảnh master: số code, cạnh code, hình dạng -> tham số decode"""
+from app.model.template_data.template_model import CropRegion, Template
+from app.model.template_data.template_service import DMTX_SHAPES
+
+
+def test_geometry_learned_from_master(template_service, qr_panel):
+    image, (x, y, w, h) = qr_panel
+    region = CropRegion('Q', x - 20, y - 20, w + 40, h + 40, symbology='qr')
+    template = Template(name='T', crop_regions=[region, CropRegion('Empty', 400, 300, 150, 150, symbology='qr')])
+
+    assert template_service.learn_code_geometry(image, template) == 1
+
+    # Rect của code (không gồm quiet zone 2 module = 10 px), theo tọa độ ảnh
+    assert region.expected_count == 1 and region.symbol_shape == 'square'
+    assert abs(region.code_edge - (w - 20)) <= 3
+    rx, ry, _, _ = region.code_rects[0]
+    assert abs(rx - (x + 10)) <= 2 and abs(ry - (y + 10)) <= 2
+    assert not template.crop_regions[1].has_code_geometry()
+
+
+def test_geometry_survives_json_round_trip():
+    region = CropRegion('Q', 0, 0, 100, 100, expected_count=2, code_edge=40,
+                        symbol_shape='rect', code_rects=[[1, 2, 40, 20], [50, 2, 40, 20]])
+
+    loaded = CropRegion.from_dict(region.to_dict())
+
+    assert loaded == region and loaded.has_code_geometry()
+    loaded.clear_code_geometry()
+    assert not loaded.has_code_geometry() and loaded.code_rects == []
+
+
+def test_decode_kwargs_follow_learned_geometry(template_service):
+    service = template_service
+
+    assert service._dmtx_decode_kwargs(CropRegion('R', 0, 0, 50, 50)) == {'timeout': 100}
+
+    small = CropRegion('R', 0, 0, 200, 200, expected_count=2, code_edge=50, symbol_shape='square')
+    assert service._dmtx_decode_kwargs(small) == {
+        'timeout': 100, 'max_count': 2, 'min_edge': 35, 'max_edge': 66, 'shape': DMTX_SHAPES['square']
+    }
+
+    large = CropRegion('R', 0, 0, 400, 400, expected_count=1, code_edge=200)
+    kwargs = service._dmtx_decode_kwargs(large, timeout=40)
+    assert kwargs['timeout'] == 40 and kwargs['shrink'] == 2
+    assert kwargs['shape'] == DMTX_SHAPES['auto']
@@ -0,0 +1,77 @@
+"""CodeTracker: cửa sổ tìm kiếm quanh vị trí code của frame trước"""
+from app.model.template_data.code_tracker import CodeTracker
+from app.model.template_data.scan_result import (
+    RegionScanResult, SCAN_BUDGET_EXHAUSTED, SCAN_NOT_FOUND, SCAN_OK
+)
+
+BOUNDS = (0, 0, 640, 480)
+
+
+def ok_result(name='R1', rects=((100, 100, 40, 40),), method=3):
+    return RegionScanResult(region_name=name, codes=['SN1'], rects=list(rects),
+                            status=SCAN_OK, method=method)
+
+
+def test_untracked_region_has_no_window():
+    assert CodeTracker().get_window('R1', BOUNDS) is None
+
+
+def test_window_around_code_with_margin():
+    tracker = CodeTracker()
+    tracker.update(ok_result(rects=[(100, 100, 40, 40)]))
+
+    # margin = max(16, 0.5 * 40) = 20
+    assert tracker.get_window('R1', BOUNDS) == (80, 80, 80, 80)
+    assert tracker.get('R1').method == 3
+
+
+def test_window_covers_all_codes_and_uses_minimum_margin():
+    tracker = CodeTracker()
+    tracker.update(ok_result(rects=[(100, 100, 10, 10), (120, 100, 10, 10)]))
+
+    # Rect chung (100, 100, 30, 10), margin tối thiểu 16
+    assert tracker.get_window('R1', BOUNDS) == (84, 84, 62, 42)
+
+
+def test_window_clamped_to_region_bounds():
+    tracker = CodeTracker()
+    tracker.update(ok_result(rects=[(5, 5, 40, 40)]))
+
+    assert tracker.get_window('R1', (0, 0, 50, 50)) == (0, 0, 50, 50)
+    assert tracker.get_window('R1', (200, 200, 50, 50)) is None
+
+
+def test_hits_and_method_follow_latest_success():
+    tracker = CodeTracker()
+    tracker.update(ok_result(method=3))
+    tracker.update(ok_result(rects=[(110, 100, 40, 40)], method=9))
+
+    track = tracker.get('R1')
+    assert track.hits == 2 and track.method == 9
+    assert track.rect == (110, 100, 40, 40)
+
+
+def test_miss_or_budget_stop_drops_track():
+    tracker = CodeTracker()
+    tracker.update(ok_result('R1'))
+    tracker.update(ok_result('R2'))
+
+    tracker.update(RegionScanResult(region_name='R1', status=SCAN_NOT_FOUND))
+    tracker.update(RegionScanResult(region_name='R2', status=SCAN_BUDGET_EXHAUSTED))
+
+    assert tracker.get('R1') is None and tracker.get('R2') is None
+
+
+def test_success_without_rects_is_not_tracked():
+    tracker = CodeTracker()
+    tracker.update(ok_result(rects=[]))
+
+    assert tracker.get('R1') is None
+
+
+def test_reset_forgets_all_tracks():
+    tracker = CodeTracker()
+    tracker.update(ok_result('R1'))
+    tracker.reset()
+
+    assert tracker.get_window('R1', BOUNDS) is None
@@ -0,0 +1,59 @@
+"""DataMatrix locator: tìm vùng code trong region lớn, patch xoay thẳng cho decoder"""
+import cv2
+import numpy as np
+
+from app.model.template_data.datamatrix_locator import PATCH_PADDING, locate_datamatrix_candidates
+
+from conftest import paste, render_datamatrix_like
+
+
+def region_with_code(angle=0.0, size=(600, 800), at=(500, 200)):
+    region = np.full(size, 190, dtype=np.uint8)
+    symbol = render_datamatrix_like()
+    if angle:
+        pad = symbol.shape[0] // 2
+        symbol = cv2.copyMakeBorder(symbol, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255)
+        center = ((symbol.shape[1] - 1) / 2.0, (symbol.shape[0] - 1) / 2.0)
+        matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+        symbol = cv2.warpAffine(symbol, matrix, symbol.shape[::-1], borderValue=255)
+    else:
+        symbol = cv2.copyMakeBorder(symbol, 12, 12, 12, 12, cv2.BORDER_CONSTANT, value=255)
+    paste(region, symbol, *at)
+    center = (at[0] + symbol.shape[1] / 2.0, at[1] + symbol.shape[0] / 2.0)
+    return region, center
+
+
+def test_code_found_in_large_region():
+    region, (cx, cy) = region_with_code()
+
+    candidates = locate_datamatrix_candidates(region)
+
+    assert candidates
+    x, y, w, h = candidates[0].bbox
+    assert x <= cx <= x + w and y <= cy <= y + h
+    assert abs(candidates[0].edge - 96) < 15
+    # Patch: cạnh code + quiet zone mỗi phía
+    assert abs(candidates[0].patch.shape[0] - 96 * (1 + 2 * PATCH_PADDING)) < 20
+
+
+def test_rotated_code_is_deskewed():
+    region, (cx, cy) = region_with_code(angle=20.0)
+
+    best = locate_datamatrix_candidates(region, expected_edge=96, symbol_shape="square")[0]
+
+    x, y, w, h = best.bbox
+    assert x <= cx <= x + w and y <= cy <= y + h
+    # Code xoay +20° (ngược chiều kim đồng hồ): cạnh nằm ở -20° (mod 90°, symbol vuông)
+    assert abs((best.angle + 20.0 + 45.0) % 90.0 - 45.0) < 3.0
+    assert abs(best.patch.shape[0] - best.patch.shape[1]) <= 4
+
+
+def test_expected_edge_filters_other_sizes():
+    region, _ = region_with_code()
+
+    assert locate_datamatrix_candidates(region, expected_edge=30) == []
+    assert len(locate_datamatrix_candidates(region, expected_edge=96, max_candidates=1)) == 1
+
+
+def test_blank_region_has_no_candidates():
+    assert locate_datamatrix_candidates(np.full((400, 400), 128, dtype=np.uint8)) == []
@@ -0,0 +1,101 @@
+"""DecodeDeadline và StageCosts: ngân sách thời gian decode"""
+import numpy as np
+import pytest
+
+from app.model.template_data import decode_budget
+from app.model.template_data.decode_budget import DecodeDeadline, MAX_ATTEMPT_TIMEOUT_MS
+from app.model.template_data.preprocess_workspace import (
+    PreprocessWorkspace, StageCosts, STAGE_COST_SEED_MS_PER_MPX
+)
+
+
+class FakeClock:
+    """Thay time.perf_counter: thời gian chỉ trôi khi gọi advance()"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(decode_budget.time, 'perf_counter', fake)
+    return fake
+
+
+def test_regions_share_remaining_time(clock):
+    deadline = DecodeDeadline(300)
+
+    assert deadline.start_region(3)
+    assert deadline.region_remaining_ms() == pytest.approx(100)
+    clock.advance(40)
+    # Phần dư của region trước chuyển cho các region sau
+    assert deadline.start_region(2)
+    assert deadline.region_remaining_ms() == pytest.approx(130)
+
+
+def test_attempt_timeout_capped_and_reduced_by_expected_cost(clock):
+    deadline = DecodeDeadline(1000)
+    deadline.start_region(1)
+
+    assert deadline.attempt_timeout_ms() == MAX_ATTEMPT_TIMEOUT_MS
+    clock.advance(937.5)
+    assert deadline.attempt_timeout_ms() == 62
+    assert deadline.attempt_timeout_ms(expected_preprocess_ms=30) == 32
+    assert not deadline.exhausted
+
+
+def test_attempt_skipped_when_estimate_does_not_fit(clock):
+    deadline = DecodeDeadline(100)
+    deadline.start_region(1)
+
+    assert deadline.attempt_timeout_ms(expected_preprocess_ms=95) is None
+    assert deadline.exhausted
+
+
+def test_region_refused_when_budget_spent(clock):
+    deadline = DecodeDeadline(50)
+    clock.advance(45)
+
+    assert not deadline.start_region(1)
+    assert deadline.exhausted
+    assert deadline.elapsed_ms() == pytest.approx(45)
+
+
+def test_stage_costs_seeded_then_measured():
+    costs = StageCosts()
+    mpx = 1_000_000
+
+    assert costs.estimate_ms(['nlm'], mpx) == STAGE_COST_SEED_MS_PER_MPX['nlm']
+    costs.record('nlm', 50.0, mpx)
+    assert costs.estimate_ms(['nlm'], mpx) == pytest.approx(50.0)
+    costs.record('nlm', 150.0, mpx)
+    assert costs.estimate_ms(['nlm'], mpx) == pytest.approx(0.7 * 50 + 0.3 * 150)
+    # Chuẩn hóa theo diện tích
+    assert costs.estimate_ms(['nlm'], mpx // 4) == pytest.approx(costs.estimate_ms(['nlm'], mpx) / 4)
+
+
+def test_scan_stages_have_seed_costs():
+    costs = StageCosts()
+
+    for stage in ('presence', 'quality', 'locator'):
+        assert costs.estimate_ms([stage], 1_000_000) > 0
+
+
+def test_workspace_estimate_skips_stages_computed_this_frame():
+    costs = StageCosts()
+    workspace = PreprocessWorkspace(64, 64, costs=costs)
+    workspace.load(np.random.default_rng(0).integers(0, 255, (64, 64), dtype=np.uint8))
+
+    full = workspace.estimate_ms(1)
+    assert full > 0
+    workspace.preprocess(5)  # clahe_strong: tiền tố của method 1
+    assert workspace.estimate_ms(1) == pytest.approx(costs.estimate_ms(['otsu'], 64 * 64))
+    workspace.preprocess(1)
+    assert workspace.estimate_ms(1) == 0
@@ -0,0 +1,64 @@
+"""Decoder backend theo symbology và phân loại symbology cho region 'auto'"""
+import numpy as np
+
+from app.model.template_data.decoder_backends import (
+    OpenCVQRBackend, SYMBOLOGY_DATAMATRIX, SYMBOLOGY_LINEAR, SYMBOLOGY_QR,
+    available_symbologies, create_decoder
+)
+from app.model.template_data.symbology_classifier import classify_symbology
+from app.model.template_data.template_model import CropRegion, Template
+
+from conftest import paste, render_datamatrix_like, render_qr
+
+
+def barcode_stripes(width: int = 240, height: int = 100, seed: int = 0) -> np.ndarray:
+    """Vạch dọc độ rộng ngẫu nhiên (giống 1D barcode) trên nền trắng"""
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width), 255, dtype=np.uint8)
+    x, black = 20, True
+    while x < width - 20:
+        bar = int(rng.integers(2, 8))
+        if black:
+            image[10:height - 10, x:x + bar] = 0
+        x, black = x + bar, not black
+    return image
+
+
+def test_qr_always_has_a_backend():
+    decoder = create_decoder(SYMBOLOGY_QR)
+
+    assert isinstance(decoder, OpenCVQRBackend)
+    assert SYMBOLOGY_QR in available_symbologies()
+    assert create_decoder('unknown') is None
+
+
+def test_opencv_backend_decodes_qr_with_rect():
+    image = paste(np.full((300, 300), 255, dtype=np.uint8), render_qr("SN-0001"), 60, 40)
+
+    symbols = create_decoder(SYMBOLOGY_QR).decode(image, SYMBOLOGY_QR, timeout=50)
+
+    assert [data for data, _ in symbols] == ['SN-0001']
+    x, y, w, h = symbols[0][1]
+    # Rect là vùng code (bỏ quiet zone 2 module = 10 px)
+    assert abs(x - 70) <= 2 and abs(y - 50) <= 2 and abs(w - 105) <= 3 and abs(h - 105) <= 3
+
+
+def test_classifier_separates_qr_barcode_and_datamatrix():
+    qr = paste(np.full((200, 200), 255, dtype=np.uint8), render_qr("PANEL-123"), 20, 20)
+    dm = paste(np.full((140, 140), 255, dtype=np.uint8), render_datamatrix_like(), 22, 22)
+
+    assert classify_symbology(qr) == SYMBOLOGY_QR
+    assert classify_symbology(barcode_stripes()) == SYMBOLOGY_LINEAR
+    assert classify_symbology(dm) == SYMBOLOGY_DATAMATRIX
+
+
+def test_auto_region_classified_once_and_decoded(template_service, qr_panel):
+    image, (x, y, w, h) = qr_panel
+    template = Template(name='T', crop_regions=[
+        CropRegion('A', x - 20, y - 20, w + 40, h + 40, symbology='auto'),
+    ])
+
+    result = template_service.process_image_with_template(image, template)
+
+    assert result['barcodes']['A'] == ['PANEL-123']
+    assert template_service._region_symbology == {'A': SYMBOLOGY_QR}
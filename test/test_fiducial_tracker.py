@@ -0,0 +1,96 @@
+"""FiducialTracker: mô hình vận tốc, cửa sổ thích nghi, tracking trong match_template"""
+import pytest
+
+from app.model.template.fiducial_tracker import (
+    TRACK_MAX_MARGIN, TRACK_MAX_MISSES, TRACK_MIN_MARGIN, FiducialTracker
+)
+from app.model.template.template_matching_service import TemplateMatchingService
+
+from conftest import move_panel, textured_panel
+
+SOURCE = object()
+
+
+def test_first_update_starts_track_without_velocity():
+    tracker = FiducialTracker()
+    assert tracker.predict() is None
+
+    tracker.update(SOURCE, 100.0, 50.0, 0.0)
+
+    assert tracker.predict() == (100.0, 50.0)
+    assert tracker.track.margin == TRACK_MIN_MARGIN
+
+
+def test_velocity_learned_from_constant_motion():
+    tracker = FiducialTracker()
+    for frame in range(20):
+        tracker.update(SOURCE, 100.0 + 3 * frame, 50.0, 0.0)
+
+    predicted_x, predicted_y = tracker.predict()
+    assert predicted_x == pytest.approx(100.0 + 3 * 20, abs=0.5)
+    assert predicted_y == pytest.approx(50.0)
+
+
+def test_margin_grows_with_prediction_error_and_is_capped():
+    tracker = FiducialTracker()
+    tracker.update(SOURCE, 100.0, 50.0, 0.0)
+    tracker.update(SOURCE, 110.0, 50.0, 0.0)
+
+    # error 10, vận tốc 3 -> ceil(2 * 10 + 3) = 23
+    assert tracker.track.margin == 23
+    tracker.update(SOURCE, 200.0, 50.0, 0.0)
+    assert tracker.track.margin == TRACK_MAX_MARGIN
+
+
+def test_misses_widen_window_then_drop_track():
+    tracker = FiducialTracker()
+    tracker.update(SOURCE, 100.0, 50.0, 0.0)
+
+    tracker.miss()
+    assert tracker.track.margin == 2 * TRACK_MIN_MARGIN
+    for _ in range(TRACK_MAX_MISSES):
+        tracker.miss()
+    assert tracker.track is None
+
+
+def test_new_source_restarts_track():
+    tracker = FiducialTracker()
+    tracker.update(SOURCE, 100.0, 50.0, 0.0)
+    tracker.update(SOURCE, 104.0, 50.0, 0.0)
+
+    tracker.update(object(), 10.0, 10.0, 0.0)
+
+    assert tracker.predict() == (10.0, 10.0) and tracker.track.hits == 1
+
+
+def test_streaming_match_uses_tracking_window():
+    master = textured_panel()
+    template = master[150:246, 200:328].copy()
+    service = TemplateMatchingService(angle_range=0)
+    tracker = FiducialTracker()
+
+    methods = []
+    for frame_index in range(5):
+        frame = move_panel(master, 2 * frame_index, -frame_index)
+        result = service.match_template(frame, template, 200, 150, tracker=tracker)
+        assert result.success
+        assert (result.dx, result.dy) == (2 * frame_index, -frame_index)
+        methods.append(result.method)
+
+    assert 'tracked' not in methods[0]
+    assert all('tracked' in method for method in methods[2:])
+
+
+def test_tracking_lost_falls_back_to_full_search():
+    master = textured_panel()
+    template = master[150:246, 200:328].copy()
+    service = TemplateMatchingService(angle_range=0)
+    tracker = FiducialTracker()
+    service.match_template(master, template, 200, 150, tracker=tracker)
+    service.match_template(master, template, 200, 150, tracker=tracker)
+
+    # Panel nhảy xa hơn cửa sổ tracking
+    result = service.match_template(move_panel(master, 40, 30), template, 200, 150, tracker=tracker)
+
+    assert result.success and (result.dx, result.dy) == (40, 30)
+    assert 'tracked' not in result.method
@@ -0,0 +1,143 @@
+"""Tư thế panel từ nhiều fiducial"""
+import math
+
+import pytest
+
+from app.model.template.pose_estimation import PanelPose, estimate_pose
+from app.model.template.template_matching_service import TemplateMatchingService
+
+from conftest import move_panel, textured_panel
+
+# (x, y) top-left của các fiducial 96x96 trên ảnh master, phần tử đầu = fiducial chính
+FIDUCIALS = [(60, 60), (480, 60), (60, 320)]
+FID_SIDE = 96
+
+
+def transform(points, dx, dy, angle, scale=1.0, center=(0.0, 0.0)):
+    pose = PanelPose(center_x=center[0], center_y=center[1], dx=dx, dy=dy, angle=angle, scale=scale)
+    return [pose.map_point(x, y) for x, y in points]
+
+
+def test_no_points_no_pose():
+    assert estimate_pose([], []) is None
+
+
+def test_single_fiducial_translation_and_bank_angle():
+    pose = estimate_pose([(100.0, 80.0)], [(105.0, 77.0)], angles=[1.5])
+
+    assert (pose.dx, pose.dy, pose.angle, pose.scale) == (5.0, -3.0, 1.5, 1.0)
+    assert pose.fiducials == 1
+
+
+def test_similarity_recovered_from_several_points():
+    master = [(100.0, 100.0), (500.0, 120.0), (120.0, 400.0), (480.0, 380.0)]
+    frame = transform(master, 12.0, -7.0, 2.5, scale=1.01, center=master[0])
+
+    pose = estimate_pose(master, frame)
+
+    assert pose.dx == pytest.approx(12.0, abs=1e-6)
+    assert pose.dy == pytest.approx(-7.0, abs=1e-6)
+    assert pose.angle == pytest.approx(2.5, abs=1e-6)
+    assert pose.scale == pytest.approx(1.01, abs=1e-6)
+    assert pose.residual == pytest.approx(0.0, abs=1e-6)
+    for (x, y), (fx, fy) in zip(master, frame):
+        assert pose.map_point(x, y) == (pytest.approx(fx), pytest.approx(fy))
+
+
+def test_residual_reports_inconsistent_fiducial():
+    master = [(100.0, 100.0), (500.0, 100.0), (100.0, 400.0)]
+    frame = [(100.0, 100.0), (500.0, 100.0), (100.0, 410.0)]
+
+    assert estimate_pose(master, frame).residual > 1.0
+
+
+def test_match_fiducials_estimates_rotated_panel_pose():
+    master = textured_panel()
+    center = (FIDUCIALS[0][0] + (FID_SIDE - 1) / 2.0, FIDUCIALS[0][1] + (FID_SIDE - 1) / 2.0)
+    frame = move_panel(master, 8, -5, 1.5, center)
+    fiducials = [(master[y:y + FID_SIDE, x:x + FID_SIDE].copy(), x, y) for x, y in FIDUCIALS]
+
+    results, pose = TemplateMatchingService().match_fiducials(frame, fiducials)
+
+    assert all(result.success for result in results)
+    assert pose.fiducials == 3
+    assert pose.angle == pytest.approx(1.5, abs=0.1)
+    assert (pose.dx, pose.dy) == (pytest.approx(8, abs=0.5), pytest.approx(-5, abs=0.5))
+    assert pose.residual < 1.0
+
+
+def test_match_fiducials_skips_failed_fiducial():
+    master = textured_panel()
+    frame = move_panel(master, 4, 3)
+    fiducials = [(master[y:y + FID_SIDE, x:x + FID_SIDE].copy(), x, y) for x, y in FIDUCIALS]
+    fiducials[2] = (textured_panel(FID_SIDE, FID_SIDE, seed=5), *FIDUCIALS[2])
+
+    results, pose = TemplateMatchingService(angle_range=0).match_fiducials(frame, fiducials)
+
+    assert [r.success for r in results] == [True, True, False]
+    assert pose.fiducials == 2
+    assert (pose.dx, pose.dy) == (pytest.approx(4, abs=0.3), pytest.approx(3, abs=0.3))
+    assert math.isclose(pose.angle, 0.0, abs_tol=0.1)
+
+
+def test_map_corners_and_bounding_rect():
+    pose = PanelPose(center_x=0.0, center_y=0.0, dx=10.0, dy=20.0, angle=90.0)
+
+    corners = pose.map_corners(0, 0, 40, 20)
+
+    # 90° ngược chiều kim đồng hồ (trục y hướng xuống): (x, y) -> (y, -x)
+    expected = [(10, 20), (10, -20), (30, -20), (30, 20)]
+    assert [(pytest.approx(x), pytest.approx(y)) for x, y in expected] == corners
+    # Hình bao làm tròn ra ngoài (floor / ceil): chứa mọi góc, lệch tối đa 1 px
+    x, y, w, h = pose.map_rect(0, 0, 40, 20)
+    assert (x, y) == (10, -20)
+    assert 20 <= w <= 21 and 40 <= h <= 41
+
+
+def test_extract_rect_is_view_without_rotation():
+    frame = textured_panel()
+    pose = PanelPose(center_x=0.0, center_y=0.0, dx=5.0, dy=-3.0)
+
+    patch = pose.extract_rect(frame, 100, 100, 64, 48)
+
+    assert patch.shape == (48, 64)
+    assert patch.base is frame or patch.base is frame.base
+    assert (patch == frame[97:145, 105:169]).all()
+
+
+def test_extract_rect_unrotates_roi():
+    master = textured_panel()
+    center = (200.0, 150.0)
+    frame = move_panel(master, 8, -5, 3.0, center)
+    pose = PanelPose(center_x=center[0], center_y=center[1], dx=8, dy=-5, angle=3.0)
+
+    patch = pose.extract_rect(frame, 260, 200, 80, 60)
+
+    assert patch.shape == (60, 80)
+    error = abs(patch.astype(int) - master[200:260, 260:340].astype(int))
+    assert error[2:-2, 2:-2].mean() < 3.0
+
+
+def test_extract_rect_outside_frame():
+    frame = textured_panel(100, 100)
+    pose = PanelPose(center_x=0.0, center_y=0.0, dx=500.0, dy=500.0, angle=2.0)
+
+    assert pose.extract_rect(frame, 0, 0, 20, 20) is None
+    assert pose.extract_rect(frame, 0, 0, 0, 20) is None
+
+
+def test_qr_roi_patch_follows_panel_pose():
+    from app.model.recipe.recipe_service import QRROIRegion
+
+    master = textured_panel()
+    frame = move_panel(master, 6, 4, -2.0, (100.0, 100.0))
+    pose = PanelPose(center_x=100.0, center_y=100.0, dx=6, dy=4, angle=-2.0)
+    roi = QRROIRegion(name='QR1', enabled=True, relative_x=150, relative_y=80, width=90, height=70)
+
+    patch = roi.extract_patch(frame, 100, 100, pose)
+
+    assert patch.shape == (70, 90)
+    error = abs(patch.astype(int) - master[180:250, 250:340].astype(int))
+    assert error[2:-2, 2:-2].mean() < 3.0
+    x, y, w, h = roi.get_pose_coords(100, 100, pose)
+    assert w > 90 and h > 70
@@ -0,0 +1,69 @@
+"""PreprocessWorkspace: kết quả giống tiền xử lý gốc, buffer dùng lại giữa các frame"""
+import cv2
+import numpy as np
+import pytest
+
+from app.model.template_data.preprocess_workspace import METHOD_STAGES, PreprocessWorkspace, method_stage_keys
+
+from bench_preprocess_workspace import baseline_preprocess, load_roi
+
+
+@pytest.fixture
+def roi():
+    return load_roi(None, 256)
+
+
+@pytest.mark.parametrize('method', sorted(METHOD_STAGES))
+def test_methods_match_original_preprocessing(roi, method):
+    workspace = PreprocessWorkspace(roi.shape[1], roi.shape[0])
+    workspace.load(roi)
+
+    assert (workspace.preprocess(method) == baseline_preprocess(roi, method)).all()
+
+
+def test_methods_in_any_order_match_original(roi):
+    bgr = cv2.cvtColor(roi, cv2.COLOR_GRAY2BGR)
+    workspace = PreprocessWorkspace(roi.shape[1], roi.shape[0])
+    workspace.load(bgr)
+
+    for method in (9, 10, 11, 0, 2, 7, 1, 6, 8, 3, 4, 5):
+        assert (workspace.preprocess(method) == baseline_preprocess(bgr, method)).all(), method
+
+
+def test_buffers_reused_across_frames(roi):
+    workspace = PreprocessWorkspace(roi.shape[1], roi.shape[0])
+    workspace.load(roi)
+    first = workspace.preprocess(9)
+
+    workspace.load(255 - roi)
+    second = workspace.preprocess(9)
+
+    assert second is first
+    assert (second == baseline_preprocess(255 - roi, 9)).all()
+
+
+def test_load_is_a_copy_of_a_strided_view(roi):
+    image = np.zeros((400, 400), dtype=np.uint8)
+    image[50:306, 100:356] = roi
+    workspace = PreprocessWorkspace(256, 256)
+
+    gray = workspace.load(image[50:306, 100:356])
+    image[:] = 0
+
+    assert (gray == roi).all()
+
+
+def test_resized_roi_reallocates(roi):
+    workspace = PreprocessWorkspace(100, 100)
+
+    workspace.load(roi)
+
+    assert workspace.shape == roi.shape
+    assert (workspace.preprocess(4) == baseline_preprocess(roi, 4)).all()
+
+
+def test_shared_prefixes_listed_once():
+    keys = method_stage_keys([9, 10, 11])
+
+    assert keys == (('clahe_soft',), ('clahe_soft', 'median3'), ('clahe_soft', 'median3', 'adaptive31'),
+                    ('clahe_soft', 'median3', 'adaptive31', 'close3'))
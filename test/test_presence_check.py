@@ -0,0 +1,43 @@
+"""Presence check: region trống được bỏ qua trước khi decode"""
+import numpy as np
+
+from app.model.template_data.presence_check import code_absent, measure_presence
+from app.model.template_data.scan_result import SCAN_EMPTY, SCAN_OK
+from app.model.template_data.template_model import CropRegion, Template
+
+from conftest import render_qr
+
+
+def test_measure_presence_flat_vs_code():
+    flat = np.full((120, 120), 200, dtype=np.uint8)
+    code = render_qr("PANEL-123")
+
+    assert measure_presence(flat) == (0.0, 0.0)
+    density, contrast = measure_presence(code)
+    assert density > 0.1 and contrast > 50
+    assert measure_presence(np.zeros((4, 4), dtype=np.uint8)) == (0.0, 0.0)
+
+
+def test_code_absent_needs_learned_reference():
+    flat = np.full((120, 120), 200, dtype=np.uint8)
+    region = CropRegion('Q', 0, 0, 120, 120)
+
+    assert not code_absent(flat, region)
+    region.presence_edge_density, region.presence_contrast = measure_presence(render_qr("PANEL-123"))
+    assert code_absent(flat, region)
+    assert not code_absent(render_qr("SN-0001"), region)
+
+
+def test_empty_slot_skips_decode(template_service, qr_panel):
+    image, (x, y, w, h) = qr_panel
+    template = Template(name='T', crop_regions=[
+        CropRegion('Q', x - 20, y - 20, w + 40, h + 40, symbology='qr')
+    ])
+    assert template_service.learn_code_geometry(image, template) == 1
+
+    empty = np.full_like(image, 200)
+    results = template_service.scan_regions(empty, template)
+    assert results['Q'].status == SCAN_EMPTY and results['Q'].attempts == 0
+
+    results = template_service.scan_regions(image, template)
+    assert results['Q'].status == SCAN_OK and results['Q'].codes == ['PANEL-123']
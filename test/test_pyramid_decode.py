@@ -0,0 +1,67 @@
+"""Pyramid decode: region lớn decode ở ảnh thu nhỏ trước, lên độ phân giải gốc khi thiếu code"""
+import numpy as np
+import pytest
+
+from app.model.template_data.scan_result import SCAN_OK
+from app.model.template_data.template_model import CropRegion, Template
+
+from conftest import paste, render_qr
+
+
+def panel_with_qr(module_px, at=(150, 150)):
+    image = np.full((720, 960), 200, dtype=np.uint8)
+    code = render_qr("PANEL-123", module_px=module_px)
+    paste(image, code, *at)
+    return image, code.shape[0]
+
+
+def region_template():
+    return Template(name='T', crop_regions=[CropRegion('Q', 100, 100, 420, 420, symbology='qr')])
+
+
+def test_large_code_decoded_at_half_scale(template_service):
+    image, _ = panel_with_qr(module_px=9)
+
+    result = template_service.scan_regions(image, region_template())['Q']
+
+    assert result.status == SCAN_OK and result.codes == ['PANEL-123']
+    assert result.scale == 0.5
+    # Rect quy về tọa độ ảnh gốc (code bắt đầu sau quiet zone 2 module)
+    x, y, w, h = result.rects[0]
+    assert abs(x - (150 + 2 * 9)) <= 4 and abs(w - 21 * 9) <= 8
+    stats = template_service.get_pyramid_stats()['Q']
+    assert stats.scaled_hits == 1 and stats.escalations == 0 and stats.saved_ms > 0
+
+
+def test_learned_code_edge_picks_smallest_readable_scale(template_service):
+    image, _ = panel_with_qr(module_px=9)
+    template = region_template()
+    assert template_service.learn_code_geometry(image, template) == 1
+
+    result = template_service.scan_regions(image, template)['Q']
+
+    # Cạnh ~190 px / 20 module: module 2.4 px ở tỉ lệ 0.25
+    assert template_service.get_pyramid_stats()['Q'].scale == 0.25
+    assert result.codes == ['PANEL-123']
+
+
+def test_small_modules_escalate_to_full_resolution(template_service):
+    image, _ = panel_with_qr(module_px=3)
+
+    result = template_service.scan_regions(image, region_template())['Q']
+
+    assert result.codes == ['PANEL-123'] and result.scale == 1.0
+    stats = template_service.get_pyramid_stats()['Q']
+    assert stats.scale == 0.5 and stats.escalations == 1 and stats.full_res_ms > 0
+
+
+@pytest.mark.parametrize('width, pyramid', [(420, False), (200, True)])
+def test_small_region_or_disabled_pyramid_scans_full_resolution(template_service, width, pyramid):
+    template_service.pyramid_decode = pyramid
+    image, _ = panel_with_qr(module_px=5, at=(120, 120))
+    template = Template(name='T', crop_regions=[CropRegion('Q', 100, 100, width, width, symbology='qr')])
+
+    result = template_service.scan_regions(image, template)['Q']
+
+    assert result.codes == ['PANEL-123'] and result.scale == 1.0
+    assert template_service.get_pyramid_stats()['Q'].scale == 1.0
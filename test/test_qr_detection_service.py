@@ -0,0 +1,145 @@
+"""QRDetectionService: ROI truyền vào (không ghi state), patch đã cắt sẵn"""
+import copy
+import os
+
+import numpy as np
+import pytest
+import yaml
+
+from app.model.qr.qr_detection_service import QRDetectionService, ROIRegion
+
+from conftest import paste, render_qr
+
+SETTING_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'setting', 'qr.yaml')
+
+# (text, x, y) của các QR trên panel
+CODES = [("SN-0001", 40, 40), ("PANEL-123", 400, 60), ("HELLO-QR-123", 220, 300)]
+
+
+@pytest.fixture
+def qr_config():
+    with open(SETTING_PATH, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)['qr']
+    config['logging']['log_results'] = False
+    return config
+
+
+@pytest.fixture
+def panel():
+    image = np.full((480, 640, 3), 210, dtype=np.uint8)
+    for text, x, y in CODES:
+        paste(image, render_qr(text), x, y)
+    return image
+
+
+def code_rois(margin=15):
+    return [ROIRegion(name=text, enabled=True, x=x - margin, y=y - margin, width=125 + 2 * margin,
+                      height=125 + 2 * margin, use_percentage=False)
+            for text, x, y in CODES]
+
+
+def test_detect_in_given_rois_without_touching_service_rois(qr_config, panel):
+    service = QRDetectionService(qr_config)
+    configured = copy.deepcopy(service.roi_regions)
+
+    results = service.detect_qr_in_rois(panel, code_rois())
+
+    assert [(r.roi_name, r.data) for r in results] == [(text, text) for text, _, _ in CODES]
+    assert service.roi_regions == configured
+
+
+def test_bbox_relative_to_roi(qr_config, panel):
+    service = QRDetectionService(qr_config)
+    roi = code_rois()[1]
+
+    result = service.detect_qr_in_rois(panel, [roi])[0]
+
+    x, y, w, h = result.get_absolute_bbox(roi.x, roi.y)
+    assert abs(x - 410) <= 3 and abs(y - 70) <= 3 and abs(w - 105) <= 4 and abs(h - 105) <= 4
+
+
+def test_disabled_roi_and_empty_roi(qr_config, panel):
+    service = QRDetectionService(qr_config)
+    rois = code_rois()
+    rois[0].enabled = False
+    empty = ROIRegion(name='Empty', enabled=True, x=0.8, y=0.8, width=0.15, height=0.15, use_percentage=True)
+
+    results = service.detect_qr_in_rois(panel, rois + [empty])
+
+    assert [r.roi_name for r in results] == ["PANEL-123", "HELLO-QR-123"]
+
+
+def test_detect_in_patches(qr_config, panel):
+    service = QRDetectionService(qr_config)
+    patches = [("A", panel[25:180, 25:180]), ("None", None), ("Blank", panel[400:470, 500:630])]
+
+    results = service.detect_qr_in_patches(patches)
+
+    assert [(r.roi_name, r.data) for r in results] == [("A", "SN-0001")]
+
+
+def test_disabled_service_returns_nothing(qr_config, panel):
+    qr_config['enabled'] = False
+
+    assert QRDetectionService(qr_config).detect_qr_in_rois(panel, code_rois()) == []
+
+
+def with_failing_first_method(config):
+    """Method 0 cho ảnh đen hoàn toàn (adaptive threshold C = -255): QR chỉ decode được từ method 1"""
+    config['detection']['max_attempts'] = 3
+    config['detection']['preprocessing'] = [
+        {'method': 'adaptive_threshold', 'block_size': 11, 'c': -255},
+        {'method': 'none'},
+        {'method': 'histogram_equalization'},
+    ]
+    return config
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_batch_results_in_roi_order(qr_config, panel, workers):
+    qr_config['detection']['workers'] = workers
+    service = QRDetectionService(qr_config)
+
+    results = service.detect_qr_in_rois(panel, list(reversed(code_rois())))
+
+    assert [r.data for r in results] == [text for text, _, _ in reversed(CODES)]
+
+
+def test_parallel_attempts_keep_method_priority(qr_config, panel):
+    with_failing_first_method(qr_config)
+    sequential = QRDetectionService(qr_config)
+    qr_config['detection']['parallel_attempts'] = True
+    parallel = QRDetectionService(qr_config)
+
+    expected = [(r.roi_name, r.attempt) for r in sequential.detect_qr_in_rois(panel, code_rois())]
+    for _ in range(3):
+        assert [(r.roi_name, r.attempt) for r in parallel.detect_qr_in_rois(panel, code_rois())] == expected
+    assert {attempt for _, attempt in expected} == {1}
+
+
+def test_roi_stats_per_name(qr_config, panel):
+    service = QRDetectionService(qr_config)
+    rois = code_rois()
+    blank = ROIRegion(name='Blank', enabled=True, x=500, y=400, width=120, height=70, use_percentage=False)
+
+    service.detect_qr_in_rois(panel, rois + [blank])
+    service.detect_qr_in_rois(panel, rois + [blank])
+
+    stats = service.get_roi_stats()
+    assert stats["SN-0001"].calls == 2 and stats["SN-0001"].success_rate == 1.0
+    assert stats['Blank'].calls == 2 and stats['Blank'].hits == 0
+    service.reset_roi_stats()
+    assert service.get_roi_stats() == {}
+
+
+def test_roi_geometry_cached_by_content(qr_config):
+    service = QRDetectionService(qr_config)
+    rois = code_rois()
+
+    first = service._resolve_rois(rois, 640, 480)
+    assert service._resolve_rois(code_rois(), 640, 480) is first
+    # ROI sửa tại chỗ / kích thước ảnh khác: tính lại
+    rois[0].x += 10
+    moved = service._resolve_rois(rois, 640, 480)
+    assert moved is not first and moved[0][1] == first[0][1] + 10
+    assert service._resolve_rois(code_rois(), 320, 240) is not first
@@ -0,0 +1,47 @@
+"""QREngine: detector theo thread, thứ tự detector; ROIStats"""
+import threading
+
+import numpy as np
+import pytest
+
+from app.model.qr.qr_engine import DEFAULT_DETECTORS, DETECTOR_CLASSIC, QREngine, ROIStats
+
+from conftest import paste, render_qr
+
+
+def test_decodes_qr_and_reports_empty_miss():
+    engine = QREngine()
+    image = paste(np.full((300, 300), 255, dtype=np.uint8), render_qr("HELLO-QR-123"), 50, 50)
+
+    decoded, points = engine.decode(image)
+    assert decoded == ['HELLO-QR-123'] and points is not None
+    assert engine.decode(np.full((100, 100), 255, dtype=np.uint8)) == ([], None)
+
+
+def test_unknown_detectors_fall_back_to_classic():
+    assert QREngine(['bogus']).detectors == DEFAULT_DETECTORS
+    assert QREngine(['bogus', DETECTOR_CLASSIC]).detectors == (DETECTOR_CLASSIC,)
+
+
+def test_detector_reused_within_thread_not_across_threads():
+    engine = QREngine()
+    main = engine._get_detector(DETECTOR_CLASSIC)
+    other = []
+    worker = threading.Thread(target=lambda: other.append(engine._get_detector(DETECTOR_CLASSIC)))
+    worker.start()
+    worker.join()
+
+    assert engine._get_detector(DETECTOR_CLASSIC) is main
+    assert other[0] is not main
+
+
+def test_roi_stats_accumulate():
+    stats = ROIStats()
+    assert stats.success_rate == 0.0 and stats.mean_ms == 0.0
+
+    stats.record(10.0, True)
+    stats.record(30.0, False)
+
+    assert stats.calls == 2 and stats.hits == 1 and stats.last_ms == 30.0
+    assert stats.success_rate == pytest.approx(0.5)
+    assert stats.mean_ms == pytest.approx(20.0)
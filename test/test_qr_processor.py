@@ -0,0 +1,81 @@
+"""QRProcessor: stage chain đã compile, ảnh màu giữ màu, dùng lại stage trong cache"""
+import cv2
+import numpy as np
+import pytest
+
+from app.model.qr.qr_processor import QRProcessor
+
+from conftest import render_qr
+
+METHODS = [
+    {'method': 'none'},
+    {'method': 'adaptive_threshold', 'block_size': 10, 'c': 2},
+    {'method': 'histogram_equalization'},
+    {'method': 'sharpen'},
+    {'method': 'denoise', 'h': 10},
+    {'method': 'unknown'},
+]
+
+
+@pytest.fixture
+def processor():
+    return QRProcessor({'detection': {'preprocessing': METHODS}})
+
+
+@pytest.fixture
+def colour_roi():
+    code = cv2.cvtColor(render_qr("SN-0001", module_px=3), cv2.COLOR_GRAY2BGR)
+    code[..., 2] = np.clip(code[..., 2].astype(int) + 30, 0, 255)
+    return code
+
+
+def test_names_and_count(processor):
+    assert processor.get_preprocessing_count() == len(METHODS)
+    assert processor.get_preprocessing_name(2) == 'histogram_equalization'
+    assert processor.get_preprocessing_name(99) == 'unknown'
+
+
+def test_none_and_unknown_return_input(processor, colour_roi):
+    assert processor.preprocess_image(colour_roi, 0) is colour_roi
+    assert processor.preprocess_image(colour_roi, 5) is colour_roi
+    assert processor.preprocess_image(colour_roi, 99) is colour_roi
+
+
+def test_adaptive_threshold_is_gray_with_odd_block(processor, colour_roi):
+    result = processor.preprocess_image(colour_roi, 1)
+
+    gray = cv2.cvtColor(colour_roi, cv2.COLOR_BGR2GRAY)
+    expected = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+    assert result.ndim == 2 and (result == expected).all()
+
+
+@pytest.mark.parametrize('index', [2, 3, 4])
+def test_colour_methods_keep_colour(processor, colour_roi, index):
+    result = processor.preprocess_image(colour_roi, index)
+
+    assert result.shape == colour_roi.shape
+
+
+def test_colour_equalize_on_luma(processor, colour_roi):
+    result = processor.preprocess_image(colour_roi, 2)
+
+    yuv = cv2.cvtColor(colour_roi, cv2.COLOR_BGR2YUV)
+    yuv[:, :, 0] = cv2.equalizeHist(yuv[:, :, 0])
+    assert (result == cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)).all()
+
+
+@pytest.mark.parametrize('index', [1, 2, 3, 4])
+def test_gray_input_stays_gray(processor, colour_roi, index):
+    gray = cv2.cvtColor(colour_roi, cv2.COLOR_BGR2GRAY)
+
+    assert processor.preprocess_image(gray, index).shape == gray.shape
+
+
+def test_stage_cache_reused_within_roi(processor, colour_roi):
+    cache = {}
+
+    first = processor.preprocess_image(colour_roi, 4, cache)
+    again = processor.preprocess_image(colour_roi, 4, cache)
+
+    assert again is first
+    assert len(cache) == 1
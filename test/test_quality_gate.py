@@ -0,0 +1,72 @@
+"""Quality gate: đánh giá focus / clipping / contrast, region phẳng và frame bị loại"""
+import cv2
+import numpy as np
+
+from app.model.template_data.quality_gate import (
+    ISSUE_BLUR, ISSUE_CLIPPED, ISSUE_LOW_CONTRAST, assess_quality, methods_for_quality
+)
+from app.model.template_data.scan_result import SCAN_EMPTY, SCAN_OK, SCAN_REJECTED
+from app.model.template_data.template_model import CropRegion, Template
+
+from conftest import paste, render_qr
+
+
+def test_sharp_code_passes():
+    # Mức xám 64-191: không bị clip
+    report = assess_quality(render_qr("PANEL-123") // 2 + 64)
+
+    assert report.ok and not report.reject and not report.flat
+
+
+def test_flat_region_is_flat_not_rejected():
+    report = assess_quality(np.full((100, 100), 128, dtype=np.uint8))
+
+    assert report.flat and not report.reject
+    assert report.issues == (ISSUE_LOW_CONTRAST,)
+
+
+def test_heavy_blur_rejected():
+    blurred = cv2.GaussianBlur(render_qr("PANEL-123") // 2 + 64, (0, 0), 12)
+    report = assess_quality(blurred)
+
+    assert ISSUE_BLUR in report.issues and report.reject and not report.flat
+
+
+def test_blown_out_frame_rejected():
+    image = np.full((100, 100), 255, dtype=np.uint8)
+    image[::10, :] = 0
+    report = assess_quality(image)
+
+    assert report.issues[0] == ISSUE_CLIPPED and report.reject
+
+
+def test_reduced_methods_follow_first_issue_and_keep_testbase_full():
+    methods = tuple(range(12))
+    blurred = assess_quality(cv2.GaussianBlur(render_qr("PANEL-123") // 2 + 64, (0, 0), 3))
+
+    assert methods_for_quality(assess_quality(render_qr("PANEL-123") // 2 + 64), methods) == methods
+    assert blurred.issues == (ISSUE_BLUR,)
+    assert methods_for_quality(blurred, methods) == (9, 10, 3, 0)
+    flat = assess_quality(np.full((100, 100), 128, dtype=np.uint8))
+    assert methods_for_quality(flat, methods) == (11, 9, 5, 1, 2)
+    # Method không có trong region bị bỏ, không còn method nào thì giữ nguyên
+    assert methods_for_quality(blurred, (1, 2)) == (1, 2)
+
+
+def test_streaming_flat_region_is_empty_and_poor_frame_rejected(template_service, qr_panel):
+    image, (x, y, w, h) = qr_panel
+    paste(image, render_qr("SN-0001"), 500, 100)
+    template = Template(name='T', crop_regions=[
+        CropRegion('Q', x - 20, y - 20, w + 40, h + 40, symbology='qr'),
+        CropRegion('Blur', 480, 80, w + 40, h + 40, symbology='qr'),
+        CropRegion('Empty', 300, 400, 150, 150, symbology='qr'),
+    ])
+    image[80:80 + h + 40, 480:480 + w + 40] = cv2.GaussianBlur(
+        image[80:80 + h + 40, 480:480 + w + 40] // 2 + 64, (0, 0), 12)
+
+    result = template_service.process_image_with_template(image, template, reject_poor_quality=True)
+
+    statuses = {name: r.status for name, r in result['region_results'].items()}
+    assert statuses == {'Q': SCAN_OK, 'Blur': SCAN_REJECTED, 'Empty': SCAN_EMPTY}
+    assert result['barcodes']['Q'] == ['PANEL-123']
+    assert result['rejected_regions'] == ['Blur'] and result['rejected']
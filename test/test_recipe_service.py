@@ -0,0 +1,108 @@
+"""RecipeService: LRU cache theo mtime, bản sao độc lập, ảnh master memory-map, xóa recipe"""
+import os
+
+import numpy as np
+import pytest
+
+from app.model.recipe import recipe_service as recipe_module
+from app.model.recipe.recipe_service import QRROIRegion, RecipeService, TemplateRegion
+
+from conftest import textured_panel
+
+
+@pytest.fixture
+def service(tmp_path):
+    return RecipeService(str(tmp_path / "recipes"))
+
+
+def create(service, name, fiducials=()):
+    master = np.dstack([textured_panel(320, 240)] * 3)
+    return service.create_recipe(
+        name, "test", master, TemplateRegion(40, 30, 64, 48),
+        [QRROIRegion(name="QR1", enabled=True, relative_x=100, relative_y=20, width=80, height=80)],
+        fiducial_regions=[TemplateRegion(x, y, 48, 48, name=f"F{i}") for i, (x, y) in enumerate(fiducials)]
+    )
+
+
+def bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 5))
+
+
+def test_load_returns_isolated_copies_sharing_images(service):
+    create(service, "A", fiducials=[(220, 160)])
+
+    first = service.load_recipe("A")
+    second = service.load_recipe("A")
+    first.qr_roi_regions[0].relative_x = 0
+    first.tolerance.max_dx = 1.0
+
+    assert second.qr_roi_regions[0].relative_x == 100 and second.tolerance.max_dx == 10.0
+    assert first.get_template_roi() is second.get_template_roi()
+    assert first.get_fiducials()[1][0] is second.get_fiducials()[1][0]
+    assert not first.get_template_roi().flags.writeable
+
+
+def test_master_image_memory_mapped_from_sidecar(service):
+    recipe = create(service, "A")
+    service.clear_cache()
+
+    loaded = service.load_recipe("A")
+
+    assert os.path.exists(recipe_module._sidecar_path(recipe.template_image_path))
+    assert isinstance(loaded.get_template_image(), np.memmap)
+    assert loaded.get_template_roi().shape == (48, 64, 3)
+
+
+def test_cache_invalidated_when_config_changes_on_disk(service):
+    create(service, "A")
+    cached = service.load_recipe("A")
+    assert service.load_recipe("A").get_template_roi() is cached.get_template_roi()
+
+    config_path = service._config_path("A")
+    bump_mtime(config_path)
+
+    reloaded = service.load_recipe("A")
+    assert reloaded.get_template_roi() is not cached.get_template_roi()
+
+
+def test_lru_keeps_recent_recipes(service, monkeypatch):
+    monkeypatch.setattr(recipe_module, "RECIPE_CACHE_SIZE", 2)
+    for name in ("A", "B", "C"):
+        create(service, name)
+
+    assert list(service._cache) == [service._config_path("B"), service._config_path("C")]
+    service.load_recipe("B")
+    create(service, "D")
+    assert service._config_path("C") not in service._cache
+    assert service._config_path("B") in service._cache
+
+
+def test_delete_releases_cached_and_current_recipe(service):
+    create(service, "A")
+    current = service.load_recipe("A")
+    service.set_current_recipe(current)
+    image_path = current.template_image_path
+    sidecar = recipe_module._sidecar_path(image_path)
+    current.get_template_image()
+
+    assert service.delete_recipe("A")
+
+    assert service.get_current_recipe() is None
+    assert current._template_image is None
+    assert not os.path.exists(image_path) and not os.path.exists(sidecar)
+    assert service.list_recipes() == []
+    assert service.load_recipe("A") is None
+    assert not service.delete_recipe("A")
+
+
+def test_delete_keeps_unrelated_current_recipe(service):
+    create(service, "A")
+    create(service, "B")
+    current = service.load_recipe("B")
+    service.set_current_recipe(current)
+
+    assert service.delete_recipe("A")
+
+    assert service.get_current_recipe() is current
+    assert service.list_recipes() == ["B"]
@@ -0,0 +1,37 @@
+"""RegionCrops: vùng cắt dạng view chỉ đọc, bounds clamp vào ảnh"""
+import numpy as np
+import pytest
+
+from app.model.template_data.region_crops import RegionCrops, clamp_region_bounds
+from app.model.template_data.template_model import CropRegion
+
+
+def test_bounds_clamped_into_image():
+    assert clamp_region_bounds(CropRegion('R', 10, 20, 30, 40), 100, 100) == (10, 20, 30, 40)
+    assert clamp_region_bounds(CropRegion('R', 90, 90, 30, 40), 100, 100) == (90, 90, 10, 10)
+    assert clamp_region_bounds(CropRegion('R', -5, 150, 30, 40), 100, 100) == (0, 99, 30, 1)
+
+
+def test_crops_are_read_only_views():
+    image = np.arange(100 * 100, dtype=np.int32).reshape(100, 100)
+    crops = RegionCrops(image, {'A': (10, 20, 30, 40)})
+
+    crop = crops['A']
+    assert crop.shape == (40, 30)
+    assert np.shares_memory(crop, image)
+    assert crop[0, 0] == image[20, 10]
+    with pytest.raises(ValueError):
+        crop[0, 0] = 0
+    # Ảnh gốc vẫn ghi được
+    image[0, 0] = -1
+
+
+def test_mapping_interface_and_copy_all():
+    image = np.zeros((50, 50), dtype=np.uint8)
+    crops = RegionCrops(image, {'A': (0, 0, 10, 10), 'B': (5, 5, 20, 20)})
+
+    assert list(crops) == ['A', 'B'] and len(crops) == 2
+    assert crops.bounds('B') == (5, 5, 20, 20)
+    copies = crops.copy_all()
+    image[:] = 255
+    assert copies['A'].max() == 0 and copies['A'].flags.writeable
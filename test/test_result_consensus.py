@@ -0,0 +1,106 @@
+"""ResultConsensus: bỏ phiếu kết quả barcode qua nhiều frame"""
+from app.model.template_data.result_consensus import ResultConsensus
+
+
+def feed(consensus, frames):
+    """Đưa lần lượt các frame, trả về các sự kiện (bỏ None)"""
+    events = []
+    for frame in frames:
+        if isinstance(frame, tuple):
+            stable = consensus.update(*frame)
+        else:
+            stable = consensus.update(frame)
+        if stable is not None:
+            events.append(stable)
+    return events
+
+
+def test_pass_emitted_once_after_min_agree_frames():
+    consensus = ResultConsensus(window=5, min_agree=3, fail_after=15)
+    frame = {'R1': ['SN1'], 'R2': ['SN2']}
+
+    assert consensus.update(frame) is None
+    assert consensus.update(frame) is None
+    stable = consensus.update(frame)
+
+    assert stable is not None and stable.passed and not stable.timed_out
+    assert stable.barcodes == {'R1': ['SN1'], 'R2': ['SN2']}
+    assert stable.confidence['R1'] == 3 / 5
+    # Cùng panel: không phát lại
+    assert feed(consensus, [frame] * 5) == []
+
+
+def test_single_misread_does_not_flicker():
+    consensus = ResultConsensus(window=5, min_agree=3)
+    feed(consensus, [{'R1': ['SN1']}] * 3)
+
+    consensus.update({'R1': ['SN1X']})
+    consensus.update({'R1': []})
+
+    assert consensus.current() == {'R1': ['SN1']}
+
+
+def test_fail_when_region_stays_empty():
+    consensus = ResultConsensus(window=3, min_agree=2, fail_after=0)
+
+    events = feed(consensus, [{'R1': ['SN1'], 'R2': []}] * 3)
+
+    assert len(events) == 1
+    assert not events[0].passed and not events[0].timed_out
+    assert events[0].barcodes == {'R1': ['SN1'], 'R2': []}
+
+
+def test_no_event_without_panel():
+    consensus = ResultConsensus(window=3, min_agree=2)
+
+    assert feed(consensus, [{'R1': [], 'R2': []}] * 10) == []
+
+
+def test_timeout_fail_when_region_never_stabilises():
+    consensus = ResultConsensus(window=5, min_agree=3, fail_after=6)
+    frames = [{'R1': ['SN1'], 'R2': [f'NOISE{i}']} for i in range(10)]
+
+    events = feed(consensus, frames)
+
+    assert len(events) == 1
+    assert events[0].timed_out and not events[0].passed
+    assert events[0].barcodes == {'R1': ['SN1'], 'R2': []}
+
+
+def test_next_panel_emits_after_empty_gap():
+    consensus = ResultConsensus(window=3, min_agree=2, fail_after=0)
+    first = feed(consensus, [{'R1': ['SN1']}] * 3)
+    feed(consensus, [{'R1': []}] * 3)
+    second = feed(consensus, [{'R1': ['SN2']}] * 3)
+
+    assert [e.barcodes for e in first + second] == [{'R1': ['SN1']}, {'R1': ['SN2']}]
+
+
+def test_abstaining_region_keeps_votes_and_others_still_vote():
+    consensus = ResultConsensus(window=3, min_agree=2, fail_after=0)
+    feed(consensus, [{'R1': ['SN1'], 'R2': ['SN2']}] * 2)
+
+    # R2 bị loại (ảnh kém) ở các frame sau: giữ giá trị ổn định, R1 vẫn được cập nhật
+    events = feed(consensus, [({'R1': ['SN3'], 'R2': []}, ['R2'])] * 3)
+
+    assert consensus.current() == {'R1': ['SN3'], 'R2': ['SN2']}
+    assert [e.barcodes for e in events] == [{'R1': ['SN3'], 'R2': ['SN2']}]
+
+
+def test_new_abstaining_region_blocks_pass():
+    consensus = ResultConsensus(window=3, min_agree=2, fail_after=0)
+
+    events = feed(consensus, [({'R1': ['SN1'], 'R2': []}, ['R2'])] * 4)
+
+    assert events == []
+    assert consensus.current() == {'R1': ['SN1'], 'R2': []}
+
+
+def test_reset_forgets_votes():
+    consensus = ResultConsensus(window=3, min_agree=2)
+    feed(consensus, [{'R1': ['SN1']}] * 2)
+
+    consensus.reset()
+
+    assert consensus.current() == {}
+    assert len(feed(consensus, [{'R1': ['SN1']}] * 2)) == 1
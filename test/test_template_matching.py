@@ -0,0 +1,117 @@
+"""TemplateMatchingService: pyramid coarse-to-fine, góc từ bank template xoay, template chuẩn bị sẵn"""
+import cv2
+import pytest
+
+from app.model.template.template_matching_service import TemplateMatchingService
+
+from conftest import move_panel, textured_panel
+
+TPL_X, TPL_Y, TPL_W, TPL_H = 200, 150, 128, 96
+
+
+@pytest.fixture
+def master():
+    return textured_panel()
+
+
+@pytest.fixture
+def template(master):
+    return master[TPL_Y:TPL_Y + TPL_H, TPL_X:TPL_X + TPL_W].copy()
+
+
+@pytest.mark.parametrize('dx, dy', [(0, 0), (7, -5), (-23, 18)])
+def test_pyramid_matches_exhaustive(master, template, dx, dy):
+    frame = move_panel(master, dx, dy)
+    pyramid = TemplateMatchingService(use_pyramid=True, angle_range=0)
+    exhaustive = TemplateMatchingService(use_pyramid=False, angle_range=0)
+
+    fast = pyramid.match_template(frame, template, TPL_X, TPL_Y)
+    full = exhaustive.match_template(frame, template, TPL_X, TPL_Y)
+
+    assert fast.success and full.success
+    assert (fast.dx, fast.dy) == (full.dx, full.dy) == (dx, dy)
+    assert fast.score == pytest.approx(full.score, abs=1e-3)
+
+
+def test_subpixel_offset(master, template):
+    frame = move_panel(master, 3.5, -2.25)
+
+    result = TemplateMatchingService(angle_range=0).match_template(frame, template, TPL_X, TPL_Y)
+
+    assert result.sub_x - TPL_X == pytest.approx(3.5, abs=0.2)
+    assert result.sub_y - TPL_Y == pytest.approx(-2.25, abs=0.2)
+
+
+def test_missing_template_fails_below_threshold(master, template):
+    other = textured_panel(seed=1)
+
+    result = TemplateMatchingService(angle_range=0).match_template(other, template, TPL_X, TPL_Y)
+
+    assert not result.success and result.score < 0.7
+
+
+def test_template_larger_than_image(template):
+    small = textured_panel(64, 64)
+
+    result = TemplateMatchingService().match_template(small, template, 0, 0)
+
+    assert not result.success and 'larger than image' in result.message
+
+
+@pytest.mark.parametrize('angle', [-3.0, 1.5, 4.0])
+def test_angle_estimated_from_rotated_bank(master, template, angle):
+    center = (TPL_X + (TPL_W - 1) / 2.0, TPL_Y + (TPL_H - 1) / 2.0)
+    frame = move_panel(master, 6, -4, angle, center)
+
+    result = TemplateMatchingService().match_template(frame, template, TPL_X, TPL_Y)
+
+    assert result.success
+    assert result.angle == pytest.approx(angle, abs=0.5)
+    assert (result.dx, result.dy) == (pytest.approx(6, abs=1), pytest.approx(-4, abs=1))
+
+
+def test_rotated_bank_built_once_per_template(master, template):
+    service = TemplateMatchingService()
+    frame = move_panel(master, 2, 2)
+
+    service.match_template(frame, template, TPL_X, TPL_Y)
+    bank = service.prepare_template(template).bank
+    service.match_template(frame, template, TPL_X, TPL_Y)
+
+    assert bank is not None and service.prepare_template(template).bank is bank
+    assert bank.angles[bank.zero_index] == 0
+    assert len(bank.angles) == 21  # ±5° bước 0.5°
+
+
+def test_prepared_template_matches_like_array(master, template):
+    service = TemplateMatchingService()
+    prepared = service.prepare_template(template)
+    # Frame BGR: chỉ cửa sổ tìm kiếm được chuyển gray
+    frame = cv2.cvtColor(move_panel(master, -9, 4), cv2.COLOR_GRAY2BGR)
+
+    from_prepared = service.match_template(frame, prepared, TPL_X, TPL_Y)
+    from_array = service.match_template(frame, template, TPL_X, TPL_Y)
+
+    assert service.prepare_template(prepared) is prepared
+    assert from_prepared.success and (from_prepared.dx, from_prepared.dy) == (-9, 4)
+    assert (from_array.dx, from_array.dy, from_array.score) == (
+        from_prepared.dx, from_prepared.dy, from_prepared.score)
+
+
+def test_prepared_cache_keyed_on_template_identity(template):
+    service = TemplateMatchingService()
+
+    prepared = service.prepare_template(template)
+
+    assert service.prepare_template(template) is prepared
+    assert service.prepare_template(template.copy()) is not prepared
+    service.clear_cache()
+    assert service.prepare_template(template) is not prepared
+
+
+def test_search_window_clipped_at_image_border(master):
+    template = master[0:TPL_H, 0:TPL_W].copy()
+
+    result = TemplateMatchingService(angle_range=0).match_template(master, template, 0, 0, search_margin=20)
+
+    assert result.success and (result.x, result.y) == (0, 0)
@@ -0,0 +1,100 @@
+"""Template plan: gộp region chồng nhau, đếm code không trùng, khóa kế hoạch theo nội dung region"""
+from app.model.template_data.template_model import CropRegion, Template
+from app.model.template_data.template_plan import (
+    distinct_code_count, group_overlapping_regions, template_fingerprint
+)
+
+
+def entry(name, x, y, w, h, symbology='qr', **geometry):
+    return CropRegion(name, x, y, w, h, symbology=symbology, **geometry), (x, y, w, h)
+
+
+def group_names(groups):
+    return [[region.name for region, _ in group] for group in groups]
+
+
+def test_separate_regions_are_not_merged():
+    groups = group_overlapping_regions([entry('A', 0, 0, 50, 50), entry('B', 100, 0, 50, 50)])
+
+    assert group_names(groups) == [['A'], ['B']]
+
+
+def test_nested_region_merged_into_outer():
+    groups = group_overlapping_regions([entry('A', 0, 0, 100, 100), entry('B', 20, 20, 30, 30)])
+
+    assert group_names(groups) == [['A', 'B']]
+
+
+def test_overlap_merged_only_when_union_is_not_larger():
+    # Union 100x50 = 5000 <= 2 * 60x50: gộp
+    merged = group_overlapping_regions([entry('A', 0, 0, 60, 50), entry('B', 40, 0, 60, 50)])
+    # Chồng ở góc: union 110x110 > 2 * 60x60, decode riêng rẻ hơn
+    corner = group_overlapping_regions([entry('A', 0, 0, 60, 60), entry('B', 50, 50, 60, 60)])
+
+    assert group_names(merged) == [['A', 'B']]
+    assert group_names(corner) == [['A'], ['B']]
+
+
+def test_different_symbologies_never_merged():
+    groups = group_overlapping_regions([entry('A', 0, 0, 100, 100),
+                                        entry('B', 20, 20, 30, 30, symbology='datamatrix')])
+
+    assert group_names(groups) == [['A'], ['B']]
+
+
+def test_chain_of_overlaps_merges_transitively():
+    groups = group_overlapping_regions([entry('A', 0, 0, 60, 50), entry('C', 200, 0, 50, 50),
+                                        entry('B', 40, 0, 60, 50), entry('D', 80, 0, 60, 50)])
+
+    assert group_names(groups) == [['A', 'B', 'D'], ['C']]
+
+
+def test_distinct_count_dedupes_shared_code_rects():
+    members = [
+        entry('A', 0, 0, 60, 50, expected_count=2, code_rects=[[5, 5, 20, 20], [45, 5, 20, 20]]),
+        entry('B', 40, 0, 60, 50, expected_count=2, code_rects=[[45, 5, 20, 20], [75, 5, 20, 20]]),
+    ]
+
+    assert distinct_code_count(members) == 3
+
+
+def test_distinct_count_without_rects_skips_nested_members():
+    members = [
+        entry('A', 0, 0, 100, 100, expected_count=3),
+        entry('B', 20, 20, 30, 30, expected_count=1),
+        entry('C', 50, 0, 100, 100, expected_count=2),
+    ]
+
+    assert distinct_code_count(members) == 5
+
+
+def test_distinct_count_identical_bounds_counted_once():
+    members = [entry('A', 0, 0, 50, 50, expected_count=1), entry('B', 0, 0, 50, 50, expected_count=1)]
+
+    assert distinct_code_count(members) == 1
+
+
+def test_fingerprint_follows_region_content_not_identity():
+    template = Template(name='T', crop_regions=[CropRegion('A', 0, 0, 50, 50)])
+    same = Template(name='T', crop_regions=[CropRegion('A', 0, 0, 50, 50)])
+
+    assert template_fingerprint(template) == template_fingerprint(same)
+    hash(template_fingerprint(template))
+
+    same.crop_regions[0].code_rects = [[5, 5, 20, 20]]
+    assert template_fingerprint(template) != template_fingerprint(same)
+
+
+def test_service_recompiles_plan_when_region_edited(template_service):
+    service = template_service
+    template = Template(name='T', crop_regions=[CropRegion('A', 0, 0, 50, 50, symbology='qr')])
+
+    plan = service._get_plan(template, 640, 480)
+    assert service._get_plan(template, 640, 480) is plan
+    assert service._get_plan(template, 800, 600) is not plan
+
+    plan = service._get_plan(template, 640, 480)
+    template.crop_regions[0].width = 80
+    edited = service._get_plan(template, 640, 480)
+    assert edited is not plan
+    assert edited.crop_bounds['A'] == (0, 0, 80, 50)
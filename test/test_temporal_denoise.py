@@ -0,0 +1,80 @@
+"""Temporal denoise: trung bình N frame thay NLM khi streaming"""
+import numpy as np
+
+from app.model.template_data.preprocess_workspace import PreprocessWorkspace
+from app.model.template_data.temporal_denoise import (
+    TEMPORAL_MAX_FRAMES, TemporalAverager, temporal_frame_count
+)
+
+from conftest import render_qr
+
+
+def noisy_frames(base, count, sigma=8.0, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        noise = rng.normal(0.0, sigma, base.shape)
+        yield np.clip(base.astype(np.float64) + noise, 0, 255).astype(np.uint8)
+
+
+def test_frame_count_clamped():
+    assert temporal_frame_count(0) == 2
+    assert temporal_frame_count(4) == 4
+    assert temporal_frame_count(10_000) == TEMPORAL_MAX_FRAMES
+
+
+def test_rounded_average_of_last_frames():
+    averager = TemporalAverager(3)
+    frames = [np.full((16, 16), value, dtype=np.uint8) for value in (100, 101, 104, 104)]
+
+    assert averager.push(frames[0]) is None
+    assert averager.push(frames[1])[0, 0] == 101  # (100 + 101) / 2 = 100.5 -> 101
+    assert averager.push(frames[2])[0, 0] == 102
+    # Ring đầy: frame 100 bị bỏ
+    assert averager.push(frames[3])[0, 0] == 103
+    assert averager.count == 3
+
+
+def test_average_reduces_sensor_noise():
+    base = render_qr("PANEL-123") // 2 + 64
+    averager = TemporalAverager(8)
+    average = None
+    frames = list(noisy_frames(base, 8))
+    for frame in frames:
+        average = averager.push(frame)
+
+    single_error = np.abs(frames[-1].astype(int) - base).mean()
+    average_error = np.abs(average.astype(int) - base).mean()
+    assert average_error < 0.5 * single_error
+
+
+def test_scene_change_drops_history():
+    averager = TemporalAverager(4)
+    averager.push(np.full((64, 64), 50, dtype=np.uint8))
+    averager.push(np.full((64, 64), 50, dtype=np.uint8))
+
+    assert averager.push(np.full((64, 64), 150, dtype=np.uint8)) is None
+    assert averager.count == 1
+    assert averager.push(np.full((64, 64), 150, dtype=np.uint8))[0, 0] == 150
+
+
+def test_workspace_uses_average_instead_of_nlm():
+    workspace = PreprocessWorkspace(64, 64)
+    frame = np.full((64, 64), 120, dtype=np.uint8)
+
+    workspace.load(frame, temporal_frames=4, sequence=1)
+    assert 'nlm' in workspace.method_stages(2)
+    workspace.load(frame, temporal_frames=4, sequence=2)
+    assert workspace.method_stages(2)[0] == 'temporal'
+    # Temporal: 2 và 6 cùng chuỗi stage
+    assert workspace.distinct_methods((2, 6, 7)) == (2, 7)
+
+
+def test_workspace_skipped_frame_resets_history():
+    workspace = PreprocessWorkspace(64, 64)
+    frame = np.full((64, 64), 120, dtype=np.uint8)
+    workspace.load(frame, temporal_frames=4, sequence=1)
+    workspace.load(frame, temporal_frames=4, sequence=2)
+
+    workspace.load(frame, temporal_frames=4, sequence=5)
+
+    assert 'nlm' in workspace.method_stages(2)